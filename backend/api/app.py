@@ -1,12 +1,21 @@
 """FastApi application for the chatbot"""
 
-from fastapi import FastAPI, Depends
+import json
+from typing import Optional
+
+from fastapi import FastAPI, Depends, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from contextlib import asynccontextmanager
 
 from config import get_settings, Settings
 from chat.manager import ChatManager
-from .models import ChatRequest, ChatResponse
+from common.metrics import render_metrics, PROMETHEUS_CONTENT_TYPE
+from common.objects import InvalidCursorError
+from common.tracing import shutdown_trace_exporter
+from memory.engines import dispose_engines
+from memory.mongo_clients import close_mongo_clients
+from .models import BatchChatRequest, BatchChatResult, ChatRequest, ChatResponse, MessagesResponse
 
 @asynccontextmanager
 async def lifespan(app:FastAPI):
@@ -20,6 +29,9 @@ async def lifespan(app:FastAPI):
 
     #shutdown: close resources
     app.state.chat_manager.close()
+    shutdown_trace_exporter()
+    dispose_engines()
+    close_mongo_clients()
 
 def create_app() -> FastAPI:
     """Create the fastAPI application
@@ -67,6 +79,25 @@ def create_app() -> FastAPI:
             conversation_id=conversation_id
         )
     
+    @app.post("/chat/batch")
+    async def chat_batch(request: BatchChatRequest):
+        """Process many independent chat messages with bounded concurrency.
+
+        Args:
+            request: Messages and the maximum number generated at once.
+
+        Returns:
+            Streaming NDJSON response, one result per line in completion order.
+        """
+        items = [(item.input, item.conversation_id or "default") for item in request.items]
+        results = app.state.chat_manager.process_batch(items, max_concurrency=request.max_concurrency)
+
+        async def lines():
+            async for result in results:
+                yield BatchChatResult(**result).model_dump_json() + "\n"
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
     @app.post("/clear/{conversation_id}")
     async def clear_history(conversation_id: str):
         """Clear the conversation history.
@@ -77,12 +108,47 @@ def create_app() -> FastAPI:
         Returns:
             Status message.
         """
-        app.state.chat_manager.clear_history(conversation_id)
+        try:
+            app.state.chat_manager.clear_history(conversation_id)
+        except TimeoutError as e:
+            raise HTTPException(status_code=503, detail=str(e))
         return {
             "status": "success",
             "message": f"History for conversation {conversation_id} cleared"
         }
     
+    @app.get("/conversations/{conversation_id}/messages", response_model=MessagesResponse)
+    def get_messages(conversation_id: str, cursor: Optional[str] = None, limit: int = Query(50, ge=1, le=1000)):
+        """Read back one page of a conversation.
+
+        Args:
+            conversation_id: ID of the conversation.
+            cursor: Cursor returned with the previous page.
+            limit: Maximum number of message pairs.
+
+        Returns:
+            Message pairs and the cursor of the next page.
+        """
+        try:
+            messages, next_cursor = app.state.chat_manager.get_messages(conversation_id, cursor=cursor, limit=limit)
+        except InvalidCursorError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return MessagesResponse(messages=messages, next_cursor=next_cursor)
+
+    @app.get("/conversations/{conversation_id}/messages/export")
+    def export_messages(conversation_id: str):
+        """Stream a whole conversation as NDJSON, one message pair per line.
+
+        Args:
+            conversation_id: ID of the conversation.
+
+        Returns:
+            Streaming NDJSON response.
+        """
+        messages = app.state.chat_manager.iter_messages(conversation_id)
+        lines = (json.dumps(message, default=str, ensure_ascii=False) + "\n" for message in messages)
+        return StreamingResponse(lines, media_type="application/x-ndjson")
+
     @app.get("/health")
     async def health_check():
         """Health check endpoint.
@@ -91,5 +157,14 @@ def create_app() -> FastAPI:
             Status message.
         """
         return {"status": "healthy"}
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def metrics():
+        """Prometheus metrics endpoint.
+
+        Returns:
+            Metrics in Prometheus text format.
+        """
+        return PlainTextResponse(render_metrics(), media_type=PROMETHEUS_CONTENT_TYPE)
     
     return app 
\ No newline at end of file
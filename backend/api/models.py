@@ -1,5 +1,5 @@
 """API models for chatbot requests and responses."""
-from typing import Optional
+from typing import Any, Dict, List, Optional
 from pydantic import BaseModel, Field
 
 
@@ -10,8 +10,31 @@ class ChatRequest(BaseModel):
     conversation_id: Optional[str] = Field(default="default", description="Conversation ID")
 
 
+class BatchChatRequest(BaseModel):
+    """Batch chat request model."""
+    
+    items: List[ChatRequest] = Field(..., description="Independent messages, answered concurrently")
+    max_concurrency: Optional[int] = Field(default=None, ge=1, description="Messages generated at once")
+
+
+class BatchChatResult(BaseModel):
+    """Result of one message of a batch."""
+    
+    index: int = Field(..., description="Position of the message in the batch")
+    conversation_id: str = Field(..., description="Conversation ID")
+    output: Optional[str] = Field(default=None, description="AI response, None when the message failed")
+    error: Optional[str] = Field(default=None, description="Error of a failed message")
+
+
 class ChatResponse(BaseModel):
     """Chat response model."""
     
     output: str = Field(..., description="AI response")
-    conversation_id: str = Field(..., description="Conversation ID") 
\ No newline at end of file
+    conversation_id: str = Field(..., description="Conversation ID") 
+
+
+class MessagesResponse(BaseModel):
+    """One page of a conversation's history."""
+    
+    messages: List[Dict[str, Any]] = Field(..., description="Message pairs, oldest first")
+    next_cursor: Optional[str] = Field(default=None, description="Cursor of the next page, None on the last page")
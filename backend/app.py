@@ -1,28 +1,76 @@
+import json
 import os
 import uvicorn
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import FastAPI, HTTPException, Query, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
 from langserve import add_routes
 from operator import itemgetter
 from langchain_core.runnables import RunnableLambda
 
 from bot import Bot
+from registry import BotRegistry, BotSpec, DEFAULT_BOT_ID
+from session import ChatSession
 from models import ModelTypes
 from memory import MemoryTypes
-from common.objects import ChatRequest
+from common.objects import ChatRequest, InvalidCursorError, MessagePage
+from common.metrics import render_metrics, PROMETHEUS_CONTENT_TYPE
+from common.tracing import shutdown_trace_exporter
+from memory.engines import dispose_engines
+from tools import shutdown_tool_executors
+from memory.mongo_clients import close_mongo_clients
 
 # Load environment variables
 load_dotenv()
 
-# Initialize the bot with the desired configuration
-bot = Bot(memory=MemoryTypes.POSTGRES_MEMORY, model=ModelTypes.GROQ, tools=[], model_kwargs={'model_name': 'groq/compound'})
+# Bots are hosted per tenant, BOTS_CONFIG may point to a JSON list of bot specs
+bots_config = os.getenv("BOTS_CONFIG")
+registry = BotRegistry.from_file(bots_config) if bots_config else BotRegistry()
+if DEFAULT_BOT_ID not in registry.bot_ids:
+    registry.register(BotSpec(
+        bot_id=DEFAULT_BOT_ID,
+        memory=MemoryTypes.POSTGRES_MEMORY,
+        model=ModelTypes.GROQ,
+        tools=[],
+        model_kwargs={'model_name': 'groq/compound'}
+    ))
+# Bots are built on their first request, serve.py builds them all in the master before forking workers
+
+
+def get_bot(bot_id: Optional[str]) -> Bot:
+    """Bot of a tenant, an unknown bot id is a 404 rather than a 500"""
+    try:
+        return registry.get(bot_id)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]) if e.args else f"Unknown bot id: {bot_id}")
+
+
+def route(input: dict):
+    """Send the request to the bot of its tenant"""
+    return get_bot(input.get("bot_id")).call({
+        "sentence": input["sentence"],
+        "conversation_id": input["conversation_id"]
+    })
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Flush traces still buffered by the background exporter
+    shutdown_trace_exporter()
+    registry.close()
+    shutdown_tool_executors()
+    dispose_engines()
+    close_mongo_clients()
 
 # Create the FastAPI app
 app = FastAPI(
     title="Chatbot App",
     description="Modern chatbot built with LangChain and LangSmith",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -40,8 +88,9 @@ add_routes(
     app,
     {
         "sentence": itemgetter("input"),
-        "conversation_id": itemgetter("conversation_id")
-    } | RunnableLambda(bot.call),
+        "conversation_id": itemgetter("conversation_id"),
+        "bot_id": RunnableLambda(lambda x: x.get("bot_id"))
+    } | RunnableLambda(route),
     path="/chat",
     input_type=ChatRequest
 )
@@ -51,12 +100,72 @@ add_routes(
 async def health_check():
     return {"status": "healthy"}
 
+# Add Prometheus metrics endpoint
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type=PROMETHEUS_CONTENT_TYPE)
+
 # Add clear history endpoint
 @app.post("/clear/{conversation_id}")
-async def clear_history(conversation_id: str):
-    bot.reset_history(conversation_id=conversation_id)
+async def clear_history(conversation_id: str, bot_id: Optional[str] = None):
+    try:
+        get_bot(bot_id).reset_history(conversation_id=conversation_id)
+    except TimeoutError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     return {"status": "success", "message": f"History for conversation {conversation_id} cleared"}
 
+# Add paginated history endpoint
+@app.get("/conversations/{conversation_id}/messages", response_model=MessagePage)
+def get_messages(conversation_id: str, cursor: Optional[str] = None, limit: int = Query(50, ge=1, le=1000),
+                 bot_id: Optional[str] = None):
+    try:
+        return get_bot(bot_id).get_messages(conversation_id, cursor=cursor, limit=limit)
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except NotImplementedError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+
+# Add NDJSON export endpoint, streamed from a server-side cursor
+@app.get("/conversations/{conversation_id}/messages/export")
+def export_messages(conversation_id: str, bot_id: Optional[str] = None):
+    try:
+        messages = get_bot(bot_id).iter_messages(conversation_id)
+    except NotImplementedError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    lines = (json.dumps(message, default=str, ensure_ascii=False) + "\n" for message in messages)
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
+# Add WebSocket chat, one connection per conversation with its history kept in the session
+@app.websocket("/ws/chat/{conversation_id}")
+async def chat_socket(websocket: WebSocket, conversation_id: str, bot_id: Optional[str] = None):
+    await websocket.accept()
+    try:
+        chat_bot = get_bot(bot_id)
+    except HTTPException as e:
+        # Application close codes mirror the HTTP status, 4404 for an unknown bot
+        await websocket.close(code=4000 + e.status_code, reason=e.detail)
+        return
+    async with ChatSession(chat_bot, conversation_id) as session:
+        try:
+            while True:
+                frame = await websocket.receive_text()
+                try:
+                    sentence = json.loads(frame)["input"]
+                except (ValueError, TypeError, KeyError):
+                    sentence = frame
+                try:
+                    chunks = []
+                    async for chunk in session.stream(sentence):
+                        chunks.append(chunk)
+                        await websocket.send_json({"type": "token", "content": chunk})
+                    await websocket.send_json({"type": "end", "output": "".join(chunks)})
+                except WebSocketDisconnect:
+                    raise
+                except Exception as e:
+                    await websocket.send_json({"type": "error", "detail": str(e)})
+        except WebSocketDisconnect:
+            pass
+
 if __name__ == "__main__":
     port = int(os.getenv("PORT", "8081"))
     uvicorn.run(app, host="0.0.0.0", port=port)
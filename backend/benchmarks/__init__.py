@@ -0,0 +1 @@
+"""Benchmarks with a stubbed LLM and local stand-ins for the storage backends."""
@@ -0,0 +1,136 @@
+"""
+Compare the embedding backends: import + load time, RSS, encodes per second and how close their vectors are
+to the SentenceTransformer ones already stored. Each backend is measured in a fresh subprocess so load time and
+RSS are not shared. The onnx backends need the exported model, see memory/embeddings.py.
+
+Run from the backend directory:
+    python -m benchmarks.embeddings --sentences 512 --output embedding_results.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+import numpy as np
+
+from memory.embeddings import EmbeddingBackends
+
+WORDS = ("the user asked about the weather in hanoi and the assistant suggested an umbrella for the rainy "
+         "afternoon then they talked about booking a flight to saigon next week with a window seat").split()
+
+
+def sample_sentences(count: int, seed: int = 0) -> List[str]:
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(5, 60, count)
+    return [" ".join(rng.choice(WORDS, length)) for length in lengths]
+
+
+def _rss() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def measure(backend: str, model_dir: str, sentences: List[str], batch_sizes: List[int], seconds: float,
+            vectors_path: str) -> Dict[str, Any]:
+    """Runs in the worker subprocess"""
+    rss_before = _rss()
+    start = time.perf_counter()
+    from memory.embeddings import load_embedder
+    embedder = load_embedder(backend, model_dir)
+    embedder.encode(sentences[:1])
+    load_seconds = time.perf_counter() - start
+    rss_loaded = _rss()
+
+    throughput = {}
+    for batch_size in batch_sizes:
+        encoded = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            offset = encoded % len(sentences)
+            batch = (sentences[offset:] + sentences)[:batch_size]
+            embedder.encode(batch, batch_size=batch_size)
+            encoded += len(batch)
+        throughput[str(batch_size)] = encoded / (time.perf_counter() - start)
+
+    np.save(vectors_path, np.asarray(embedder.encode(sentences, batch_size=32), dtype=np.float32))
+    return {
+        "backend": backend,
+        "load_seconds": load_seconds,
+        "rss_loaded_bytes": rss_loaded,
+        "rss_model_bytes": rss_loaded - rss_before,
+        "rss_after_bytes": _rss(),
+        "encodes_per_second": throughput,
+    }
+
+
+def run_backend(backend: str, args, workdir: str) -> Dict[str, Any]:
+    vectors_path = os.path.join(workdir, f"{backend}.npy")
+    command = [sys.executable, "-m", "benchmarks.embeddings", "--worker", backend, "--vectors", vectors_path,
+               "--sentences", str(args.sentences), "--seconds", str(args.seconds),
+               "--model-dir", args.model_dir, "--batch-sizes", *map(str, args.batch_sizes)]
+    completed = subprocess.run(command, capture_output=True, text=True, check=True)
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result["vectors_path"] = vectors_path
+    return result
+
+
+def parse_args(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Benchmark the sentence embedding backends")
+    parser.add_argument("--backends", nargs="+", default=[b.value for b in EmbeddingBackends],
+                        choices=[b.value for b in EmbeddingBackends])
+    parser.add_argument("--model-dir", default="models/all-MiniLM-L6-v2-onnx")
+    parser.add_argument("--sentences", type=int, default=512)
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 32])
+    parser.add_argument("--seconds", type=float, default=5, help="Encoding time per batch size")
+    parser.add_argument("--output", default="embedding_results.json")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--vectors", default=None, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str] = None):
+    args = parse_args(argv)
+    sentences = sample_sentences(args.sentences)
+    if args.worker is not None:
+        print(json.dumps(measure(args.worker, args.model_dir, sentences, args.batch_sizes, args.seconds,
+                                 args.vectors)))
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="embedding-bench-") as workdir:
+        for backend in args.backends:
+            results.append(run_backend(backend, args, workdir))
+        # Agreement with the vectors of the reference backend, stored rows were written with it
+        reference = next((r for r in results if r["backend"] == EmbeddingBackends.SENTENCE_TRANSFORMERS), None)
+        reference_vectors = np.load(reference["vectors_path"]) if reference else None
+        for result in results:
+            if reference_vectors is not None:
+                cosines = (np.load(result["vectors_path"]) * reference_vectors).sum(axis=1)
+                result["cosine_to_reference"] = {"mean": float(cosines.mean()), "min": float(cosines.min())}
+            del result["vectors_path"]
+            rates = ", ".join(f"b{size}={rate:8.1f}/s" for size, rate in result["encodes_per_second"].items())
+            agreement = result.get("cosine_to_reference", {})
+            print(
+                f"{result['backend']:<22} load={result['load_seconds']:6.2f}s "
+                f"rss={result['rss_loaded_bytes'] / 1024 / 1024:7.1f}MiB "
+                f"(+{result['rss_model_bytes'] / 1024 / 1024:6.1f}MiB) {rates} "
+                f"cos_min={agreement.get('min', float('nan')):.4f}"
+            )
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("worker", "vectors")},
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
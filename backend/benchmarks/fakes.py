@@ -0,0 +1,466 @@
+"""Local stand-ins for the LLM, embedder, search and storage backends used by the benchmarks."""
+import asyncio
+import copy
+import fnmatch
+import hashlib
+import itertools
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain_core.chat_history import InMemoryChatMessageHistory
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from pymongo import InsertOne, UpdateOne
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model answering with a fixed response after `latency` + generated tokens / `tokens_per_second`"""
+    response: str = "Final Answer: This is a benchmark response from the fake chat model."
+    latency: float = 0.2
+    tokens_per_second: float = 50
+    return_messages: bool = True
+    # Never hit the process-wide LLM cache, every call must pay the simulated latency
+    cache: Optional[bool] = False
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def _delay(self) -> float:
+        tokens = len(self.response.split())
+        return self.latency + (tokens / self.tokens_per_second if self.tokens_per_second else 0)
+
+    def _result(self) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.response))])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                  **kwargs: Any) -> ChatResult:
+        time.sleep(self._delay())
+        return self._result()
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                         **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self._delay())
+        return self._result()
+
+
+class FakeEmbedder:
+    """Deterministic hash based embedder with the same interface as SentenceTransformer.encode"""
+
+    def __init__(self, dimension: int = 384, latency: float = 0.005):
+        self.dimension = dimension
+        self.latency = latency
+
+    def encode(self, text, **kwargs):
+        time.sleep(self.latency)
+        texts = [text] if isinstance(text, str) else list(text)
+        vectors = []
+        for item in texts:
+            seed = int.from_bytes(hashlib.sha256(item.encode()).digest()[:4], "little")
+            vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+            vectors.append(vector / np.linalg.norm(vector))
+        return vectors[0] if isinstance(text, str) else np.stack(vectors)
+
+
+class FakeSearchTransport:
+    """Search transport returning canned results after a fixed latency"""
+
+    def __init__(self, latency: float = 0.3):
+        self.latency = latency
+
+    def search(self, query: str, max_results: int) -> List[Dict[str, Any]]:
+        time.sleep(self.latency)
+        return [
+            {"title": f"Result {i} for {query}", "body": "Benchmark snippet.", "href": f"https://example.com/{i}"}
+            for i in range(max_results)
+        ]
+
+
+class InMemoryMongoChatMessageHistory(InMemoryChatMessageHistory):
+    """Accepts the MongoDBChatMessageHistory constructor arguments and keeps messages in process"""
+
+    def __init__(self, connection_string: str = None, session_id: str = None, database_name: str = None,
+                 collection_name: str = None, **kwargs):
+        super().__init__()
+
+
+def _get_path(document: dict, path: str):
+    value = document
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def _matches(document: dict, query: dict) -> bool:
+    for key, expected in (query or {}).items():
+        value = _get_path(document, key)
+        if isinstance(expected, dict) and any(k.startswith("$") for k in expected):
+            for op, operand in expected.items():
+                if op == "$gt" and not (value is not None and value > operand):
+                    return False
+                if op == "$gte" and not (value is not None and value >= operand):
+                    return False
+                if op == "$lt" and not (value is not None and value < operand):
+                    return False
+                if op == "$lte" and not (value is not None and value <= operand):
+                    return False
+                if op == "$in" and value not in operand:
+                    return False
+                if op == "$exists" and (value is not None) != bool(operand):
+                    return False
+        elif value != expected:
+            return False
+    return True
+
+
+def _project(document: dict, projection: Optional[dict]) -> dict:
+    if not projection:
+        return copy.deepcopy(document)
+    included = [k for k, v in projection.items() if v and k != "_id"]
+    if included:
+        result = {k: copy.deepcopy(document[k]) for k in included if k in document}
+        if projection.get("_id", 1) and "_id" in document:
+            result["_id"] = document["_id"]
+        return result
+    return {k: copy.deepcopy(v) for k, v in document.items() if projection.get(k, 1)}
+
+
+class InMemoryCursor:
+    def __init__(self, documents: List[dict], projection: Optional[dict] = None):
+        self._documents = documents
+        self._projection = projection
+        self._limit = 0
+        self._skip = 0
+
+    def sort(self, key, direction: int = 1):
+        keys = key if isinstance(key, list) else [(key, direction)]
+        for name, order in reversed(keys):
+            self._documents.sort(key=lambda d: (_get_path(d, name) is None, _get_path(d, name)), reverse=order < 0)
+        return self
+
+    def skip(self, count: int):
+        self._skip = count
+        return self
+
+    def limit(self, count: int):
+        self._limit = count
+        return self
+
+    def batch_size(self, size: int):
+        return self
+
+    def __iter__(self):
+        documents = self._documents[self._skip:]
+        if self._limit:
+            documents = documents[:self._limit]
+        return iter([_project(d, self._projection) for d in documents])
+
+    def close(self):
+        pass
+
+
+class InMemoryResult:
+    def __init__(self, deleted_count: int = 0, modified_count: int = 0, inserted_id: Any = None):
+        self.deleted_count = deleted_count
+        self.modified_count = modified_count
+        self.inserted_id = inserted_id
+
+
+class InMemoryCollection:
+    """Subset of pymongo's Collection used by the chatbot"""
+
+    def __init__(self, name: str = "collection"):
+        self.name = name
+        self._documents: List[dict] = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def create_index(self, keys, **kwargs):
+        return keys if isinstance(keys, str) else "_".join(f"{k}_{v}" for k, v in keys)
+
+    def insert_one(self, document: dict):
+        with self._lock:
+            document.setdefault("_id", next(self._ids))
+            self._documents.append(copy.deepcopy(document))
+        return InMemoryResult(inserted_id=document["_id"])
+
+    def insert_many(self, documents: List[dict], **kwargs):
+        for document in documents:
+            self.insert_one(document)
+
+    def find(self, query: dict = None, projection: dict = None, **kwargs):
+        with self._lock:
+            documents = [d for d in self._documents if _matches(d, query)]
+        return InMemoryCursor(documents, projection)
+
+    def find_one(self, query: dict = None, projection: dict = None, sort=None, **kwargs):
+        cursor = self.find(query, projection)
+        if sort is not None:
+            cursor.sort(sort)
+        return next(iter(cursor), None)
+
+    def _update(self, query: dict, update: dict, upsert: bool) -> Optional[dict]:
+        document = next((d for d in self._documents if _matches(d, query)), None)
+        inserted = document is None
+        if inserted:
+            if not upsert:
+                return None
+            document = {k: v for k, v in query.items() if not isinstance(v, dict)}
+            document["_id"] = next(self._ids)
+            self._documents.append(document)
+        for key, value in update.get("$set", {}).items():
+            document[key] = copy.deepcopy(value)
+        for key, value in update.get("$setOnInsert", {}).items() if inserted else ():
+            document[key] = copy.deepcopy(value)
+        for key, value in update.get("$inc", {}).items():
+            document[key] = document.get(key, 0) + value
+        for key, value in update.get("$push", {}).items():
+            if isinstance(value, dict) and "$each" in value:
+                document.setdefault(key, []).extend(copy.deepcopy(value["$each"]))
+            else:
+                document.setdefault(key, []).append(copy.deepcopy(value))
+        for key, value in update.get("$max", {}).items():
+            document[key] = max(document.get(key, value), value)
+        for key in update.get("$unset", {}):
+            document.pop(key, None)
+        return document
+
+    def update_one(self, query: dict, update: dict, upsert: bool = False):
+        with self._lock:
+            document = self._update(query, update, upsert)
+        return InMemoryResult(modified_count=int(document is not None))
+
+    def find_one_and_update(self, query: dict, update: dict, projection: dict = None, upsert: bool = False,
+                            return_document: bool = False, **kwargs):
+        with self._lock:
+            before = next((copy.deepcopy(d) for d in self._documents if _matches(d, query)), None)
+            document = self._update(query, update, upsert)
+            result = document if return_document else before
+            return _project(result, projection) if result is not None else None
+
+    def bulk_write(self, requests: List[Any], ordered: bool = True, **kwargs):
+        """InsertOne and UpdateOne requests, applied in order under one lock"""
+        modified = 0
+        with self._lock:
+            for request in requests:
+                if isinstance(request, InsertOne):
+                    document = copy.deepcopy(request._doc)
+                    document.setdefault("_id", next(self._ids))
+                    self._documents.append(document)
+                elif isinstance(request, UpdateOne):
+                    modified += self._update(request._filter, request._doc, request._upsert) is not None
+                else:
+                    raise NotImplementedError(f"Got unsupported bulk request: {type(request).__name__}")
+        return InMemoryResult(modified_count=modified)
+
+    def delete_many(self, query: dict):
+        with self._lock:
+            before = len(self._documents)
+            self._documents = [d for d in self._documents if not _matches(d, query)]
+            return InMemoryResult(deleted_count=before - len(self._documents))
+
+    def count_documents(self, query: dict):
+        return len(self.find(query)._documents)
+
+
+class InMemoryDatabase(dict):
+    def __missing__(self, name: str):
+        collection = self[name] = InMemoryCollection(name)
+        return collection
+
+
+class InMemoryMongoClient(dict):
+    """Subset of pymongo's MongoClient used by the chatbot"""
+
+    def __missing__(self, name: str):
+        database = self[name] = InMemoryDatabase()
+        return database
+
+    def close(self):
+        pass
+
+
+class InMemoryRedis:
+    """Subset of redis-py's client used by the chatbot, with decode_responses=True semantics"""
+
+    def __init__(self):
+        self._data: Dict[str, Any] = {}
+        self._expiry: Dict[str, float] = {}
+        self._lock = threading.RLock()
+
+    def _expire_if_needed(self, key: str):
+        expires_at = self._expiry.get(key)
+        if expires_at is not None and expires_at < time.monotonic():
+            self._data.pop(key, None)
+            self._expiry.pop(key, None)
+
+    def _get(self, key: str, default_factory=None):
+        self._expire_if_needed(key)
+        if key not in self._data and default_factory is not None:
+            self._data[key] = default_factory()
+        return self._data.get(key)
+
+    def rpush(self, key: str, *values):
+        with self._lock:
+            items = self._get(key, list)
+            items.extend(values)
+            return len(items)
+
+    def lrange(self, key: str, start: int, end: int):
+        with self._lock:
+            items = self._get(key) or []
+            length = len(items)
+            start = max(length + start, 0) if start < 0 else start
+            end = length + end if end < 0 else end
+            return list(items[start:end + 1])
+
+    def llen(self, key: str):
+        with self._lock:
+            return len(self._get(key) or [])
+
+    def ltrim(self, key: str, start: int, end: int):
+        with self._lock:
+            items = self._get(key)
+            if items is not None:
+                self._data[key] = self.lrange(key, start, end)
+            return True
+
+    def sadd(self, key: str, *members):
+        with self._lock:
+            members_set = self._get(key, set)
+            before = len(members_set)
+            members_set.update(members)
+            return len(members_set) - before
+
+    def srem(self, key: str, *members):
+        with self._lock:
+            members_set = self._get(key) or set()
+            before = len(members_set)
+            members_set.difference_update(members)
+            return before - len(members_set)
+
+    def smembers(self, key: str):
+        with self._lock:
+            return set(self._get(key) or set())
+
+    def sscan_iter(self, key: str, match: str = None, count: int = None):
+        for member in self.smembers(key):
+            if match is None or fnmatch.fnmatchcase(member, match):
+                yield member
+
+    def get(self, key: str):
+        with self._lock:
+            return self._get(key)
+
+    def set(self, key: str, value, ex: int = None):
+        with self._lock:
+            self._data[key] = value
+            self._expiry.pop(key, None)
+            if ex:
+                self._expiry[key] = time.monotonic() + ex
+            return True
+
+    def exists(self, *keys):
+        with self._lock:
+            return sum(1 for key in keys if self._get(key) is not None)
+
+    def expire(self, key: str, seconds: int):
+        with self._lock:
+            if self._get(key) is None:
+                return False
+            self._expiry[key] = time.monotonic() + seconds
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            deleted = 0
+            for key in keys:
+                self._expire_if_needed(key)
+                if self._data.pop(key, None) is not None:
+                    deleted += 1
+                self._expiry.pop(key, None)
+            return deleted
+
+    unlink = delete
+
+    def rename(self, src: str, dst: str):
+        with self._lock:
+            self._data[dst] = self._data.pop(src)
+            if src in self._expiry:
+                self._expiry[dst] = self._expiry.pop(src)
+            return True
+
+    def renamenx(self, src: str, dst: str):
+        with self._lock:
+            if self._get(dst) is not None:
+                return False
+            self._get(src)
+            self._expiry.pop(dst, None)
+            return self.rename(src, dst)
+
+    def type(self, key: str):
+        with self._lock:
+            value = self._get(key)
+            if value is None:
+                return "none"
+            return {list: "list", set: "set"}.get(value.__class__, "string")
+
+    def lindex(self, key: str, index: int):
+        with self._lock:
+            items = self._get(key) or []
+            return items[index] if -len(items) <= index < len(items) else None
+
+    def ttl(self, key: str):
+        with self._lock:
+            if self._get(key) is None:
+                return -2
+            expires_at = self._expiry.get(key)
+            return -1 if expires_at is None else int(expires_at - time.monotonic())
+
+    def keys(self, pattern: str = "*"):
+        with self._lock:
+            for key in list(self._data):
+                self._expire_if_needed(key)
+            return [key for key in self._data if fnmatch.fnmatchcase(key, pattern)]
+
+    def scan_iter(self, match: str = "*", count: int = None):
+        yield from self.keys(match)
+
+    def pipeline(self, transaction: bool = True):
+        return InMemoryRedisPipeline(self)
+
+    def close(self):
+        pass
+
+
+class InMemoryRedisPipeline:
+    """Buffers commands and runs them against InMemoryRedis on execute()"""
+
+    def __init__(self, client: InMemoryRedis):
+        self._client = client
+        self._commands = []
+
+    def __getattr__(self, name: str):
+        method = getattr(self._client, name)
+
+        def queue(*args, **kwargs):
+            self._commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        with self._client._lock:
+            results = [method(*args, **kwargs) for method, args, kwargs in self._commands]
+        self._commands = []
+        return results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._commands = []
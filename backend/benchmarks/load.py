@@ -0,0 +1,365 @@
+"""
+Load generator for the /chat endpoints of app.py (bot target, LangServe /chat/invoke) and api/app.py (api target).
+
+Virtual users hold multi-turn conversations: the number of turns is geometric around --turns-mean, message
+lengths are log-normal around --words-median and users think between turns. In closed-loop mode --concurrency
+users send their next message once the previous answer is back. In open-loop mode new conversations arrive as
+a Poisson process of --rate per second whatever the response times, so queueing shows up in the latencies.
+Concurrency or rate ramps up linearly over --ramp seconds, then holds for --duration; several values run as
+successive steps.
+
+The app is served in process through httpx's ASGI transport, or over HTTP with --url. In process the app is
+imported with its environment, --fake-llm answers with the benchmark fake model and in-memory Mongo instead:
+on the bot target a bot built on them is hosted by the registry, and the configured bots, built on their
+first request, are not built at all. A step where every request fails stops the run, which exits non-zero
+after writing the steps done so far.
+
+Run from the backend directory:
+    python -m benchmarks.load --target api --fake-llm --concurrency 8 32 128 --ramp 10 --duration 30
+    python -m benchmarks.load --target bot --url http://localhost:8080 --mode open --rate 5 20
+"""
+import argparse
+import asyncio
+import json
+import math
+import platform
+import random
+import tempfile
+import time
+import uuid
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextlib import AsyncExitStack
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from common.metrics import DEFAULT_BUCKETS
+from benchmarks.timing import summarize
+
+TARGET_TO_PATH = {
+    "bot": "/chat/invoke",
+    "api": "/chat",
+}
+LOAD_BOT_ID = "load-test"
+
+WORDS = ("what is the weather like in hanoi tomorrow and should i bring an umbrella when i fly to saigon next "
+         "week can you book a window seat and remind me what we said about the hotel near the river").split()
+
+
+class ConversationShape:
+    """Random turns, message lengths and think times of simulated conversations"""
+
+    def __init__(self, turns_mean: float, words_median: float, words_sigma: float, max_words: int,
+                 think_time: float, seed: int = 0):
+        self.turns_mean = turns_mean
+        self.words_median = words_median
+        self.words_sigma = words_sigma
+        self.max_words = max_words
+        self.think_time = think_time
+        self.rng = random.Random(seed)
+
+    def turns(self) -> int:
+        """Geometric with mean `turns_mean`, most conversations are short and a few run long"""
+        if self.turns_mean <= 1:
+            return 1
+        p = 1 / self.turns_mean
+        return 1 + int(math.log(1 - self.rng.random()) / math.log(1 - p))
+
+    def sentence(self, turn: int) -> str:
+        words = int(round(self.rng.lognormvariate(math.log(self.words_median), self.words_sigma)))
+        words = min(max(words, 1), self.max_words)
+        return f"Question {turn}: " + " ".join(self.rng.choice(WORDS) for _ in range(words))
+
+    def think(self) -> float:
+        return self.rng.expovariate(1 / self.think_time) if self.think_time > 0 else 0.0
+
+    def arrival(self, rate: float) -> float:
+        """Seconds until the next conversation of a Poisson process"""
+        return self.rng.expovariate(rate)
+
+
+class LoadStats:
+    """Client-side latencies, a histogram on the server's metric buckets, errors and a per-second timeline"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = list(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.latencies: List[float] = []
+        self.errors: Counter = Counter()
+        self.timeline: Dict[int, List[float]] = defaultdict(list)
+        self.timeline_errors: Counter = Counter()
+        self.start = time.monotonic()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.conversations = 0
+        self.dropped = 0
+
+    def begin(self):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def end(self, seconds: float, error: Optional[str]):
+        self.in_flight -= 1
+        second = int(time.monotonic() - self.start)
+        if error is not None:
+            self.errors[error] += 1
+            self.timeline_errors[second] += 1
+            return
+        self.latencies.append(seconds)
+        self.bucket_counts[bisect_left(self.buckets, seconds)] += 1
+        self.timeline[second].append(seconds)
+
+    def histogram(self) -> Dict[str, int]:
+        labels = [str(bucket) for bucket in self.buckets] + ["+Inf"]
+        return dict(zip(labels, self.bucket_counts))
+
+    def report(self) -> Dict[str, Any]:
+        duration = time.monotonic() - self.start
+        errors = sum(self.errors.values())
+        requests = len(self.latencies) + errors
+        seconds = sorted(set(self.timeline) | set(self.timeline_errors))
+        per_second = {second: summarize(self.timeline[second]) for second in seconds}
+        return {
+            "duration_s": duration,
+            "requests": requests,
+            "errors": errors,
+            "error_rate": errors / requests if requests else 0.0,
+            "error_kinds": dict(self.errors),
+            "throughput_rps": len(self.latencies) / duration if duration else 0.0,
+            "conversations": self.conversations,
+            "dropped_conversations": self.dropped,
+            "max_in_flight": self.max_in_flight,
+            "latency": {**summarize(self.latencies), "histogram": self.histogram()},
+            "timeline": [
+                {
+                    "second": second,
+                    "completed": len(self.timeline[second]),
+                    "errors": self.timeline_errors[second],
+                    "p50": per_second[second]["p50"],
+                    "p95": per_second[second]["p95"],
+                }
+                for second in seconds
+            ],
+        }
+
+
+def chat_payload(target: str, sentence: str, conversation_id: str, bot_id: Optional[str]) -> Dict[str, Any]:
+    if target == "bot":
+        return {"input": {"input": sentence, "conversation_id": conversation_id, "bot_id": bot_id}}
+    return {"input": sentence, "conversation_id": conversation_id}
+
+
+async def send(client: httpx.AsyncClient, args, stats: LoadStats, sentence: str, conversation_id: str):
+    payload = chat_payload(args.target, sentence, conversation_id, args.bot_id)
+    stats.begin()
+    start = time.perf_counter()
+    error = None
+    try:
+        request = client.post(TARGET_TO_PATH[args.target], json=payload, timeout=args.timeout)
+        # httpx only enforces its timeout on network I/O, the ASGI transport awaits the app without one
+        response = await (request if args.url else asyncio.wait_for(request, args.timeout))
+        if response.status_code >= 400:
+            error = f"status_{response.status_code}"
+    except (httpx.TimeoutException, asyncio.TimeoutError):
+        error = "timeout"
+    except httpx.HTTPError as e:
+        error = type(e).__name__
+    except Exception as e:
+        # In process, an exception of the app reaches the client instead of a 500
+        error = f"app_{type(e).__name__}"
+    stats.end(time.perf_counter() - start, error)
+
+
+async def converse(client: httpx.AsyncClient, args, stats: LoadStats, shape: ConversationShape,
+                   conversation_id: str, deadline: float):
+    """One conversation, cut short when the step ends"""
+    for turn in range(shape.turns()):
+        if time.monotonic() >= deadline:
+            return
+        await send(client, args, stats, shape.sentence(turn), conversation_id)
+        await asyncio.sleep(shape.think())
+    stats.conversations += 1
+
+
+async def run_closed(client: httpx.AsyncClient, args, shape: ConversationShape, concurrency: int) -> LoadStats:
+    """`concurrency` users, each starting a new conversation when the last one ends"""
+    stats = LoadStats()
+    deadline = stats.start + args.ramp + args.duration
+    start_users = min(args.start_concurrency, concurrency)
+    run_id = uuid.uuid4().hex[:8]
+
+    async def user(index: int):
+        if index >= start_users:
+            # Users join evenly over the ramp
+            await asyncio.sleep(args.ramp * (index - start_users + 1) / (concurrency - start_users))
+        number = 0
+        while time.monotonic() < deadline:
+            await converse(client, args, stats, shape, f"load-{run_id}-{index}-{number}", deadline)
+            number += 1
+
+    await asyncio.gather(*(user(index) for index in range(concurrency)))
+    return stats
+
+
+async def run_open(client: httpx.AsyncClient, args, shape: ConversationShape, rate: float) -> LoadStats:
+    """New conversations arriving at `rate` per second, whether or not earlier ones were answered"""
+    stats = LoadStats()
+    deadline = stats.start + args.ramp + args.duration
+    start_rate = args.start_rate if args.start_rate is not None else rate
+    run_id = uuid.uuid4().hex[:8]
+    tasks = set()
+    number = 0
+    while True:
+        elapsed = time.monotonic() - stats.start
+        current = rate if elapsed >= args.ramp else start_rate + (rate - start_rate) * elapsed / args.ramp
+        await asyncio.sleep(shape.arrival(max(current, 1e-3)))
+        if time.monotonic() >= deadline:
+            break
+        if len(tasks) >= args.max_conversations:
+            # The client is the bottleneck past this point, count the arrival instead of queueing it
+            stats.dropped += 1
+            continue
+        task = asyncio.create_task(converse(client, args, stats, shape, f"load-{run_id}-{number}", deadline))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        number += 1
+    await asyncio.gather(*tasks)
+    return stats
+
+
+async def serve_in_process(args, stack: AsyncExitStack):
+    """The app of the target with its lifespan, or with the fake model when --fake-llm is set"""
+    if args.target == "api":
+        from api.app import create_app
+        app = create_app()
+        if not args.fake_llm:
+            await stack.enter_async_context(app.router.lifespan_context(app))
+            return app
+        from chat.manager import ChatManager
+        from database.mongodb import MongodbClient
+        from benchmarks.fakes import FakeChatModel, InMemoryMongoClient
+        app.state.chat_manager = ChatManager(
+            db=MongodbClient(client=InMemoryMongoClient()),
+            model=FakeChatModel(latency=args.llm_latency, tokens_per_second=args.tokens_per_second),
+        )
+        stack.callback(app.state.chat_manager.close)
+        return app
+
+    import app as bot_app
+    await stack.enter_async_context(bot_app.app.router.lifespan_context(bot_app.app))
+    if args.fake_llm:
+        from bot import BotModes
+        from memory import MemoryTypes
+        from models import MODEL_TO_CLASS
+        from benchmarks.fakes import FakeChatModel
+        from benchmarks.run import FAKE_MODEL, build_bot
+        from benchmarks.timing import StageRecorder
+        MODEL_TO_CLASS[FAKE_MODEL] = FakeChatModel
+        workdir = stack.enter_context(tempfile.TemporaryDirectory(prefix="chatbot-load-"))
+        # Hosted next to the configured bots, which are never built since no request is routed to them
+        bot_app.registry.host(LOAD_BOT_ID, build_bot(
+            MemoryTypes.CUSTOM_MEMORY, BotModes.DIRECT, args, workdir, StageRecorder()
+        ))
+        args.bot_id = LOAD_BOT_ID
+    return bot_app.app
+
+
+async def run(args) -> List[Dict[str, Any]]:
+    shape = ConversationShape(args.turns_mean, args.words_median, args.words_sigma, args.max_words,
+                              args.think_time, seed=args.seed)
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    results = []
+    async with AsyncExitStack() as stack:
+        if args.url:
+            client = httpx.AsyncClient(base_url=args.url, limits=limits)
+        else:
+            app = await serve_in_process(args, stack)
+            client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://in-process",
+                                       limits=limits)
+        await stack.enter_async_context(client)
+        steps = args.concurrency if args.mode == "closed" else args.rate
+        for step in steps:
+            if args.mode == "closed":
+                stats = await run_closed(client, args, shape, step)
+            else:
+                stats = await run_open(client, args, shape, step)
+            result = {
+                "target": args.target,
+                "transport": "http" if args.url else "asgi",
+                "mode": args.mode,
+                "concurrency" if args.mode == "closed" else "rate": step,
+                **stats.report(),
+            }
+            print_result(result)
+            results.append(result)
+            if result["requests"] and result["errors"] == result["requests"]:
+                # The next steps would fail the same way, their latencies only time the error path
+                break
+    return results
+
+
+def print_result(result: Dict[str, Any]):
+    latency = result["latency"]
+    step = f"c={result['concurrency']}" if result["mode"] == "closed" else f"rate={result['rate']}/s"
+    print(
+        f"{result['target']:<4} {result['transport']:<5} {result['mode']:<6} {step:<12} "
+        f"rps={result['throughput_rps']:8.2f} p50={latency['p50'] * 1000:8.1f}ms "
+        f"p95={latency['p95'] * 1000:8.1f}ms p99={latency['p99'] * 1000:8.1f}ms "
+        f"err={result['error_rate']:.2%} in_flight<={result['max_in_flight']} "
+        f"dropped={result['dropped_conversations']}"
+    )
+
+
+def parse_args(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Load test the /chat endpoints with simulated conversations")
+    parser.add_argument("--target", default="api", choices=list(TARGET_TO_PATH),
+                        help="bot for app.py, api for api/app.py")
+    parser.add_argument("--url", default=None, help="Base URL of a running server, unset serves the app in process")
+    parser.add_argument("--bot-id", default=None, help="Bot of the bot target, unset for the default bot")
+    parser.add_argument("--fake-llm", action="store_true", help="In process, answer with the benchmark fake model")
+    parser.add_argument("--mode", default="closed", choices=["closed", "open"])
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32], help="Closed-loop users per step")
+    parser.add_argument("--start-concurrency", type=int, default=1, help="Closed-loop users at the start of a ramp")
+    parser.add_argument("--rate", nargs="+", type=float, default=[1, 5, 20],
+                        help="Open-loop new conversations per second per step")
+    parser.add_argument("--start-rate", type=float, default=None, help="Open-loop rate at the start of a ramp")
+    parser.add_argument("--max-conversations", type=int, default=10000,
+                        help="Open-loop conversations in progress before arrivals are dropped")
+    parser.add_argument("--ramp", type=float, default=10, help="Seconds to reach the step's concurrency or rate")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds held at the step's concurrency or rate")
+    parser.add_argument("--turns-mean", type=float, default=4, help="Mean turns per conversation")
+    parser.add_argument("--words-median", type=float, default=12, help="Median words per message")
+    parser.add_argument("--words-sigma", type=float, default=0.8, help="Spread of the log-normal message length")
+    parser.add_argument("--max-words", type=int, default=200)
+    parser.add_argument("--think-time", type=float, default=1.0, help="Mean seconds between turns, 0 for none")
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds before a request counts as timed out")
+    parser.add_argument("--max-connections", type=int, default=1000)
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Fake model time to first token in seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=50, help="Fake model generation rate")
+    parser.add_argument("--embedding-latency", type=float, default=0.005)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="load_results.json")
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str] = None):
+    args = parse_args(argv)
+    results = asyncio.run(run(args))
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "settings": vars(args),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+    failed = results[-1] if results else None
+    if failed is not None and failed["requests"] and failed["errors"] == failed["requests"]:
+        raise SystemExit(f"Every request of the last step failed, aborted: {failed['error_kinds']}")
+
+
+if __name__ == "__main__":
+    main()
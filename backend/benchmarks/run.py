@@ -0,0 +1,287 @@
+"""
+End-to-end benchmark of Bot and ChatManager with a fake chat model and local stand-ins for every store.
+
+Run from the backend directory:
+    python -m benchmarks.run --concurrency 1 4 16 --history 0 20 100 --output benchmark_results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List
+
+from sqlalchemy import MetaData, Table, create_engine
+
+from bot import Bot, BotModes
+from chat.manager import ChatManager
+from common.config import Config
+from common.objects import Message, MessageTurn
+from database.mongodb import MongodbClient
+from memory import MemoryTypes
+from migrations import sql_schema
+from models import MODEL_TO_CLASS
+from tools import CustomSearchTool
+from benchmarks.fakes import (
+    FakeChatModel, FakeEmbedder, FakeSearchTransport, InMemoryMongoChatMessageHistory, InMemoryMongoClient,
+    InMemoryRedis
+)
+from benchmarks.timing import StageRecorder, summarize
+
+FAKE_MODEL = "FAKE"
+# Memories with no faithful local stand-in, skipped unless asked for with --memory, and why
+SKIPPED_MEMORIES = {
+    MemoryTypes.POSTGRES_MEMORY.value: "pgvector similarity search has no SQLite stand-in, every load takes the "
+                                       "error path",
+    MemoryTypes.TIERED_MEMORY.value: "its cold tier is the Postgres memory",
+}
+# Memories whose stand-ins exercise the same code paths as the real backend
+STAND_IN_MEMORIES = [m.value for m in MemoryTypes if m.value not in SKIPPED_MEMORIES]
+
+BENCH_REACT_PROMPT = """{bot_personality}
+{user_personality}
+You have access to the following tools:
+{tools}
+
+Use the following format:
+Thought: do I need to use a tool?
+Action: the action to take, should be one of [{tool_names}]
+Action Input: the input to the action
+Observation: the result of the action
+Final Answer: the final answer to the human
+
+Previous conversation history:
+{history}
+
+New input: {input}
+{agent_scratchpad}"""
+
+
+def sqlite_engine(workdir: str, name: str, build_table: Callable[[MetaData], Table]):
+    """File backed SQLite engine standing in for MySQL or Postgres, with the table the migration builds for it"""
+    engine = create_engine(
+        f"sqlite:///{os.path.join(workdir, name)}.db",
+        connect_args={"check_same_thread": False, "timeout": 30},
+    )
+    metadata = MetaData()
+    build_table(metadata)
+    metadata.create_all(engine)
+    return engine
+
+
+def memory_kwargs_for(memory_type: MemoryTypes, workdir: str, embedder: FakeEmbedder) -> Dict[str, Any]:
+    if memory_type == MemoryTypes.MONGO_MEMORY:
+        return {"chat_history_class": InMemoryMongoChatMessageHistory}
+    if memory_type == MemoryTypes.CUSTOM_MEMORY:
+        return {"client": InMemoryMongoClient()}
+    if memory_type == MemoryTypes.SQL_MEMORY:
+        return {"engine": sqlite_engine(workdir, f"sql_{time.monotonic_ns()}", sql_schema.mysql_chat_memory)}
+    if memory_type == MemoryTypes.REDIS_MEMORY:
+        return {"client": InMemoryRedis()}
+    if memory_type == MemoryTypes.POSTGRES_MEMORY:
+        # pgvector similarity SQL is not understood by SQLite, the search step fails fast and is logged,
+        # only benchmarked when asked for with --memory
+        engine = sqlite_engine(workdir, f"pg_{time.monotonic_ns()}", sql_schema.postgres_chat_memory)
+        return {"engine": engine, "embedder": embedder}
+    if memory_type == MemoryTypes.SQLITE_MEMORY:
+        return {"path": os.path.join(workdir, f"sqlite_{time.monotonic_ns()}.db")}
+    return {}
+
+
+def build_bot(memory_type: MemoryTypes, mode: BotModes, args, workdir: str, recorder: StageRecorder) -> Bot:
+    embedder = FakeEmbedder(latency=args.embedding_latency)
+    embedder.encode = recorder.wrap("embedding", embedder.encode)
+    tools = [] if mode == BotModes.DIRECT else [CustomSearchTool(transport=FakeSearchTransport(args.search_latency))]
+    bot = Bot(
+        config=Config(),
+        memory=memory_type,
+        model=FAKE_MODEL,
+        model_kwargs={"latency": args.llm_latency, "tokens_per_second": args.tokens_per_second},
+        memory_kwargs=memory_kwargs_for(memory_type, workdir, embedder),
+        tools=tools,
+        mode=mode,
+        prompt_template=BENCH_REACT_PROMPT if mode == BotModes.REACT else None,
+    )
+    bot.brain = bot.brain.with_config(callbacks=[recorder])
+    return bot
+
+
+def populate_bot_history(bot: Bot, conversation_id: str, turns: int):
+    if hasattr(bot.memory, "user_memory"):
+        # LangChain backed memories only keep history in their per-conversation chat history object
+        bot.memory.load_history(conversation_id)
+        chat_history = bot.memory.user_memory[conversation_id]
+        for i in range(turns):
+            chat_history.add_user_message(f"Earlier question number {i} about the weather")
+            chat_history.add_ai_message(f"Earlier answer number {i}, it is sunny today")
+        return
+    for i in range(turns):
+        bot.memory.add_message(MessageTurn(
+            human_message=Message(message=f"Earlier question number {i} about the weather", role="Human"),
+            ai_message=Message(message=f"Earlier answer number {i}, it is sunny today", role="AI"),
+            conversation_id=conversation_id,
+        ))
+
+
+def run_bot_scenario(memory_type: MemoryTypes, mode: BotModes, concurrency: int, history: int, args,
+                     workdir: str) -> Dict[str, Any]:
+    recorder = StageRecorder()
+    bot = build_bot(memory_type, mode, args, workdir, recorder)
+    conversations = [f"bench-{memory_type.value}-{mode.value}-{worker}" for worker in range(concurrency)]
+    for conversation_id in conversations:
+        populate_bot_history(bot, conversation_id, history)
+    bot.memory.add_message = recorder.wrap("persist", bot.memory.add_message)
+
+    errors = 0
+    errors_lock = threading.Lock()
+    request = recorder.wrap("total", bot.predict)
+
+    def worker(index: int):
+        nonlocal errors
+        conversation_id = conversations[index % concurrency]
+        try:
+            request(f"Benchmark question {index}, what is the weather like?", conversation_id=conversation_id)
+        except Exception:
+            with errors_lock:
+                errors += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, range(args.requests)))
+    duration = time.perf_counter() - start
+    return {
+        "target": "bot",
+        "memory": memory_type.value,
+        "mode": mode.value,
+        "concurrency": concurrency,
+        "history_length": history,
+        "requests": args.requests,
+        "errors": errors,
+        "duration_s": duration,
+        "throughput_rps": args.requests / duration if duration else 0.0,
+        "stages": recorder.summary(),
+    }
+
+
+async def run_chat_manager_scenario(concurrency: int, history: int, args) -> Dict[str, Any]:
+    recorder = StageRecorder()
+    manager = ChatManager(
+        db=MongodbClient(client=InMemoryMongoClient()),
+        model=FakeChatModel(latency=args.llm_latency, tokens_per_second=args.tokens_per_second),
+    )
+    conversations = [f"bench-chat-manager-{worker}" for worker in range(concurrency)]
+    for conversation_id in conversations:
+        for i in range(history):
+            manager.db.add_conversation_message(conversation_id, f"Earlier question {i}", f"Earlier answer {i}")
+    manager.db.format_history = recorder.wrap("history_load", manager.db.format_history)
+    manager.db.add_conversation_message = recorder.wrap("persist", manager.db.add_conversation_message)
+    manager.chain = manager.chain.with_config(callbacks=[recorder])
+    process_message = recorder.wrap_async("total", manager.process_message)
+
+    errors = 0
+    queue: asyncio.Queue = asyncio.Queue()
+    for index in range(args.requests):
+        queue.put_nowait(index)
+
+    async def worker(conversation_id: str):
+        nonlocal errors
+        while not queue.empty():
+            index = queue.get_nowait()
+            try:
+                await process_message(f"Benchmark question {index}", conversation_id)
+            except Exception:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(conversation_id) for conversation_id in conversations))
+    duration = time.perf_counter() - start
+    return {
+        "target": "chat-manager",
+        "memory": "mongodb-client",
+        "mode": "direct",
+        "concurrency": concurrency,
+        "history_length": history,
+        "requests": args.requests,
+        "errors": errors,
+        "duration_s": duration,
+        "throughput_rps": args.requests / duration if duration else 0.0,
+        "stages": recorder.summary(),
+    }
+
+
+def print_result(result: Dict[str, Any]):
+    total = result["stages"].get("total", summarize([]))
+    stages = ", ".join(
+        f"{stage}={values['p50'] * 1000:.1f}ms"
+        for stage, values in sorted(result["stages"].items()) if stage != "total"
+    )
+    print(
+        f"{result['target']:<13} {result['memory']:<16} {result['mode']:<7} c={result['concurrency']:<3} "
+        f"h={result['history_length']:<4} rps={result['throughput_rps']:8.2f} "
+        f"p50={total['p50'] * 1000:8.1f}ms p95={total['p95'] * 1000:8.1f}ms p99={total['p99'] * 1000:8.1f}ms "
+        f"err={result['errors']} | {stages}"
+    )
+
+
+def parse_args(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Benchmark Bot and ChatManager with stubbed LLM and local stores")
+    parser.add_argument("--targets", nargs="+", default=["bot", "chat-manager"], choices=["bot", "chat-manager"])
+    parser.add_argument("--memory", nargs="+", default=STAND_IN_MEMORIES,
+                        choices=[m.value for m in MemoryTypes],
+                        help=f"Defaults to the memories with a local stand-in, skipping {', '.join(SKIPPED_MEMORIES)}")
+    parser.add_argument("--modes", nargs="+", default=[BotModes.DIRECT.value, BotModes.REACT.value],
+                        choices=[BotModes.DIRECT.value, BotModes.REACT.value])
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16])
+    parser.add_argument("--history", nargs="+", type=int, default=[0, 20, 100])
+    parser.add_argument("--requests", type=int, default=50, help="Requests per scenario")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Fake model time to first token in seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=50, help="Fake model generation rate")
+    parser.add_argument("--embedding-latency", type=float, default=0.005)
+    parser.add_argument("--search-latency", type=float, default=0.3)
+    parser.add_argument("--output", default="benchmark_results.json")
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str] = None):
+    args = parse_args(argv)
+    MODEL_TO_CLASS[FAKE_MODEL] = FakeChatModel
+    results = []
+    skipped = {}
+    if "bot" in args.targets:
+        skipped = {memory: reason for memory, reason in SKIPPED_MEMORIES.items() if memory not in args.memory}
+    for memory, reason in skipped.items():
+        print(f"Skipped {memory}: {reason}")
+    with tempfile.TemporaryDirectory(prefix="chatbot-bench-") as workdir:
+        for concurrency in args.concurrency:
+            for history in args.history:
+                if "bot" in args.targets:
+                    for memory in args.memory:
+                        for mode in args.modes:
+                            result = run_bot_scenario(MemoryTypes(memory), BotModes(mode), concurrency, history,
+                                                      args, workdir)
+                            print_result(result)
+                            results.append(result)
+                if "chat-manager" in args.targets:
+                    result = asyncio.run(run_chat_manager_scenario(concurrency, history, args))
+                    print_result(result)
+                    results.append(result)
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "settings": vars(args),
+        "skipped_memories": skipped,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
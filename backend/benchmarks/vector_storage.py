@@ -0,0 +1,173 @@
+"""
+Compare the embedding storage layouts of chat_memory on a scratch PostgreSQL table per layout:
+table + index size, HNSW build time, recall@k against exact full-precision search and query latency.
+Needs a PostgreSQL server with pgvector 0.7+, the scratch tables are dropped afterwards.
+
+Run from the backend directory:
+    python -m benchmarks.vector_storage --rows 100000 --queries 200 --output vector_storage_results.json
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+
+from common.config import Config
+from memory.vector_storage import EMBEDDING_DIMENSION, keeps_full_precision, search_params, similarity_query
+from migrations.embedding_storage import backfill, create_index, drop_full_precision
+from benchmarks.timing import summarize
+
+SESSION_ID = "bench"
+# (storage, rerank)
+LAYOUTS: List[Tuple[str, bool]] = [
+    ("vector", False),
+    ("halfvec", False),
+    ("halfvec", True),
+    ("binary", False),
+    ("binary", True),
+]
+
+CREATE_TABLE = f"""
+CREATE TABLE "{{table}}" (
+    id SERIAL PRIMARY KEY,
+    "SessionId" VARCHAR(255) NOT NULL,
+    "History" JSON NOT NULL,
+    "Embedding" vector({EMBEDDING_DIMENSION}),
+    "EmbeddingHalf" halfvec({EMBEDDING_DIMENSION}),
+    "EmbeddingBits" bit({EMBEDDING_DIMENSION})
+)
+"""
+
+
+def clustered_embeddings(rows: int, clusters: int, seed: int) -> np.ndarray:
+    """Normalized vectors around random centroids, closer to sentence embeddings than uniform noise"""
+    rng = np.random.default_rng(seed)
+    centroids = rng.standard_normal((clusters, EMBEDDING_DIMENSION)).astype(np.float32)
+    vectors = centroids[rng.integers(0, clusters, rows)] + 0.6 * rng.standard_normal(
+        (rows, EMBEDDING_DIMENSION)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _literal(vector: np.ndarray) -> str:
+    return "[" + ",".join(f"{value:.7g}" for value in vector) + "]"
+
+
+def load_table(engine: Engine, table: str, vectors: np.ndarray, batch_size: int = 1000):
+    with engine.begin() as conn:
+        conn.execute(text(f'DROP TABLE IF EXISTS "{table}"'))
+        conn.execute(text(CREATE_TABLE.format(table=table)))
+    insert = text(f'INSERT INTO "{table}" (id, "SessionId", "History", "Embedding") '
+                  f'VALUES (:id, :session_id, :history, (:embedding)::vector)')
+    for offset in range(0, len(vectors), batch_size):
+        with engine.begin() as conn:
+            conn.execute(insert, [
+                {"id": i, "session_id": SESSION_ID, "history": json.dumps({"id": i}), "embedding": _literal(vector)}
+                for i, vector in enumerate(vectors[offset:offset + batch_size], start=offset + 1)
+            ])
+
+
+def prepare_layout(engine: Engine, table: str, storage: str, rerank: bool) -> float:
+    """Fill the layout's columns, drop what it does not keep and build its index, returning the build time"""
+    if storage == "vector":
+        start = time.perf_counter()
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text(f'CREATE INDEX ON "{table}" USING hnsw ("Embedding" vector_cosine_ops)'))
+        return time.perf_counter() - start
+    backfill(engine, storage, table=table, batch_size=10000, pause_seconds=0)
+    if not keeps_full_precision(storage, rerank):
+        drop_full_precision(engine, storage, table=table, batch_size=10000, pause_seconds=0)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f'VACUUM FULL "{table}"'))
+    return create_index(engine, storage, table=table)
+
+
+def table_size(engine: Engine, table: str) -> int:
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT pg_total_relation_size(:table)"), {"table": table}).scalar()
+
+
+def run_layout(engine: Engine, storage: str, rerank: bool, vectors: np.ndarray, queries: np.ndarray,
+               truth: np.ndarray, args) -> Dict[str, Any]:
+    table = f"bench_vectors_{storage}{'_rerank' if rerank else ''}"
+    load_table(engine, table, vectors)
+    try:
+        build_seconds = prepare_layout(engine, table, storage, rerank)
+        size = table_size(engine, table)
+        query = similarity_query(storage, rerank, table_name=table)
+        latencies, recalls = [], []
+        with engine.connect() as conn:
+            conn.execute(text(f"SET hnsw.ef_search = {max(40, args.k * args.rerank_factor)}"))
+            for vector, expected in zip(queries, truth):
+                params = search_params(SESSION_ID, _literal(vector), args.k, args.rerank_factor)
+                start = time.perf_counter()
+                rows = conn.execute(query, params).scalars().all()
+                latencies.append(time.perf_counter() - start)
+                found = {row["id"] for row in rows}
+                recalls.append(len(found & set(expected.tolist())) / args.k)
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text(f'DROP TABLE IF EXISTS "{table}"'))
+    return {
+        "storage": storage,
+        "rerank": rerank,
+        "size_bytes": size,
+        "index_build_seconds": build_seconds,
+        "recall_at_k": float(np.mean(recalls)),
+        "latency": summarize(latencies),
+    }
+
+
+def parse_args(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Benchmark compact pgvector layouts of chat_memory embeddings")
+    parser.add_argument("--connection-string", default=None, help="Defaults to POSTGRES_CONNECTION_STRING")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--clusters", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rerank-factor", type=int, default=4)
+    parser.add_argument("--layouts", nargs="+", default=[f"{s}{'+rerank' if r else ''}" for s, r in LAYOUTS],
+                        choices=[f"{s}{'+rerank' if r else ''}" for s, r in LAYOUTS])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="vector_storage_results.json")
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str] = None):
+    args = parse_args(argv)
+    config = Config(postgres_connection_string=args.connection_string)
+    engine = create_engine(config.postgres_connection_string, future=True)
+    with engine.begin() as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+
+    vectors = clustered_embeddings(args.rows + args.queries, args.clusters, args.seed)
+    vectors, queries = vectors[:args.rows], vectors[args.rows:]
+    # Exact top-k by cosine similarity, ids start at 1
+    truth = np.argsort(-(queries @ vectors.T), axis=1)[:, :args.k] + 1
+
+    results = []
+    for layout in args.layouts:
+        storage, _, rerank = layout.partition("+")
+        result = run_layout(engine, storage, bool(rerank), vectors, queries, truth, args)
+        print(
+            f"{layout:<15} size={result['size_bytes'] / 1024 / 1024:8.1f}MiB "
+            f"build={result['index_build_seconds']:7.2f}s recall@{args.k}={result['recall_at_k']:.3f} "
+            f"p50={result['latency']['p50'] * 1000:7.2f}ms p95={result['latency']['p95'] * 1000:7.2f}ms"
+        )
+        results.append(result)
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "settings": {key: value for key, value in vars(args).items() if key != "connection_string"},
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,66 +1,120 @@
 import asyncio
+from enum import Enum
 from queue import Queue
-from typing import Optional, Union, List
+from typing import AsyncIterator, Dict, Optional, Union, List, Tuple
 from operator import itemgetter
 
-from langchain.agents import AgentExecutor
+from langchain.agents import AgentExecutor, create_tool_calling_agent
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.runnables import RunnableLambda, RunnableMap
 from langchain.agents.format_scratchpad import format_log_to_str
 from langchain.agents.output_parsers import ReActSingleInputOutputParser
-from langchain.callbacks.tracers.langchain import wait_for_all_tracers
 from langchain.callbacks.streaming_stdout_final_only import FinalStreamingStdOutCallbackHandler
 from langchain_core.runnables import RunnablePassthrough
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.language_models import BaseChatModel
 
-from memory import MemoryTypes, MEM_TO_CLASS
+from memory import MemoryTypes, MEM_TO_CLASS, ConversationSummarizer
 from models import ModelTypes
 from common.config import Config, BaseObject
-from common.objects import Message, MessageTurn
+from common.objects import BatchResult, Message, MessagePage, MessageTurn, messages_from_dict
+from common.metrics import MetricsCallbackHandler, count, timed
+from common.outbox import DurableOutbox
+from common.tracing import get_trace_exporter
 from common.constants import *
 from chain import ChainManager
-from prompts import BOT_PERSONALITY
+from prompts import BOT_PERSONALITY, DIRECT_CHAT_PROMPT, TOOL_CALLING_SYSTEM_PROMPT
 from utils import BotAnonymizer, CacheTypes, ChatbotCache
-from tools import CustomSearchTool
+from tools import CustomSearchTool, TimeoutTool
+
+
+DEFAULT_MODEL_KWARGS = {
+    "max_output_tokens": 1024,
+    "temperature": 0.2,
+    "top_p": 0.8,
+    "top_k": 40
+}
+
+
+class BotModes(str, Enum):
+    """Enumerator with the ways a Bot can answer."""
+    REACT = "react"
+    DIRECT = "direct"
+    TOOL_CALLING = "tool-calling"
 
 
 class Bot(BaseObject):
     def __init__(
             self,
             config: Config = None,
-            prompt_template: str = PERSONAL_CHAT_PROMPT_REACT,
+            prompt_template: str = None,
             memory: Optional[MemoryTypes] = None,
             cache: Optional[CacheTypes] = None,
             model: Optional[ModelTypes] = None,
             memory_kwargs: Optional[dict] = None,
             model_kwargs: Optional[dict] = None,
             bot_personality: str = BOT_PERSONALITY,
-            tools: List[str] = None   
-                 
+            tools: List[str] = None,
+            mode: Optional[BotModes] = None,
+            base_model: Optional[BaseChatModel] = None,
+            summarizer: Optional[ConversationSummarizer] = None,
+            outbox_name: Optional[str] = None
     ):
         super().__init__()
         self.config = config if config is not None else Config()
-        self.tools = tools or [CustomSearchTool()]
+        self.tools = tools if tools is not None else [CustomSearchTool()]
+        # Without tools there is nothing for the agent loop to do, answer with a single LLM call
+        self.mode = mode if mode is not None else (BotModes.REACT if self.tools else BotModes.DIRECT)
         partial_variables = {
             "bot_personality": bot_personality or BOT_PERSONALITY,
             "user_personality": "",
-            "tools": "\n".join([f"{tool.name}: {tool.description}" for tool in self.tools]),
-            "tool_names": ", ".join([tool.name for tool in self.tools])
         }
+        if self.mode == BotModes.DIRECT:
+            prompt_template = prompt_template or DIRECT_CHAT_PROMPT
+        elif self.mode == BotModes.TOOL_CALLING:
+            prompt_template = prompt_template or ChatPromptTemplate.from_messages([
+                ("system", TOOL_CALLING_SYSTEM_PROMPT),
+                ("human", "{input}"),
+                MessagesPlaceholder("agent_scratchpad"),
+            ])
+        else:
+            prompt_template = prompt_template or PERSONAL_CHAT_PROMPT_REACT
+            partial_variables.update({
+                "tools": "\n".join([f"{tool.name}: {tool.description}" for tool in self.tools]),
+                "tool_names": ", ".join([tool.name for tool in self.tools])
+            })
     
         self.chain = ChainManager(
                 config=self.config,
                 prompt_template=prompt_template,
                 model=model,
                 model_kwargs=model_kwargs if model_kwargs else self.get_model_kwargs(model=model),
-                partial_variables=partial_variables
+                partial_variables=partial_variables,
+                base_model=base_model
             )
         self.input_queue = Queue(maxsize=6)
         self._memory = self.get_memory(memory_type=memory, parameters=memory_kwargs)
         # if cache == CacheTypes.GPTCache and model!=ModelTypes.OPENAI:
         #     cache = None
         self._cache = ChatbotCache.create(cache_type=cache)
-        #self.anonymizer = BotAnonymizer(config=self.config)
+        # Language pipelines are loaded lazily on first anonymized message
+        self.anonymizer = BotAnonymizer(config=self.config) if self.config.enable_anonymizer else None
+        # Long conversations are compacted into a running summary when summary_threshold is set
+        if summarizer is None and self.config.summary_threshold:
+            summarizer = ConversationSummarizer.from_config(self.config, model=self.chain.base_model)
+        self.summarizer = summarizer
+        # Answered turns are written by a background thread through a local file when outbox_directory is set,
+        # turns a previous run did not write are replayed
+        self.outbox = None
+        if self.config.outbox_directory:
+            self.outbox = DurableOutbox(
+                directory=self.config.outbox_directory,
+                name=outbox_name or self.config.session_id,
+                handler=self._write_records,
+                batch_size=self.config.outbox_batch_size,
+                fsync_interval=self.config.outbox_fsync_interval,
+            )
         self.brain = None
         self.start()
 
@@ -78,12 +132,119 @@ class Bot(BaseObject):
         print("=== END DEBUG ===")
         return history
 
+    def preload(self):
+        """Load the models this bot would otherwise load on its first message"""
+        if self.anonymizer is not None:
+            self.anonymizer.preload()
+        preload_memory = getattr(self.memory, "preload", None)
+        if preload_memory is not None:
+            preload_memory()
+
+    @timed("bot", "history_load")
+    def _load_history(self, inputs: dict) -> str:
+        # Batches load their histories up front with bulk queries
+        if inputs.get("history") is not None:
+            return inputs["history"]
+        pending = self._pending_history(inputs["conversation_id"])
+        history = None
+        if self.summarizer is not None:
+            history = self.summarizer.load_history(inputs["conversation_id"])
+            if history is not None:
+                history = self._with_recall([history], [inputs["input"]])[0]
+        if history is None:
+            history = self.memory.load_history(inputs["conversation_id"], inputs["input"])
+        return self._join_history(history, pending)
+
+    def _with_recall(self, histories: List[str], queries: List[str]) -> List[str]:
+        """Similar turns of the session ahead of summarizer histories, memories only add them to their own"""
+        recall = getattr(self.memory, "recall", None)
+        if recall is None:
+            return histories
+        return recall.with_recall_many(histories, queries, top_k=self.config.recall_top_k)
+
+    def _pending_history(self, conversation_id: str) -> List[str]:
+        """Turns answered but still in the outbox, read before the memory so none is missed"""
+        if self.outbox is None:
+            return []
+        return [messages_from_dict(record) for record in self.outbox.pending(conversation_id)]
+
+    @staticmethod
+    def _join_history(history: str, pending: List[str]) -> str:
+        if not pending:
+            return history
+        return "\n".join([history, *pending]) if history else "\n".join(pending)
+
     def start(self):
+        if self.mode == BotModes.DIRECT:
+            brain = self._build_direct_chain()
+        elif self.mode == BotModes.TOOL_CALLING:
+            brain = self._build_tool_calling_agent()
+        else:
+            brain = self._build_react_agent()
+        callbacks = [MetricsCallbackHandler("bot")]
+        trace_exporter = get_trace_exporter(self.config)
+        if trace_exporter is not None:
+            callbacks.append(trace_exporter)
+        self.brain = brain.with_config(callbacks=callbacks)
+
+    def _build_direct_chain(self):
+        """Prompt -> model -> string chain with history injection, without agent scaffolding"""
+        history_loader = RunnableMap({
+            "input": itemgetter("input"),
+            "history": RunnableLambda(self._load_history)
+        }).with_config(run_name="LoadHistory")
+
+        if self.config.enable_anonymizer:
+            anonymizer_runnable = self.anonymizer.get_runnable_anonymizer().with_config(run_name="AnonymizeSentence")
+            de_anonymizer = RunnableLambda(self.anonymizer.deanonymize).with_config(
+                run_name="DeAnonymizeResponse")
+            return (
+                history_loader
+                | anonymizer_runnable
+                | self.chain.chain
+                | StrOutputParser()
+                | de_anonymizer
+            )
+        return history_loader | self.chain.chain | StrOutputParser()
+
+    def _build_tool_calling_agent(self):
+        """
+        Agent using the model's native tool calling. Every tool call proposed in one step is executed
+        concurrently by `AgentExecutor.ainvoke`, each bounded by `config.tool_timeout`, and the results
+        are added to the scratchpad in the order the model proposed them.
+        """
+        history_loader = RunnablePassthrough.assign(
+            history=RunnableLambda(self._load_history)
+        ).with_config(run_name="LoadHistory")
+        tools = [TimeoutTool.wrap(tool, timeout=self.config.tool_timeout) for tool in self.tools]
+        agent = create_tool_calling_agent(self.chain.base_model, tools, self.chain.prompt)
+
+        if self.config.enable_anonymizer:
+            anonymizer_runnable = self.anonymizer.get_runnable_anonymizer().with_config(run_name="AnonymizeSentence")
+            anonymize_inputs = RunnablePassthrough.assign(
+                anonymized=anonymizer_runnable
+            ) | RunnableLambda(lambda x: {
+                **x, "input": x["anonymized"]["input"], "history": x["anonymized"]["history"]
+            })
+            agent = history_loader | anonymize_inputs | agent
+        else:
+            agent = history_loader | agent
+
+        return AgentExecutor(
+            agent=agent,
+            tools=tools,
+            verbose=True,
+            max_iterations=3,
+            return_intermediate_steps=False,
+            handle_parsing_errors=True
+        )
+
+    def _build_react_agent(self):
         history_loader = RunnableMap({
             "input": itemgetter("input"),
             "agent_scratchpad": itemgetter("intermediate_steps") | RunnableLambda(format_log_to_str),
-            "history": RunnablePassthrough() | RunnableLambda(lambda x: self.memory.load_history(x["conversation_id"], x["input"]))
-        }).with_config(run_name="LoadHistory") | RunnableLambda(lambda x: print(f"Loaded history: {x['history']}") or x)
+            "history": RunnablePassthrough() | RunnableLambda(self._load_history)
+        }).with_config(run_name="LoadHistory")
 
         # history_loader = RunnableMap({
         #     "input": itemgetter("input"),
@@ -104,7 +265,7 @@ class Bot(BaseObject):
 
         if self.config.enable_anonymizer:
             anonymizer_runnable = self.anonymizer.get_runnable_anonymizer().with_config(run_name="AnonymizeSentence")
-            de_anonymizer = RunnableLambda(self.anonymizer.anonymizer.deanonymize).with_config(
+            de_anonymizer = RunnableLambda(self.anonymizer.deanonymize).with_config(
                 run_name="DeAnonymizeResponse")
             
             agent = (
@@ -117,7 +278,7 @@ class Bot(BaseObject):
         else:
             agent = history_loader | self.chain.chain | ReActSingleInputOutputParser()
         
-        self.brain = AgentExecutor(
+        return AgentExecutor(
             agent=agent,
             tools=self.tools,
             verbose=True,
@@ -155,12 +316,7 @@ class Bot(BaseObject):
 
     @property
     def default_model_kwargs(self):
-        return {
-            "max_output_tokens": 1024,
-            "temperature": 0.2,
-            "top_p": 0.8,
-            "top_k": 40
-        }
+        return dict(DEFAULT_MODEL_KWARGS)
 
     @property
     def openai_model_kwargs(self):
@@ -178,54 +334,261 @@ class Bot(BaseObject):
             "callbacks": [FinalStreamingStdOutCallbackHandler()]  # Use only with agent
         }
     
+    def _history_reader(self, name: str):
+        reader = getattr(self.memory, name, None)
+        if reader is None:
+            raise NotImplementedError(f"{self.memory.class_name()} does not support reading history back")
+        return reader
+
+    def get_messages(self, conversation_id: str, cursor: str = None, limit: int = 50) -> MessagePage:
+        messages, next_cursor = self._history_reader("get_messages")(conversation_id, cursor=cursor, limit=limit)
+        return MessagePage(messages=messages, next_cursor=next_cursor)
+
+    def iter_messages(self, conversation_id: str, batch_size: int = 500):
+        return self._history_reader("iter_messages")(conversation_id, batch_size=batch_size)
+
     def reset_history(self, conversation_id: str = None):
+        # Turns still in the outbox would be read back into history and written after the delete
+        if self.outbox is not None and not self.outbox.flush(timeout=self.config.outbox_flush_timeout):
+            raise TimeoutError(f"Outbox {self.outbox.path} did not drain in {self.config.outbox_flush_timeout}s, "
+                               f"history was not cleared")
         self.memory.clear(conversation_id=conversation_id)
+        if self.summarizer is not None:
+            self.summarizer.clear(conversation_id=conversation_id)
     
-    def add_message_to_memory(
+    @timed("bot", "history_load_batch")
+    def load_histories(self, items: List[Tuple[str, str]]) -> List[str]:
+        """History of each (input, conversation_id) item, read with bulk queries when the memory supports them"""
+        histories: List[Optional[str]] = [None] * len(items)
+        pending_histories = [self._pending_history(conversation_id) for _, conversation_id in items]
+        if self.summarizer is not None:
+            for i, (_, conversation_id) in enumerate(items):
+                histories[i] = self.summarizer.load_history(conversation_id)
+            summarized = [i for i, history in enumerate(histories) if history is not None]
+            recalled = self._with_recall([histories[i] for i in summarized], [items[i][0] for i in summarized])
+            for i, history in zip(summarized, recalled):
+                histories[i] = history
+        missing = [i for i, history in enumerate(histories) if history is None]
+        if missing:
+            load_histories = getattr(self.memory, "load_histories", None)
+            if load_histories is not None:
+                loaded = load_histories([items[i][1] for i in missing], [items[i][0] for i in missing])
+            else:
+                loaded = [self.memory.load_history(items[i][1], items[i][0]) for i in missing]
+            for i, history in zip(missing, loaded):
+                histories[i] = history
+        return [self._join_history(history, pending) for history, pending in zip(histories, pending_histories)]
+
+    def _make_turn(
             self,
             human_message: Union[Message, str],
             ai_message: Union[Message, str],
             conversation_id: str
-    ):
+    ) -> MessageTurn:
         if isinstance(human_message, str):
             human_message = Message(message=human_message, role=self.config.human_prefix)
         if isinstance(ai_message, str):
             ai_message = Message(message=ai_message, role=self.config.ai_prefix)
+        return MessageTurn(human_message=human_message, ai_message=ai_message, conversation_id=conversation_id)
 
-        turn = MessageTurn(
-            human_message=human_message,
-            ai_message=ai_message,
-            conversation_id=conversation_id
-        )
+    def persist(
+            self,
+            human_message: Union[Message, str],
+            ai_message: Union[Message, str],
+            conversation_id: str
+    ):
+        """Persist a turn, through the outbox when there is one so the caller does not wait on the memory"""
+        if self.outbox is None:
+            return self.add_message_to_memory(human_message, ai_message, conversation_id)
+        self.outbox.append(self._make_turn(human_message, ai_message, conversation_id).model_dump())
+
+    def persist_turns(self, turns: List[MessageTurn]):
+        if self.outbox is None:
+            return self.add_messages_to_memory(turns)
+        for turn in turns:
+            self.outbox.append(turn.model_dump())
+
+    def _write_records(self, records: List[dict]):
+        """
+        Outbox handler, writes drained turns with one bulk write. A failed write raises so the outbox keeps
+        the records for a retry, the summarizer is given the turns only once they are stored.
+        """
+        turns = [MessageTurn(**record) for record in records]
+        earlier = self._untracked_histories(turns)
+        self.memory.insert_messages(turns)
+        self._summarize_turns(turns, earlier)
+
+    def _untracked_histories(self, turns: List[MessageTurn]) -> Dict[str, str]:
+        """Stored history of the conversations the summarizer does not track yet, read before the turns are written"""
+        if self.summarizer is None:
+            return {}
+        return {
+            conversation_id: self.memory.load_history(conversation_id)
+            for conversation_id in dict.fromkeys(turn.conversation_id for turn in turns)
+            if self.summarizer.load_state(conversation_id) is None
+        }
+
+    def _summarize_turns(self, turns: List[MessageTurn], earlier: Dict[str, str]):
+        if self.summarizer is None:
+            return
+        try:
+            for turn in turns:
+                self.summarizer.add_turn(
+                    turn.conversation_id,
+                    messages_from_dict(turn.model_dump()),
+                    history=lambda conversation_id=turn.conversation_id: earlier.get(conversation_id, "")
+                )
+        except Exception as e:
+            # The turns are stored, failing the outbox batch would store them again
+            count("bot", "summarize_error")
+            self.logger.error(f"Could not add {len(turns)} turns to the conversation summaries: {e}")
+
+    @timed("bot", "persist")
+    def add_message_to_memory(
+            self,
+            human_message: Union[Message, str],
+            ai_message: Union[Message, str],
+            conversation_id: str
+    ):
+        turn = self._make_turn(human_message, ai_message, conversation_id)
+        if self.summarizer is not None:
+            self.summarizer.add_turn(
+                conversation_id,
+                messages_from_dict(turn.model_dump()),
+                history=lambda: self.memory.load_history(conversation_id)
+            )
         self.memory.add_message(turn)
     
-    async def __call__(self, message: Message, conversation_id: str):
-        try:
-            try:
-                output = self.brain.invoke({"input": message.message, "conversation_id": conversation_id})['output']
-            except ValueError as e:
-                import regex as re
-                response = str(e)
-                # Try to extract the actual response from error messages
-                response = re.findall(r".*?Could not parse LLM output: `(.*)`", response)
-                if not response:
-                    # Try another common error pattern
-                    response = re.findall(r".*?Error in parsing LLM output: `(.*)`", response)
-                    if not response:
-                        raise e
-                output = response[0]
-
-            output = Message(message=output, role=self.config.ai_prefix)
+    @timed("bot", "persist_batch")
+    def add_messages_to_memory(self, turns: List[MessageTurn]):
+        """Persist the turns of a batch, with one bulk write when the memory supports it"""
+        if self.summarizer is not None:
+            for turn in turns:
+                self.summarizer.add_turn(
+                    turn.conversation_id,
+                    messages_from_dict(turn.model_dump()),
+                    history=lambda conversation_id=turn.conversation_id: self.memory.load_history(conversation_id)
+                )
+        add_messages = getattr(self.memory, "add_messages", None)
+        if add_messages is not None:
+            add_messages(turns)
+        else:
+            for turn in turns:
+                self.memory.add_message(turn)
+
+    def _output_text(self, output) -> str:
+        """Answer text of a brain output"""
+        if self.mode == BotModes.DIRECT:
             return output
+        output = output["output"]
+        if self.mode == BotModes.TOOL_CALLING and self.config.enable_anonymizer:
+            output = self.anonymizer.deanonymize(output)
+        return output
+
+    @staticmethod
+    def _recover_react_output(error: ValueError) -> str:
+        """Extract the answer from a ReAct output the parser rejected"""
+        import regex as re
+        response = str(error)
+        # Try to extract the actual response from error messages
+        recovered = re.findall(r".*?Could not parse LLM output: `(.*)`", response)
+        if not recovered:
+            # Try another common error pattern
+            recovered = re.findall(r".*?Error in parsing LLM output: `(.*)`", response)
+            if not recovered:
+                raise error
+        return recovered[0]
+
+    @timed("bot", "generate")
+    async def __call__(self, message: Message, conversation_id: str, history: str = None):
+        # Traces are exported in the background, the response never waits for them
+        # A given history, e.g. kept by a connection, replaces the memory read
+        inputs = {"input": message.message, "conversation_id": conversation_id, "history": history}
+        if self.mode != BotModes.REACT:
+            output = await self.brain.ainvoke(inputs)
+            return Message(message=self._output_text(output), role=self.config.ai_prefix)
+        try:
+            output = self.brain.invoke(inputs)['output']
+        except ValueError as e:
+            output = self._recover_react_output(e)
+
+        output = Message(message=output, role=self.config.ai_prefix)
+        return output
+
+    async def astream(self, message: Message, conversation_id: str, history: str = None) -> AsyncIterator[str]:
+        """
+        Answer chunks as they are generated. Direct chains stream model tokens, agents yield their final answer
+        at once since their intermediate steps are not part of the answer.
+        """
+        if self.mode != BotModes.DIRECT:
+            output = await self(message, conversation_id=conversation_id, history=history)
+            yield output.message
+            return
+        async for chunk in self.brain.astream(
+                {"input": message.message, "conversation_id": conversation_id, "history": history}):
+            yield chunk
+
+    async def abatch(
+            self,
+            items: List[Tuple[str, str]],
+            max_concurrency: int = None
+    ) -> AsyncIterator[BatchResult]:
+        """
+        Answer independent (input, conversation_id) items, at most `max_concurrency` at a time, yielding each
+        result or error as soon as it finishes. Histories are read before and turns written after the batch
+        with bulk queries, so items of the same conversation do not see each other.
+        """
+        if not items:
+            return
+        max_concurrency = max_concurrency or self.config.batch_max_concurrency
+        histories = await asyncio.to_thread(self.load_histories, items)
+        inputs = [
+            {"input": sentence, "conversation_id": conversation_id, "history": history}
+            for (sentence, conversation_id), history in zip(items, histories)
+        ]
+        turns = []
+        try:
+            async for index, output in self.brain.abatch_as_completed(
+                    inputs, config={"max_concurrency": max_concurrency}, return_exceptions=True):
+                sentence, conversation_id = items[index]
+                try:
+                    if isinstance(output, ValueError) and self.mode == BotModes.REACT:
+                        output = self._recover_react_output(output)
+                    elif isinstance(output, Exception):
+                        raise output
+                    else:
+                        output = self._output_text(output)
+                except Exception as e:
+                    count("bot", "batch_error")
+                    self.logger.error(f"Batch item {index} of conversation <{conversation_id}> failed: {e}")
+                    yield BatchResult(index=index, conversation_id=conversation_id, error=str(e))
+                    continue
+                turns.append(MessageTurn(
+                    human_message=Message(message=sentence, role=self.config.human_prefix),
+                    ai_message=Message(message=output, role=self.config.ai_prefix),
+                    conversation_id=conversation_id
+                ))
+                yield BatchResult(index=index, conversation_id=conversation_id, output=output)
         finally:
-            # Wait for invoke chain finish before push to Langsmith
-            wait_for_all_tracers()
+            # Answers already streamed are kept even when the client goes away mid-batch
+            if turns:
+                await asyncio.to_thread(self.persist_turns, turns)
 
     def predict(self, sentence: str, conversation_id: str = None):
         message = Message(message=sentence, role=self.config.human_prefix)
         output = asyncio.run(self(message, conversation_id=conversation_id))
-        self.add_message_to_memory(human_message=message, ai_message=output, conversation_id=conversation_id)
+        self.persist(human_message=message, ai_message=output, conversation_id=conversation_id)
         return output
     
     def call(self, input: dict):
-        return self.predict(**input)
\ No newline at end of file
+        return self.predict(**input)
+
+    def close(self, timeout: float = 5.0):
+        """Give the outbox a chance to write what is pending, the rest is replayed on the next start"""
+        if self.outbox is not None:
+            self.outbox.close(timeout=timeout)
+        if self.summarizer is not None:
+            self.summarizer.close()
+        close_memory = getattr(self.memory, "close", None)
+        if close_memory is not None:
+            close_memory()
\ No newline at end of file
@@ -1,10 +1,12 @@
-from typing import Optional
-from langchain_core.prompts import PromptTemplate
-from langchain.callbacks.tracers.langchain import wait_for_all_tracers
+from typing import Optional, Union
+from langchain_core.prompts import PromptTemplate, BasePromptTemplate
+from langchain_core.language_models import BaseChatModel
 from langchain.hub import pull as hub_pull
 
 from common.config import BaseObject, Config
 from common.objects import Message
+from common.metrics import timed
+from common.tracing import get_trace_exporter
 from models import ModelTypes, MODEL_TO_CLASS
 
 class ChainManager(BaseObject):
@@ -12,13 +14,16 @@ class ChainManager(BaseObject):
             self,
             config: Config=None,
             model: Optional[ModelTypes]=None,
-            prompt_template: str = None,
+            prompt_template: Union[str, BasePromptTemplate] = None,
             model_kwargs: Optional[dict]=None,
-            partial_variables: dict=None
+            partial_variables: dict=None,
+            base_model: Optional[BaseChatModel]=None
             ):
         super().__init__()
         self.config = config if config is not None else Config()
-        self._base_model = self.get_model(model_type=model, parameters=model_kwargs)
+        # A prebuilt model can be shared by several chains
+        self._base_model = base_model if base_model is not None \
+            else self.get_model(model_type=model, parameters=model_kwargs)
         self._init_prompt_template(template_path=prompt_template, partial_variables=partial_variables)
         self._init_chain()
 
@@ -27,7 +32,15 @@ class ChainManager(BaseObject):
             model_type: Optional[ModelTypes] = None,
             parameters: Optional[dict] = None
     ):
-        parameters = parameters or {}
+        return self.build_model(config=self.config, model_type=model_type, parameters=parameters)
+
+    @staticmethod
+    def build_model(
+            config: Config,
+            model_type: Optional[ModelTypes] = None,
+            parameters: Optional[dict] = None
+    ):
+        parameters = dict(parameters or {})
         model_name = parameters.pop("model_name", None)
         if model_type is None:
             model_type = ModelTypes.GROQ
@@ -47,20 +60,34 @@ class ChainManager(BaseObject):
 
         if model_type in [ModelTypes.GROQ]:
             if model_name:
-                model_name = self.config.base_model_name
+                model_name = config.base_model_name
             return model_class(model_name=model_name, **parameters)
         return model_class(**parameters, return_messages=True)
 
+    @property
+    def base_model(self):
+        return self._base_model
+
+    @property
+    def prompt(self):
+        return self._prompt
+
     def _init_chain(self):
         self.chain = (self._prompt | self._base_model).with_config(run_name="GenerateResponse")
 
-    def _init_prompt_template(self, template_path: str = None, partial_variables=None):
+    def _init_prompt_template(self, template_path: Union[str, BasePromptTemplate] = None, partial_variables=None):
         partial_variables = partial_variables or {}
-        try:
-            prompt: PromptTemplate = hub_pull(template_path)
-        except Exception as e:
-            self.logger.warning(f"Failed to pull prompt form hub: {e}")
+        if isinstance(template_path, BasePromptTemplate):
+            prompt = template_path
+        elif "{" in template_path:
+            # Inline template, no need for a round trip to the hub
             prompt = PromptTemplate.from_template(template_path)
+        else:
+            try:
+                prompt: PromptTemplate = hub_pull(template_path)
+            except Exception as e:
+                self.logger.warning(f"Failed to pull prompt form hub: {e}")
+                prompt = PromptTemplate.from_template(template_path)
         self._prompt = prompt.partial(**partial_variables)
     
     def chain_stream(self, input: str, conversation_id: str):
@@ -69,14 +96,16 @@ class ChainManager(BaseObject):
             include_names=["StreamResponse"]
         )
     
+    @timed("chain", "predict")
     async def _predict(self, message: Message, converstion_id: str):
-        try:
-            output = self.chain.invoke({"input": message.message, "conversation_id": str})
-            output = Message(message=output, role=self.config.ai_prefix)
-            return output
-        finally:
-            # Wait for invoke chain finish before push to Langsmith
-            wait_for_all_tracers()
+        # Traces are exported in the background, the response never waits for them
+        trace_exporter = get_trace_exporter(self.config)
+        output = self.chain.invoke(
+            {"input": message.message, "conversation_id": str},
+            config={"callbacks": [trace_exporter]} if trace_exporter is not None else None
+        )
+        output = Message(message=output, role=self.config.ai_prefix)
+        return output
 
     async def __call__(self, message: Message, conversation_id: str):
         output: Message = await self._predict(message=message, converstion_id=conversation_id)
@@ -1,37 +1,77 @@
-from typing import Any, Dict, Optional
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
+import logging
 import os
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+from langchain_core.language_models import BaseChatModel
 from langchain_groq import ChatGroq
 
 from config import settings
 from database.mongodb import MongodbClient
+from memory.summary import ConversationSummarizer, MongoSummaryStore
+from common.outbox import DurableOutbox
+from common.metrics import MetricsCallbackHandler, count, track
 from dotenv import load_dotenv
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 class ChatManager:
     """ Manager for chat interactions with LLMs"""
 
     def __init__(self,
                  model_name: Optional[str]=None,
                  temperature: float = 0.7,
+                 db: Optional[MongodbClient] = None,
+                 model: Optional[BaseChatModel] = None,
+                 summarizer: Optional[ConversationSummarizer] = None,
                  ):
         """Initialize the chat manager.
         
         Args:
             model_name: Name of the model to use, defaults to configuration.
             temperature: Temperature for generation, higher means more creative.
+            db: Optional database client, defaults to a new MongodbClient.
+            model: Optional chat model, defaults to Groq with `model_name`.
+            summarizer: Optional conversation summarizer, built from settings when
+                `summary_threshold` is set.
         """
          
         self.model_name = model_name or settings.base_model_name
         self.temperature = temperature
+        self._model = model
 
         #initialize database client
-        self.db = MongodbClient()
+        self.db = db if db is not None else MongodbClient()
         
         #initialize chat components
         self._init_chat_components()
 
+        #compact long conversations into a summary stored next to the history
+        if summarizer is None and settings.summary_threshold:
+            summarizer = ConversationSummarizer(
+                model=self.model,
+                store=MongoSummaryStore(
+                    session_id=self.db.collection.name,
+                    collection=self.db.db[f"{self.db.collection.name}_summaries"]
+                ),
+                threshold=settings.summary_threshold,
+                keep_turns=settings.summary_keep_turns,
+            )
+        self.summarizer = summarizer
+
+        #answer first, message pairs are written by a background thread through a local file
+        self.outbox = None
+        if settings.outbox_directory:
+            self.outbox = DurableOutbox(
+                directory=settings.outbox_directory,
+                name=self.db.collection.name,
+                handler=self._write_records,
+                batch_size=settings.outbox_batch_size,
+                fsync_interval=settings.outbox_fsync_interval,
+            )
+
     def _init_chat_components(self) -> None:
         """Initialize chat components."""
 
@@ -50,17 +90,22 @@ class ChatManager:
         )
 
         #create the caht model - using groq for now
-        groq_api_key = os.getenv("GROQ_API_KEY")
-        self.model = ChatGroq(
-            model=self.model_name,
-            temperature=self.temperature,
-            api_key=groq_api_key,
-        )
+        if self._model is not None:
+            self.model = self._model
+        else:
+            groq_api_key = os.getenv("GROQ_API_KEY")
+            self.model = ChatGroq(
+                model=self.model_name,
+                temperature=self.temperature,
+                api_key=groq_api_key,
+            )
 
         self.output_parser = StrOutputParser()
 
         #create the chain
-        self.chain = self.template | self.model | self.output_parser
+        self.chain = (self.template | self.model | self.output_parser).with_config(
+            callbacks=[MetricsCallbackHandler("chat_manager")]
+        )
 
     async def process_message(self, user_input: str, conversation_id: str):
         """Process a user message and return the AI response.
@@ -73,31 +118,184 @@ class ChatManager:
         """
 
         #Get conversation history
-        history = self.db.format_history(conversation_id)
+        with track("chat_manager", "history_load"):
+            pending = self._pending_history(conversation_id)
+            history = None
+            if self.summarizer is not None:
+                history = self.summarizer.load_history(conversation_id)
+            if history is None:
+                history = self.db.format_history(conversation_id)
+            history = self._join_history(history, pending)
 
         #generate response
-        response = await self.chain.ainvoke({
-            "history": history,
-            "input": user_input
-        })
+        with track("chat_manager", "generate"):
+            response = await self.chain.ainvoke({
+                "history": history,
+                "input": user_input
+            })
         
         #add message pair to history
-        self.db.add_conversation_message(
-            conversation_id=conversation_id,
-            user_message=user_input,
-            ai_message=response
-        )
+        with track("chat_manager", "persist"):
+            if self.outbox is not None:
+                self.outbox.append({"conversation_id": conversation_id, "user": user_input, "ai": response})
+            else:
+                self._persist_batch([(conversation_id, user_input, response)])
         
         return response
+
+    def _pending_history(self, conversation_id: str) -> str:
+        """Message pairs answered but still in the outbox, read before the database so none is missed."""
+        if self.outbox is None:
+            return ""
+        return self.db.format_messages(self.outbox.pending(conversation_id))
+
+    @staticmethod
+    def _join_history(history: str, pending: str) -> str:
+        if not pending:
+            return history
+        return f"{history}\n\n{pending}" if history else pending
+
+    def _write_records(self, records: List[Dict[str, Any]]) -> None:
+        """Outbox handler, stores the drained message pairs with one bulk write."""
+        self._persist_batch([(record["conversation_id"], record["user"], record["ai"]) for record in records])
     
+    def _load_histories(self, conversation_ids: List[str]) -> Dict[str, str]:
+        """Histories of many conversations, the ones without a summary read with one query."""
+        histories: Dict[str, str] = {}
+        pending = {conversation_id: self._pending_history(conversation_id) for conversation_id in conversation_ids}
+        if self.summarizer is not None:
+            for conversation_id in conversation_ids:
+                history = self.summarizer.load_history(conversation_id)
+                if history is not None:
+                    histories[conversation_id] = history
+        missing = [conversation_id for conversation_id in conversation_ids if conversation_id not in histories]
+        if missing:
+            histories.update(self.db.format_histories(missing))
+        return {
+            conversation_id: self._join_history(histories.get(conversation_id, ""), pending[conversation_id])
+            for conversation_id in conversation_ids
+        }
+
+    def _persist_batch(self, turns: List[Tuple[str, str, str]]) -> None:
+        """Store the message pairs of a batch with one bulk write.
+        
+        A failed write raises, so the outbox retries the batch. The summarizer is given the pairs only
+        once they are stored, its errors are logged so a stored batch is not written twice.
+        """
+        earlier: Dict[str, str] = {}
+        if self.summarizer is not None:
+            # Read before the write, so the history seeding a newly tracked conversation does not hold the batch
+            for conversation_id in dict.fromkeys(conversation_id for conversation_id, _, _ in turns):
+                if self.summarizer.load_state(conversation_id) is None:
+                    earlier[conversation_id] = self.db.format_history(conversation_id)
+        self.db.add_conversation_messages(turns)
+        if self.summarizer is None:
+            return
+        try:
+            for conversation_id, user_input, response in turns:
+                self.summarizer.add_turn(
+                    conversation_id,
+                    f"User: {user_input}\nAI: {response}",
+                    history=lambda conversation_id=conversation_id: earlier.get(conversation_id, "")
+                )
+        except Exception as e:
+            count("chat_manager", "summarize_error")
+            logger.error(f"Could not add {len(turns)} message pairs to the conversation summaries: {e}")
+
+    async def process_batch(
+            self,
+            items: List[Tuple[str, str]],
+            max_concurrency: Optional[int] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Answer independent messages concurrently, yielding each result as soon as it finishes.
+        
+        Histories are read before and message pairs written after the batch with bulk queries,
+        so messages of the same conversation do not see each other.
+        
+        Args:
+            items: (user_input, conversation_id) pairs.
+            max_concurrency: Messages generated at once, defaults to configuration.
+            
+        Yields:
+            Dicts with the item index, conversation_id and either output or error.
+        """
+        if not items:
+            return
+        max_concurrency = max_concurrency or settings.batch_max_concurrency
+
+        with track("chat_manager", "history_load_batch"):
+            histories = await asyncio.to_thread(
+                self._load_histories, list(dict.fromkeys(conversation_id for _, conversation_id in items))
+            )
+
+        inputs = [
+            {"history": histories[conversation_id], "input": user_input}
+            for user_input, conversation_id in items
+        ]
+        turns: List[Tuple[str, str, str]] = []
+        try:
+            async for index, response in self.chain.abatch_as_completed(
+                    inputs, config={"max_concurrency": max_concurrency}, return_exceptions=True):
+                user_input, conversation_id = items[index]
+                if isinstance(response, Exception):
+                    count("chat_manager", "batch_error")
+                    yield {"index": index, "conversation_id": conversation_id, "error": str(response)}
+                    continue
+                turns.append((conversation_id, user_input, response))
+                yield {"index": index, "conversation_id": conversation_id, "output": response}
+        finally:
+            # Answers already streamed are kept even when the client goes away mid-batch
+            if turns:
+                with track("chat_manager", "persist_batch"):
+                    if self.outbox is not None:
+                        for conversation_id, user_input, response in turns:
+                            self.outbox.append({"conversation_id": conversation_id, "user": user_input, "ai": response})
+                    else:
+                        await asyncio.to_thread(self._persist_batch, turns)
+
+    def get_messages(self, conversation_id: str, cursor: Optional[str] = None, limit: int = 50):
+        """Get one page of the conversation history.
+        
+        Args:
+            conversation_id: ID of the conversation.
+            cursor: Cursor returned with the previous page.
+            limit: Maximum number of message pairs.
+            
+        Returns:
+            Message pairs and the cursor of the next page.
+        """
+        return self.db.get_messages_page(conversation_id, cursor=cursor, limit=limit)
+
+    def iter_messages(self, conversation_id: str):
+        """Iterate over the whole conversation history in bounded memory.
+        
+        Args:
+            conversation_id: ID of the conversation.
+        """
+        return self.db.iter_messages(conversation_id)
+
     def clear_history(self, conversation_id: str) -> None:
         """Clear the conversation history.
         
         Args:
             conversation_id: ID of the conversation.
+
+        Raises:
+            TimeoutError: The outbox did not drain in time, nothing was cleared.
         """
+        # Pairs still in the outbox would be read back into history and written after the delete
+        if self.outbox is not None and not self.outbox.flush(timeout=settings.outbox_flush_timeout):
+            raise TimeoutError(f"Outbox {self.outbox.path} did not drain in {settings.outbox_flush_timeout}s, "
+                               f"history was not cleared")
         self.db.clear_conversation_history(conversation_id)
+        if self.summarizer is not None:
+            self.summarizer.clear(conversation_id)
     
     def close(self) -> None:
         """Close resources."""
+        if self.outbox is not None:
+            #what is not written in time is replayed on the next start
+            self.outbox.close()
+        if self.summarizer is not None:
+            self.summarizer.close()
         self.db.close() 
\ No newline at end of file
@@ -4,24 +4,11 @@ import json
 import vertexai
 import urllib.parse
 
-from .constants import CHAT_MODEL_NAME
+from .constants import CHAT_MODEL_NAME, NLP_MODEL_SIZES
 from .common_keys import *
 
 
-class Singleton(type):
-    _instances = {}
-
-    def __call__(cls, *args, **kwargs):
-        if cls not in cls._instances:
-            cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
-        return cls._instances[cls]
-
-
-class BaseSingleton(metaclass=Singleton):
-    pass
-
-
-class BaseObject(BaseSingleton):
+class BaseObject:
     def __init__(self, **kwargs):
         self.logger = logging.getLogger(self.class_name())
 
@@ -54,7 +41,53 @@ class Config(BaseObject):
             postgres_connection_string: str = None,
             postgres_database_name: str = None,
             postgres_table_name: str = None,
-            memory_window_size: int = 5
+            memory_window_size: int = 5,
+            anonymizer_model_sizes: dict = None,
+            anonymizer_idle_seconds: float = None,
+            tool_timeout: float = 10,
+            trace_sink: str = None,
+            trace_file_path: str = None,
+            trace_buffer_size: int = 1000,
+            trace_batch_size: int = 100,
+            trace_flush_interval: float = 1.0,
+            trace_drop_policy: str = "drop_oldest",
+            summary_store: str = None,
+            summary_threshold: int = None,
+            summary_keep_turns: int = 4,
+            retention_max_age_days: float = None,
+            retention_max_turns: int = None,
+            retention_batch_size: int = 1000,
+            retention_pause_seconds: float = 0.05,
+            retention_interval_seconds: float = 300,
+            batch_max_concurrency: int = None,
+            embedding_storage: str = None,
+            embedding_rerank: bool = None,
+            embedding_rerank_factor: int = 4,
+            semantic_recall: bool = None,
+            recall_top_k: int = 3,
+            recall_directory: str = None,
+            embedding_backend: str = None,
+            embedding_model_dir: str = None,
+            embedding_threads: int = None,
+            outbox_directory: str = None,
+            outbox_batch_size: int = 100,
+            outbox_fsync_interval: float = 0.05,
+            outbox_flush_timeout: float = 10.0,
+            sqlite_path: str = None,
+            tiered_hot_turns: int = 50,
+            tiered_idle_seconds: int = None,
+            sql_pool_size: int = None,
+            sql_max_overflow: int = None,
+            sql_pool_timeout: float = 30,
+            sql_pool_recycle: int = 1800,
+            sql_pool_pre_ping: bool = True,
+            mongo_max_pool_size: int = None,
+            mongo_min_pool_size: int = None,
+            mongo_max_idle_time_ms: int = 300000,
+            mongo_connect_timeout_ms: int = 10000,
+            mongo_server_selection_timeout_ms: int = 10000,
+            mongo_wait_queue_timeout_ms: int = 10000,
+            mongo_compressors: str = None
     ):
         super().__init__()
         self.credentials = credentials if credentials is not None else os.getenv(CREDENTIALS_FILE,
@@ -110,6 +143,84 @@ class Config(BaseObject):
         self.human_prefix = os.getenv(HUMAN_PREFIX, "Human")
         self.memory_key = os.getenv(MEMORY_KEY, "history")
         self.enable_anonymizer = False
+        self.anonymizer_model_sizes = {**NLP_MODEL_SIZES, **(anonymizer_model_sizes or {})}
+        # Unload language pipelines that have not been used for this many seconds (None disables)
+        self.anonymizer_idle_seconds = anonymizer_idle_seconds
+        self.tool_timeout = tool_timeout
+        # One of "none", "langsmith" or "file"
+        self.trace_sink = trace_sink if trace_sink is not None else os.getenv(TRACE_SINK, "none")
+        self.trace_file_path = trace_file_path if trace_file_path is not None \
+            else os.getenv(TRACE_FILE_PATH, "traces/traces.jsonl")
+        self.trace_buffer_size = trace_buffer_size
+        self.trace_batch_size = trace_batch_size
+        self.trace_flush_interval = trace_flush_interval
+        self.trace_drop_policy = trace_drop_policy
+        # Fold older turns into a running summary once this many are not summarized (0 disables)
+        self.summary_threshold = summary_threshold if summary_threshold is not None \
+            else int(os.getenv(SUMMARY_THRESHOLD, "0"))
+        self.summary_keep_turns = summary_keep_turns
+        # One of "in-memory", "mongodb", "redis" or "sql"
+        self.summary_store = summary_store if summary_store is not None else os.getenv(SUMMARY_STORE, "in-memory")
+        # Purge SQL chat history older than this many days or beyond this many turns per conversation (0 disables)
+        self.retention_max_age_days = retention_max_age_days if retention_max_age_days is not None \
+            else float(os.getenv(RETENTION_MAX_AGE_DAYS, "0"))
+        self.retention_max_turns = retention_max_turns if retention_max_turns is not None \
+            else int(os.getenv(RETENTION_MAX_TURNS, "0"))
+        self.retention_batch_size = retention_batch_size
+        self.retention_pause_seconds = retention_pause_seconds
+        self.retention_interval_seconds = retention_interval_seconds
+        # Prompts of a batch request generated at once
+        self.batch_max_concurrency = batch_max_concurrency if batch_max_concurrency is not None \
+            else int(os.getenv(BATCH_MAX_CONCURRENCY, "8"))
+        # Local database file of the embedded sqlite-memory
+        self.sqlite_path = sqlite_path if sqlite_path is not None else os.getenv(SQLITE_PATH, "data/chat_memory.db")
+        # tiered-memory keeps the last tiered_hot_turns turns of a conversation in Redis until it is idle that long
+        self.tiered_hot_turns = tiered_hot_turns
+        self.tiered_idle_seconds = tiered_idle_seconds if tiered_idle_seconds is not None \
+            else int(os.getenv(TIERED_IDLE_SECONDS, "3600"))
+        # One of "vector", "halfvec" or "binary", the layout turn embeddings are stored and searched in
+        self.embedding_storage = embedding_storage if embedding_storage is not None \
+            else os.getenv(EMBEDDING_STORAGE, "vector")
+        # Keep full-precision vectors to reorder the top `embedding_rerank_factor` x k compact matches
+        self.embedding_rerank = embedding_rerank if embedding_rerank is not None \
+            else os.getenv(EMBEDDING_RERANK, "false").lower() == "true"
+        self.embedding_rerank_factor = embedding_rerank_factor
+        # In-process similarity recall for the memories without pgvector, memory-mapped under recall_directory if set
+        self.semantic_recall = semantic_recall if semantic_recall is not None \
+            else os.getenv(SEMANTIC_RECALL, "false").lower() == "true"
+        self.recall_top_k = recall_top_k
+        self.recall_directory = recall_directory if recall_directory is not None else os.getenv(RECALL_DIRECTORY)
+        # One of "sentence-transformers", "onnx" or "onnx-int8", the ONNX models are read from embedding_model_dir
+        self.embedding_backend = embedding_backend if embedding_backend is not None \
+            else os.getenv(EMBEDDING_BACKEND, "sentence-transformers")
+        self.embedding_model_dir = embedding_model_dir if embedding_model_dir is not None \
+            else os.getenv(EMBEDDING_MODEL_DIR, "models/all-MiniLM-L6-v2-onnx")
+        self.embedding_threads = embedding_threads
+        # Turns are answered first and written through a local outbox under outbox_directory when it is set
+        self.outbox_directory = outbox_directory if outbox_directory is not None else os.getenv(OUTBOX_DIRECTORY)
+        self.outbox_batch_size = outbox_batch_size
+        self.outbox_fsync_interval = outbox_fsync_interval
+        # Longest wait for an outbox to drain before an operation that needs its records written
+        self.outbox_flush_timeout = outbox_flush_timeout
+        # Pool of each SQL engine, shared by every memory and store of the process using the same URL
+        self.sql_pool_size = sql_pool_size if sql_pool_size is not None else int(os.getenv(SQL_POOL_SIZE, "10"))
+        self.sql_max_overflow = sql_max_overflow if sql_max_overflow is not None \
+            else int(os.getenv(SQL_MAX_OVERFLOW, "20"))
+        self.sql_pool_timeout = sql_pool_timeout
+        self.sql_pool_recycle = sql_pool_recycle
+        self.sql_pool_pre_ping = sql_pool_pre_ping
+        # Pool of each MongoClient, shared by every Mongo memory and store of the process using the same URI
+        self.mongo_max_pool_size = mongo_max_pool_size if mongo_max_pool_size is not None \
+            else int(os.getenv(MONGO_MAX_POOL_SIZE, "100"))
+        self.mongo_min_pool_size = mongo_min_pool_size if mongo_min_pool_size is not None \
+            else int(os.getenv(MONGO_MIN_POOL_SIZE, "0"))
+        self.mongo_max_idle_time_ms = mongo_max_idle_time_ms
+        self.mongo_connect_timeout_ms = mongo_connect_timeout_ms
+        self.mongo_server_selection_timeout_ms = mongo_server_selection_timeout_ms
+        self.mongo_wait_queue_timeout_ms = mongo_wait_queue_timeout_ms
+        # Comma separated wire compressors, e.g. "zstd,snappy,zlib", unset sends uncompressed
+        self.mongo_compressors = mongo_compressors if mongo_compressors is not None \
+            else os.getenv(MONGO_COMPRESSORS, "")
 
     def init_env(self):
         credential_data = json.load(open(self.credentials, "r"))
@@ -9,5 +9,11 @@ NLP_CONFIG = {
         {"lang_code": "en", "model_name": "en_core_web_md"}
     ],
 }
+# spaCy pipelines available per language, keyed by size
+NLP_MODELS = {
+    "vi": {"lg": "vi_core_news_lg"},
+    "en": {"sm": "en_core_web_sm", "md": "en_core_web_md", "lg": "en_core_web_lg"},
+}
+NLP_MODEL_SIZES = {"vi": "lg", "en": "md"}
 PERSONAL_CHAT_PROMPT_REACT = "minhi/personality-chat-react-prompt"
 PERSONAL_CHAT_PROMPT = "minhi/personality-chatbot_backend-prompt"
@@ -1,10 +1,9 @@
 from pydantic import BaseModel, Field
 from typing import Optional, List, Dict
-from sqlalchemy import Column, Integer, String, DateTime, Index, JSON
+from sqlalchemy import Column, Integer, String, DateTime, Index, JSON, Text
 from sqlalchemy.dialects.mysql import JSON as MySQLJSON
 from datetime import datetime
 from sqlalchemy.orm import declarative_base
-from pgvector.sqlalchemy import Vector
 
 Base = declarative_base()
 
@@ -22,6 +21,32 @@ class MessageTurn(BaseModel):
 class ChatRequest(BaseModel):
     input: str
     conversation_id: Optional[str]
+    bot_id: Optional[str] = None
+
+
+class MessagePage(BaseModel):
+    messages: List[dict] = Field(description="Message turns, oldest first")
+    next_cursor: Optional[str] = Field(default=None, description="Cursor of the next page, None on the last page")
+
+
+class InvalidCursorError(ValueError):
+    """A pagination cursor that was not returned with an earlier page"""
+
+
+def parse_int_cursor(cursor: Optional[str]) -> Optional[int]:
+    """Id or offset cursor of a page, None for the first page"""
+    if cursor is None:
+        return None
+    if not (cursor.isascii() and cursor.isdigit()):
+        raise InvalidCursorError(f"Got malformed cursor: {cursor!r}")
+    return int(cursor)
+
+
+class BatchResult(BaseModel):
+    index: int = Field(description="Position of the item in the batch")
+    conversation_id: str = Field(description="Conversation of the item")
+    output: Optional[str] = Field(default=None, description="Answer, None when the item failed")
+    error: Optional[str] = Field(default=None, description="Error of a failed item")
 
 
 def messages_from_dict(message: dict) -> str:
@@ -52,10 +77,24 @@ class ChatMemory(Base):
     ConversationId = Column(String(255, collation=None), nullable=False, quote=True, name="ConversationId")
     SessionId = Column(String(255, collation=None), nullable=False, quote=True, name="SessionId")
     History = Column(JSON, nullable=False, quote=True, name="History")
-    Embedding = Column(Vector(384), quote=True, name="Embedding")
     CreatedAt = Column(DateTime, default=datetime.utcnow, quote=True, name="CreatedAt")
 
     __table_args__ = (
         Index("idx_sessionid", "SessionId"),
+        # Tail reads and per-conversation retention
+        Index("idx_conversation_created", "SessionId", "ConversationId", "CreatedAt"),
+        # Age based retention
+        Index("idx_created", "CreatedAt"),
     )
 
+
+
+class ConversationSummary(Base):
+    __tablename__ = "conversation_summary"
+
+    SessionId = Column(String(255), primary_key=True, quote=True, name="SessionId")
+    ConversationId = Column(String(255), primary_key=True, quote=True, name="ConversationId")
+    Summary = Column(Text, nullable=False, default="", quote=True, name="Summary")
+    Turns = Column(JSON, nullable=False, quote=True, name="Turns")
+    FoldedTurns = Column(Integer, nullable=False, default=0, quote=True, name="FoldedTurns")
+    UpdatedAt = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, quote=True, name="UpdatedAt")
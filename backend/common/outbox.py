@@ -0,0 +1,306 @@
+"""Durable local outbox: records are appended to a file and handed to their backend by a background thread."""
+import fcntl
+import glob
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from common.metrics import REGISTRY, count, observe
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BACKLOG = REGISTRY.gauge(
+    "chatbot_outbox_backlog_bytes", "Bytes appended to an outbox and not yet written to its backend", ("outbox",)
+)
+
+Handler = Callable[[List[Dict[str, Any]]], None]
+
+
+class DurableOutbox:
+    """
+    Append-only log of records waiting to be written by `handler`, a callable taking a list of records.
+
+    `append` returns as soon as the record is in the file. A background thread fsyncs the file once per
+    `fsync_interval` for everything appended meanwhile, then hands the records to `handler` in batches,
+    in append order, retrying with backoff while it fails. A crash of the process loses nothing, a power
+    loss at most the last interval. Records are delivered at least once: a crash between a write and the
+    update of the drained offset writes that batch again.
+
+    Each process appends to its own `<name>-<pid>.jsonl` under `directory`, so pre-forked workers never
+    share a file. Files left behind by processes that are gone are replayed when an outbox starts.
+    """
+
+    def __init__(
+            self,
+            directory: str,
+            name: str,
+            handler: Handler,
+            batch_size: int = 100,
+            fsync_interval: float = 0.05,
+            retry_seconds: float = 1.0,
+            max_retry_seconds: float = 30.0,
+            compact_bytes: int = 1024 * 1024,
+            key: str = "conversation_id",
+    ):
+        self.directory = directory
+        self.name = name
+        self.handler = handler
+        self.batch_size = batch_size
+        self.fsync_interval = fsync_interval
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self.compact_bytes = compact_bytes
+        self.key = key
+        os.makedirs(directory, exist_ok=True)
+        self._open()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    # ----------------------------------------
+    # Files
+    # ----------------------------------------
+    def _open(self):
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._dirty = False
+        self.path = os.path.join(self.directory, f"{self.name}-{os.getpid()}.jsonl")
+        self._file = open(self.path, "ab")
+        # Held while the process lives, other processes only replay files they can lock
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._reader = open(self.path, "rb")
+        self._offset = self._read_offset(self.path)
+        self._size = self._truncate_torn(self._file, self.path)
+        # key -> [(end offset, record)] of records not yet drained, read back into history
+        self._pending: Dict[str, List[Tuple[int, Dict[str, Any]]]] = {}
+        for end, record in self._read_records(self._reader, self._offset, self._size):
+            self._track(end, record)
+        self._worker = threading.Thread(target=self._work, name=f"outbox-{self.name}", daemon=True)
+        self._worker.start()
+
+    def _after_fork(self):
+        """Threads and file locks do not belong to a forked worker, it gets its own file and thread"""
+        if self._stopped:
+            return
+        # Closing the inherited descriptors leaves the parent's lock in place
+        self._file.close()
+        self._reader.close()
+        self._open()
+
+    @staticmethod
+    def _offset_path(path: str) -> str:
+        return path + ".offset"
+
+    def _read_offset(self, path: str) -> int:
+        try:
+            with open(self._offset_path(path), "r") as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _write_offset(self, path: str, offset: int):
+        tmp_path = self._offset_path(path) + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._offset_path(path))
+
+    def _remove(self, path: str):
+        os.remove(path)
+        if os.path.exists(self._offset_path(path)):
+            os.remove(self._offset_path(path))
+
+    @staticmethod
+    def _truncate_torn(file, path: str) -> int:
+        """Drop a last line torn by a crash, its append never returned, and return the size of the file"""
+        size = os.path.getsize(path)
+        valid = size
+        with open(path, "rb") as f:
+            while valid > 0:
+                start = max(0, valid - 65536)
+                f.seek(start)
+                newline = f.read(valid - start).rfind(b"\n")
+                if newline >= 0:
+                    valid = start + newline + 1
+                    break
+                valid = start
+        if valid < size:
+            os.ftruncate(file.fileno(), valid)
+        return valid
+
+    def _read_records(self, reader, start: int, end: int, limit: int = None) -> List[Tuple[int, Dict[str, Any]]]:
+        """(end offset, record) of the complete lines between two offsets"""
+        reader.seek(start)
+        records = []
+        position = start
+        while position < end and (limit is None or len(records) < limit):
+            line = reader.readline()
+            if not line.endswith(b"\n"):
+                break
+            position += len(line)
+            records.append((position, json.loads(line)))
+        return records
+
+    def _track(self, end: int, record: Dict[str, Any]):
+        key = record.get(self.key)
+        if key is not None:
+            self._pending.setdefault(key, []).append((end, record))
+
+    # ----------------------------------------
+    # Writes
+    # ----------------------------------------
+    def append(self, record: Dict[str, Any]):
+        line = (json.dumps(record, default=str, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError(f"Outbox {self.path} is closed")
+            self._file.write(line)
+            self._file.flush()
+            self._size += len(line)
+            self._dirty = True
+            self._track(self._size, record)
+            self._condition.notify()
+        count("outbox", "appended")
+
+    def pending(self, key: str) -> List[Dict[str, Any]]:
+        """Records of a key appended and not yet written by the handler, oldest first"""
+        with self._condition:
+            return [record for _, record in self._pending.get(key, [])]
+
+    @property
+    def backlog(self) -> int:
+        return self._size - self._offset
+
+    # ----------------------------------------
+    # Background thread
+    # ----------------------------------------
+    def _sync(self):
+        with self._condition:
+            if not self._dirty:
+                return
+            self._dirty = False
+            fileno = self._file.fileno()
+        start = time.perf_counter()
+        os.fsync(fileno)
+        observe("outbox", "fsync", time.perf_counter() - start)
+
+    def _deliver(self, records: List[Dict[str, Any]]) -> bool:
+        """Hand records to the handler, retrying with backoff until it succeeds or the outbox stops"""
+        delay = self.retry_seconds
+        while True:
+            try:
+                start = time.perf_counter()
+                self.handler(records)
+                observe("outbox", "drain", time.perf_counter() - start)
+                count("outbox", "drained", amount=len(records))
+                return True
+            except Exception as e:
+                count("outbox", "drain_error")
+                logger.warning(f"Outbox {self.name} could not write {len(records)} records, retrying in {delay:.1f}s: {e}")
+            with self._condition:
+                if self._stopped:
+                    return False
+                self._condition.wait(timeout=delay)
+            delay = min(delay * 2, self.max_retry_seconds)
+
+    def _drain(self) -> bool:
+        """Write one batch, returning whether there was anything to write"""
+        with self._condition:
+            offset, size = self._offset, self._size
+        if offset >= size:
+            return False
+        batch = self._read_records(self._reader, offset, size, limit=self.batch_size)
+        if not batch or not self._deliver([record for _, record in batch]):
+            return False
+        end = batch[-1][0]
+        self._write_offset(self.path, end)
+        with self._condition:
+            self._offset = end
+            for key in list(self._pending):
+                records = [(e, record) for e, record in self._pending[key] if e > end]
+                if records:
+                    self._pending[key] = records
+                else:
+                    del self._pending[key]
+            # Everything written, start the file over once it is big enough to matter
+            if self._offset == self._size and self._size >= self.compact_bytes:
+                os.ftruncate(self._file.fileno(), 0)
+                self._offset = self._size = 0
+                self._write_offset(self.path, 0)
+                count("outbox", "compaction")
+            OUTBOX_BACKLOG.set(self.name, value=self._size - self._offset)
+        return True
+
+    def _replay_orphans(self):
+        """Write the records of files left by processes that are gone, then delete the files"""
+        for path in sorted(glob.glob(os.path.join(glob.escape(self.directory), f"{glob.escape(self.name)}-*.jsonl"))):
+            # Only <name>-<pid>.jsonl, not the files of an outbox whose name starts with <name>-
+            if path == self.path or not re.fullmatch(rf"{re.escape(self.name)}-\d+\.jsonl", os.path.basename(path)):
+                continue
+            with open(path, "r+b") as orphan:
+                try:
+                    fcntl.flock(orphan.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    # Its process is still alive
+                    continue
+                offset = self._read_offset(path)
+                size = self._truncate_torn(orphan, path)
+                while offset < size:
+                    batch = self._read_records(orphan, offset, size, limit=self.batch_size)
+                    if not batch or not self._deliver([record for _, record in batch]):
+                        return
+                    offset = batch[-1][0]
+                    self._write_offset(path, offset)
+                    count("outbox", "replayed", amount=len(batch))
+                logger.info(f"Replayed outbox file {path}")
+                self._remove(path)
+
+    def _work(self):
+        try:
+            self._replay_orphans()
+        except Exception as e:
+            logger.error(f"Outbox {self.name} could not replay the files of earlier processes: {e}")
+        while True:
+            with self._condition:
+                while not self._stopped and not self._dirty and self._offset >= self._size:
+                    self._condition.wait()
+                # Group the appends of one interval into one fsync
+                deadline = time.monotonic() + self.fsync_interval
+                while not self._stopped and time.monotonic() < deadline:
+                    self._condition.wait(timeout=deadline - time.monotonic())
+            self._sync()
+            while self._drain():
+                pass
+            with self._condition:
+                if self._stopped:
+                    return
+
+    def flush(self, timeout: float = None) -> bool:
+        """Wait until everything appended so far is written, returning whether it was"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        target = self._size
+        while self._offset < target and self._size >= target:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(self.fsync_interval)
+        return True
+
+    def close(self, timeout: float = 5.0):
+        """Try to write what is pending, what is left is replayed by the next process"""
+        self.flush(timeout=timeout)
+        with self._condition:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._condition.notify_all()
+        self._worker.join(timeout=timeout)
+        self._sync()
+        empty = self._offset >= self._size
+        self._reader.close()
+        self._file.close()
+        if empty:
+            self._remove(self.path)
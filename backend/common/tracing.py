@@ -0,0 +1,206 @@
+"""Non-blocking, batched export of LangChain traces."""
+import atexit
+import json
+import logging
+import os
+import threading
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from langchain_core.tracers.base import BaseTracer
+from langchain_core.tracers.langchain import wait_for_all_tracers
+from langchain_core.tracers.schemas import Run
+
+from common.metrics import count
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+
+
+class FileTraceSink:
+    """Appends runs as JSON lines to a local file, for offline inspection"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def export(self, runs: List[Dict[str, Any]]):
+        for run in runs:
+            self._file.write(json.dumps(run, default=str, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class LangSmithTraceSink:
+    """Uploads runs to LangSmith with one batch request per export"""
+
+    def __init__(self, project_name: Optional[str] = None, client=None):
+        from langsmith import Client
+        self.client = client if client is not None else Client()
+        self.project_name = project_name or os.getenv("LANGCHAIN_PROJECT", "default")
+
+    def export(self, runs: List[Dict[str, Any]]):
+        self.client.batch_ingest_runs(create=[{**run, "session_name": self.project_name} for run in runs])
+
+    def close(self):
+        pass
+
+
+def _flatten(run: Run) -> List[Dict[str, Any]]:
+    runs = [run.dict(exclude={"child_runs"})]
+    for child in run.child_runs:
+        runs.extend(_flatten(child))
+    return runs
+
+
+class BatchTraceExporter(BaseTracer):
+    """
+    Tracer that hands finished traces to a background thread and returns immediately.
+    The buffer is bounded, when it is full traces are dropped according to `drop_policy`.
+    """
+
+    def __init__(
+            self,
+            sink,
+            max_buffer_size: int = 1000,
+            batch_size: int = 100,
+            flush_interval: float = 1.0,
+            drop_policy: str = DROP_OLDEST,
+            **kwargs: Any
+    ):
+        super().__init__(**kwargs)
+        if drop_policy not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f"Unknown drop policy: {drop_policy}. Valid policies are: {DROP_OLDEST}, {DROP_NEWEST}")
+        self.sink = sink
+        self.max_buffer_size = max_buffer_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.drop_policy = drop_policy
+        self.dropped = 0
+        self._buffer: deque = deque()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._start_worker()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _start_worker(self):
+        self._worker = threading.Thread(target=self._work, name="trace-exporter", daemon=True)
+        self._worker.start()
+
+    def _after_fork(self):
+        """Threads do not survive fork, give a forked worker its own exporter thread"""
+        self._condition = threading.Condition()
+        # Traces buffered before the fork are exported by the parent
+        self._buffer = deque()
+        if not self._stopped:
+            self._start_worker()
+
+    def _persist_run(self, run: Run) -> None:
+        """Called once per finished root run, only enqueues"""
+        with self._condition:
+            if self._stopped:
+                return
+            if len(self._buffer) >= self.max_buffer_size:
+                self.dropped += 1
+                count("tracing", "dropped")
+                if self.drop_policy == DROP_NEWEST:
+                    return
+                self._buffer.popleft()
+            self._buffer.append(run)
+            if len(self._buffer) >= self.batch_size:
+                self._condition.notify()
+
+    def _take_batch(self) -> List[Run]:
+        with self._condition:
+            if len(self._buffer) < self.batch_size and not self._stopped:
+                self._condition.wait(timeout=self.flush_interval)
+            batch = []
+            while self._buffer and len(batch) < self.batch_size:
+                batch.append(self._buffer.popleft())
+            return batch
+
+    def _export(self, batch: List[Run]):
+        try:
+            runs = [item for run in batch for item in _flatten(run)]
+            self.sink.export(runs)
+            count("tracing", "exported", amount=len(batch))
+        except Exception as e:
+            count("tracing", "export_error")
+            logger.warning(f"Failed to export {len(batch)} traces: {e}")
+
+    def _work(self):
+        while True:
+            batch = self._take_batch()
+            if batch:
+                self._export(batch)
+            with self._condition:
+                if self._stopped and not self._buffer:
+                    return
+
+    def flush(self):
+        """Export everything buffered so far from the calling thread"""
+        while True:
+            with self._condition:
+                batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            if not batch:
+                return
+            self._export(batch)
+
+    def shutdown(self, timeout: float = 5.0):
+        """Stop accepting traces, drain the buffer and close the sink"""
+        with self._condition:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._condition.notify_all()
+        self._worker.join(timeout=timeout)
+        self.flush()
+        self.sink.close()
+
+
+_exporter: Optional[BatchTraceExporter] = None
+_exporter_lock = threading.Lock()
+
+
+def get_trace_exporter(config=None) -> Optional[BatchTraceExporter]:
+    """Process-wide exporter built from `Config`, None when trace export is disabled"""
+    global _exporter
+    if _exporter is not None:
+        return _exporter
+    if config is None:
+        from common.config import Config
+        config = Config()
+    if config.trace_sink == "none":
+        return None
+    with _exporter_lock:
+        if _exporter is None:
+            if config.trace_sink == "file":
+                sink = FileTraceSink(config.trace_file_path)
+            else:
+                sink = LangSmithTraceSink()
+            _exporter = BatchTraceExporter(
+                sink=sink,
+                max_buffer_size=config.trace_buffer_size,
+                batch_size=config.trace_batch_size,
+                flush_interval=config.trace_flush_interval,
+                drop_policy=config.trace_drop_policy,
+            )
+            atexit.register(_exporter.shutdown)
+    return _exporter
+
+
+def shutdown_trace_exporter():
+    """Flush pending traces, called once when the application stops"""
+    global _exporter
+    if _exporter is not None:
+        _exporter.shutdown()
+        _exporter = None
+    # LangChain's own tracer uploads in the background too, let it finish
+    wait_for_all_tracers()
@@ -31,6 +31,26 @@ class Settings(BaseSettings):
     human_prefix: str = Field(default="Human", description="Prefix for human messages in the prompt")
     ai_prefix: str = Field(default="AI", description="Prefix for AI messages in the prompt")
     
+    # Conversation summarization, 0 disables it
+    summary_threshold: int = Field(default=0, description="Unsummarized turns that trigger folding older ones")
+    summary_keep_turns: int = Field(default=4, description="Recent turns kept verbatim next to the summary")
+
+    # Batch chat
+    batch_max_concurrency: int = Field(default=8, description="Prompts of a batch request generated at once")
+
+    # Respond-then-persist, turns go through a local outbox file when a directory is set
+    outbox_directory: Optional[str] = Field(default=None, description="Directory of the local outbox, unset writes inline")
+    outbox_batch_size: int = Field(default=100, description="Outbox records written to MongoDB per bulk write")
+    outbox_fsync_interval: float = Field(default=0.05, description="Seconds of appends grouped into one fsync")
+    outbox_flush_timeout: float = Field(default=10.0, description="Seconds a clear waits for the outbox to drain")
+
+    # MongoClient pool, one client per URI is shared by the whole process
+    mongo_max_pool_size: int = Field(default=100, description="Connections per server of the shared MongoClient")
+    mongo_min_pool_size: int = Field(default=0, description="Connections per server kept open while idle")
+    mongo_server_selection_timeout_ms: int = Field(default=10000, description="Milliseconds to find a usable server")
+    mongo_wait_queue_timeout_ms: int = Field(default=10000, description="Milliseconds to wait for a free connection")
+    mongo_compressors: str = Field(default="", description="Comma separated wire compressors, e.g. zstd,zlib")
+
     # Misc settings
     collection_name: str = Field(default="chat_histories", description="MongoDB collection name")
 
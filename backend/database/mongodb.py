@@ -1,25 +1,37 @@
 """MongoDB database client for the chatbot application."""
-from typing import Dict, List, Any, Optional, cast
+from typing import Dict, Iterator, List, Any, Optional, Sequence, Tuple, cast
 from datetime import datetime, timezone
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
 from pymongo.collection import Collection
 from pymongo.database import Database
 
 from config import settings
+from common.config import Config
+from common.objects import parse_int_cursor
+from common.metrics import timed
+from memory.mongo_clients import get_mongo_client
 
 
 class MongodbClient:
     """MongoDB client for chat history storage."""
     
-    def __init__(self, collection_name: Optional[str] = None):
+    def __init__(self, collection_name: Optional[str] = None, client: Optional[MongoClient] = None):
         """Initialize the MongoDB client.
         
         Args:
             collection_name: Optional name of the MongoDB collection to use.
                 Defaults to the value in settings.
+            client: Optional client to use instead of the process-wide client of `settings.mongo_uri`.
         """
         self.mongo_uri = settings.mongo_uri
-        self.client = MongoClient(self.mongo_uri)
+        self._shared = client is None
+        self.client = client if client is not None else get_mongo_client(self.mongo_uri, Config(
+            mongo_max_pool_size=settings.mongo_max_pool_size,
+            mongo_min_pool_size=settings.mongo_min_pool_size,
+            mongo_server_selection_timeout_ms=settings.mongo_server_selection_timeout_ms,
+            mongo_wait_queue_timeout_ms=settings.mongo_wait_queue_timeout_ms,
+            mongo_compressors=settings.mongo_compressors,
+        ))
         
         # Extract the database name from the MongoDB URI
         db_name = self.mongo_uri.split("/")[-1]
@@ -28,6 +40,7 @@ class MongodbClient:
         self.db: Database = self.client[db_name]
         self.collection: Collection = self.db[collection_name or settings.collection_name]
     
+    @timed("mongodb_client", "add_message")
     def add_conversation_message(
         self, 
         conversation_id: str, 
@@ -43,7 +56,6 @@ class MongodbClient:
         """
         # Check if conversation exists
         conversation = self.collection.find_one({"conversation_id": conversation_id})
-        print(conversation,'............')
         # Get current UTC time
         current_time = datetime.now(timezone.utc)
         
@@ -69,6 +81,34 @@ class MongodbClient:
                 }]
             })
     
+    @timed("mongodb_client", "add_messages")
+    def add_conversation_messages(self, turns: Sequence[Tuple[str, str, str]]) -> None:
+        """Add many message pairs with one bulk write.
+        
+        Args:
+            turns: (conversation_id, user_message, ai_message) tuples, in order.
+        """
+        current_time = datetime.now(timezone.utc)
+        messages: Dict[str, List[Dict[str, Any]]] = {}
+        for conversation_id, user_message, ai_message in turns:
+            messages.setdefault(conversation_id, []).append({
+                "user": user_message,
+                "ai": ai_message,
+                "timestamp": current_time
+            })
+        if not messages:
+            return
+        # One upsert per conversation, creating the conversations seen for the first time
+        self.collection.bulk_write([
+            UpdateOne(
+                {"conversation_id": conversation_id},
+                {"$push": {"messages": {"$each": pairs}}, "$setOnInsert": {"created_at": current_time}},
+                upsert=True
+            )
+            for conversation_id, pairs in messages.items()
+        ], ordered=False)
+
+    @timed("mongodb_client", "load_history")
     def get_conversation_history(self, conversation_id: str) -> List[Dict[str, Any]]:
         """Get the chat history for a conversation.
         
@@ -87,6 +127,69 @@ class MongodbClient:
         
         return []
     
+    @timed("mongodb_client", "load_histories")
+    def get_conversation_histories(self, conversation_ids: Sequence[str]) -> Dict[str, List[Dict[str, Any]]]:
+        """Get the chat history of many conversations with one query.
+        
+        Args:
+            conversation_ids: IDs of the conversations.
+            
+        Returns:
+            Message pairs of each conversation, empty for unknown ones.
+        """
+        histories: Dict[str, List[Dict[str, Any]]] = {conversation_id: [] for conversation_id in conversation_ids}
+        documents = self.collection.find(
+            {"conversation_id": {"$in": list(histories)}},
+            {"_id": 0, "conversation_id": 1, "messages": 1}
+        )
+        for document in documents:
+            histories[document["conversation_id"]] = document.get("messages", [])
+        return histories
+
+    @timed("mongodb_client", "get_messages")
+    def get_messages_page(
+        self,
+        conversation_id: str,
+        cursor: Optional[str] = None,
+        limit: int = 50
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Get one page of the chat history, sliced on the server.
+        
+        Args:
+            conversation_id: ID of the conversation.
+            cursor: Position of the first message of the page, from the previous page.
+            limit: Maximum number of message pairs to return.
+            
+        Returns:
+            Message pairs of the page and the cursor of the next one, None on the last page.
+        """
+        start = parse_int_cursor(cursor) or 0
+        conversation = self.collection.find_one(
+            {"conversation_id": conversation_id},
+            {"_id": 0, "messages": {"$slice": [start, limit + 1]}}
+        )
+        messages = conversation.get("messages", []) if conversation else []
+        next_cursor = str(start + limit) if len(messages) > limit else None
+        return messages[:limit], next_cursor
+
+    def iter_messages(self, conversation_id: str, batch_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """Iterate over the chat history holding at most `batch_size` messages in memory.
+        
+        Args:
+            conversation_id: ID of the conversation.
+            batch_size: Number of message pairs fetched per round trip.
+            
+        Yields:
+            Message pairs, oldest first.
+        """
+        cursor = None
+        while True:
+            messages, cursor = self.get_messages_page(conversation_id, cursor=cursor, limit=batch_size)
+            yield from messages
+            if cursor is None:
+                return
+
+    @timed("mongodb_client", "clear_history")
     def clear_conversation_history(self, conversation_id: str) -> None:
         """Clear the chat history for a conversation.
         
@@ -107,8 +210,30 @@ class MongodbClient:
         Returns:
             Formatted history string.
         """
-        messages = self.get_conversation_history(conversation_id)
+        return self.format_messages(self.get_conversation_history(conversation_id))
+
+    def format_histories(self, conversation_ids: Sequence[str]) -> Dict[str, str]:
+        """Format the chat history of many conversations, read with one query.
         
+        Args:
+            conversation_ids: IDs of the conversations.
+            
+        Returns:
+            Formatted history string of each conversation.
+        """
+        histories = self.get_conversation_histories(conversation_ids)
+        return {conversation_id: self.format_messages(messages) for conversation_id, messages in histories.items()}
+
+    @staticmethod
+    def format_messages(messages: List[Dict[str, Any]]) -> str:
+        """Format message pairs for use in prompts.
+        
+        Args:
+            messages: Message pairs, oldest first.
+            
+        Returns:
+            Formatted history string.
+        """
         if not messages:
             return ""
         
@@ -121,5 +246,6 @@ class MongodbClient:
         return formatted_history.strip()
     
     def close(self) -> None:
-        """Close the MongoDB client connection."""
-        self.client.close() 
\ No newline at end of file
+        """Close the MongoDB client connection, the shared client is closed by `close_mongo_clients`."""
+        if not self._shared:
+            self.client.close() 
\ No newline at end of file
@@ -13,5 +13,6 @@ if __name__ == "__main__":
         "chatbot_backend.main:app",
         host="0.0.0.0",
         port=port,
-        reload=True
+        # Auto-reload is for development only, use serve.py to run several workers in production
+        reload=os.getenv("RELOAD", "false").lower() == "true"
     ) 
\ No newline at end of file
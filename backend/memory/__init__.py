@@ -4,4 +4,7 @@ from .custom_memory import CustomMongoChatbotMemory
 from .mysql_memory import CustomSQLChatbotMemory
 from .redis_memory import CustomRedisChatbotMemory
 from .postgres_memory import CustomPostgresChatbotMemory
+from .sqlite_memory import CustomSQLiteChatbotMemory
+from .tiered_memory import CustomTieredChatbotMemory
 from .memory_types import MemoryTypes, MEM_TO_CLASS
+from .summary import ConversationSummarizer, SummaryState, SummaryStoreTypes, SUMMARY_STORE_TO_CLASS
@@ -1,9 +1,11 @@
-from typing import Optional
+from typing import List, Optional
 
 from langchain.memory import ConversationBufferWindowMemory, ChatMessageHistory
 
 from common.config import BaseObject, Config
+from common.metrics import timed
 from common.objects import MessageTurn
+from memory.recall import get_recall_index
 
 class BaseChatbotMemory(BaseObject):
     __slots__ = ["_base_memory", "_memory"]
@@ -30,6 +32,7 @@ class BaseChatbotMemory(BaseObject):
         self._base_memory_class = chat_history_class
         self._memory = memory_class(**self.params)
         self._user_memory = dict()
+        self.recall = get_recall_index(self.config)
     @property
     def params(self):
         if self._params:
@@ -50,20 +53,34 @@ class BaseChatbotMemory(BaseObject):
     def user_memory(self):
         return self._user_memory
 
+    @timed("base_memory", "clear_history")
     def clear(self, conversation_id: str):
         if conversation_id in self.user_memory:
             memory = self.user_memory.pop(conversation_id)
             memory.clear()
+        if self.recall is not None:
+            self.recall.remove(conversation_id)
 
-    def load_history(self, conversation_id: str) -> str:
+    @timed("base_memory", "load_history")
+    def load_history(self, conversation_id: str, input: str = None) -> str:
         if conversation_id not in self._user_memory:
             memory = self._base_memory_class(**self.chat_history_kwargs)
             self.memory.chat_memory = memory
             self.user_memory[conversation_id] = memory
-            return ""
-
-        self.memory.chat_memory = self.user_memory.get(conversation_id)
-        return self._memory.load_memory_variables({})["history"]
+            history = ""
+        else:
+            self.memory.chat_memory = self.user_memory.get(conversation_id)
+            history = self._memory.load_memory_variables({})["history"]
+        if self.recall is not None:
+            history = self.recall.with_recall(history, input, top_k=self.config.recall_top_k)
+        return history
 
     def add_message(self, message_turn: MessageTurn):
-        pass
\ No newline at end of file
+        if self.recall is not None:
+            self.recall.add_turns([message_turn])
+
+    def insert_messages(self, message_turns: List[MessageTurn]) -> int:
+        """Add many message turns, errors are raised to the caller"""
+        for message_turn in message_turns:
+            self.add_message(message_turn)
+        return len(message_turns)
\ No newline at end of file
@@ -1,9 +1,15 @@
 import json
-from typing import List
-from pymongo import MongoClient, errors
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, DESCENDING, MongoClient, ReturnDocument, UpdateOne, errors
 
 from common.config import Config, BaseObject
-from common.objects import MessageTurn, messages_from_dict
+from common.metrics import timed
+from common.objects import InvalidCursorError, MessageTurn, messages_from_dict, parse_int_cursor
+from memory.mongo_clients import get_mongo_client
+from memory.recall import get_recall_index
 
 
 class BaseCustomMongoChatbotMemory(BaseObject):
@@ -15,6 +21,7 @@ class BaseCustomMongoChatbotMemory(BaseObject):
             database_name: str = None,
             collection_name: str = None,
             k: int = 5,
+            client: MongoClient = None,
             **kwargs
     ):
         super(BaseCustomMongoChatbotMemory, self).__init__()
@@ -26,15 +33,32 @@ class BaseCustomMongoChatbotMemory(BaseObject):
         self.collection_name = collection_name
 
         try:
-            self.client: MongoClient = MongoClient(connection_string)
+            self.client: MongoClient = client if client is not None \
+                else get_mongo_client(connection_string, self.config)
         except errors.ConnectionFailure as error:
             self.logger.error(error)
 
         self.db = self.client[database_name]
         self.collection = self.db[collection_name]
-        self.collection.create_index("SessionId")
+        # Last sequence number of each conversation
+        self.counters = self.db[f"{collection_name}_counters"]
+        # Serves the tail reads below, its prefix also serves the session-wide deletes
+        self.collection.create_index([("SessionId", ASCENDING), ("ConversationId", ASCENDING), ("seq", ASCENDING)])
+        self.counters.create_index([("SessionId", ASCENDING), ("ConversationId", ASCENDING)], unique=True)
         self.k = k
 
+    def next_seq(self, conversation_id: str, count: int = 1) -> int:
+        """Reserve `count` sequence numbers of a conversation, returning the last one"""
+        counter = self.counters.find_one_and_update(
+            {"SessionId": self.session_id, "ConversationId": conversation_id},
+            {"$inc": {"seq": count}},
+            projection={"_id": 0, "seq": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return counter["seq"]
+
+    @timed("custom_memory", "add_message")
     def add_message(self, message_turn: MessageTurn):
         conversation_id = message_turn.conversation_id
         try:
@@ -43,44 +67,204 @@ class BaseCustomMongoChatbotMemory(BaseObject):
                 {
                     "ConversationId": conversation_id,
                     "SessionId": self.session_id,
-                    "History": json.dumps(message_turn.dict(), ensure_ascii=False),
+                    "seq": self.next_seq(conversation_id),
+                    "Turn": message_turn.model_dump(),
+                    "CreatedAt": datetime.now(timezone.utc),
                 }
             )
         except errors.WriteError as err:
             self.logger.error(err)
 
+    def insert_messages(self, message_turns: Sequence[MessageTurn]) -> int:
+        """
+        Insert many turns at once, reserving the sequence numbers of each conversation with one update,
+        errors are raised to the caller
+        """
+        turns_by_conversation: Dict[str, List[MessageTurn]] = {}
+        for message_turn in message_turns:
+            turns_by_conversation.setdefault(message_turn.conversation_id, []).append(message_turn)
+        now = datetime.now(timezone.utc)
+        documents = []
+        for conversation_id, turns in turns_by_conversation.items():
+            first = self.next_seq(conversation_id, count=len(turns)) - len(turns) + 1
+            documents.extend(
+                {
+                    "ConversationId": conversation_id,
+                    "SessionId": self.session_id,
+                    "seq": first + i,
+                    "Turn": turn.model_dump(),
+                    "CreatedAt": now,
+                }
+                for i, turn in enumerate(turns)
+            )
+        if documents:
+            self.collection.insert_many(documents, ordered=False)
+        return len(documents)
+
+    @timed("custom_memory", "add_messages")
+    def add_messages(self, message_turns: Sequence[MessageTurn]):
+        """Insert many turns at once, reserving the sequence numbers of each conversation with one update"""
+        try:
+            saved = self.insert_messages(message_turns)
+            self.logger.info(f"Saved {saved} message turns")
+        except errors.PyMongoError as err:
+            self.logger.error(err)
+
+    @timed("custom_memory", "clear_history")
     def clear_history(self, conversation_id: str = None):
         try:
             self.logger.info(f"Deleting the history of conversation <{conversation_id}> at session <{self.session_id}>")
             if conversation_id is None:
                 self.logger.warning(f"You are deleting all collection with session: {self.session_id}")
-                self.collection.delete_many({"SessionId": self.session_id})
+                query = {"SessionId": self.session_id}
             else:
-                self.collection.delete_many({"SessionId": self.session_id, "ConversationId": conversation_id})
+                query = {"SessionId": self.session_id, "ConversationId": conversation_id}
+            self.collection.delete_many(query)
+            self.counters.delete_many(query)
         except errors.WriteError as err:
             self.logger.error(err)
 
+    # Rows written before `migrate_json_history` have no seq and sort before every numbered row, in insertion order
+    NEWEST_FIRST = [("seq", DESCENDING), ("_id", DESCENDING)]
+    OLDEST_FIRST = [("seq", ASCENDING), ("_id", ASCENDING)]
+    LEGACY_CURSOR_PREFIX = "_"
+
+    @staticmethod
+    def _turn(document: dict) -> dict:
+        # Rows written before the migration keep the turn as a JSON string
+        if "Turn" in document:
+            return document["Turn"]
+        return json.loads(document["History"])
+
+    @timed("custom_memory", "load_history")
     def load_history(self, conversation_id: str) -> str:
-        """Retrieve the messages from MongoDB"""
-        from pymongo import errors
-        cursor = None
+        """Retrieve the last k messages from MongoDB"""
         try:
-            cursor = self.collection.find({"SessionId": self.session_id, "ConversationId": conversation_id})
+            cursor = self.collection.find(
+                {"SessionId": self.session_id, "ConversationId": conversation_id},
+                {"_id": 0, "Turn": 1, "History": 1}
+            ).sort(self.NEWEST_FIRST).limit(self.k)
+            items = [self._turn(document) for document in cursor]
         except errors.OperationFailure as error:
             self.logger.error(error)
-
-        if cursor:
-            items = [json.loads(document["History"]) for document in cursor][-self.k:]
-        else:
             items = []
 
-        messages: List[str] = [messages_from_dict(item) for item in items]
+        messages: List[str] = [messages_from_dict(item) for item in reversed(items)]
         return "\n".join(messages)
 
+    @timed("custom_memory", "load_histories")
+    def load_histories(self, conversation_ids: Sequence[str]) -> Dict[str, str]:
+        """Retrieve the last k messages of many conversations with one aggregation"""
+        histories = {conversation_id: "" for conversation_id in conversation_ids}
+        try:
+            documents = self.collection.aggregate([
+                {"$match": {"SessionId": self.session_id, "ConversationId": {"$in": list(histories)}}},
+                {"$sort": {"ConversationId": ASCENDING, "seq": DESCENDING, "_id": DESCENDING}},
+                # $firstN keeps only the tail of each conversation in the group stage (MongoDB 5.2+)
+                {"$group": {
+                    "_id": "$ConversationId",
+                    "turns": {"$firstN": {"input": {"Turn": "$Turn", "History": "$History"}, "n": self.k}},
+                }},
+            ])
+            for document in documents:
+                items = [self._turn(turn) for turn in reversed(document["turns"])]
+                histories[document["_id"]] = "\n".join(messages_from_dict(item) for item in items)
+        except errors.OperationFailure as error:
+            self.logger.error(error)
+        return histories
+
+    @classmethod
+    def _message(cls, document: dict) -> dict:
+        return {"seq": document.get("seq"), **cls._turn(document), "created_at": document.get("CreatedAt")}
+
+    @classmethod
+    def _cursor(cls, document: dict) -> str:
+        if document.get("seq") is None:
+            return f"{cls.LEGACY_CURSOR_PREFIX}{document['_id']}"
+        return str(document["seq"])
+
+    @classmethod
+    def _after_cursor(cls, cursor: str) -> dict:
+        """Query of the rows after a cursor, a seq or, within the unmigrated rows, `_` and an _id"""
+        try:
+            if cursor.startswith(cls.LEGACY_CURSOR_PREFIX):
+                after = ObjectId(cursor[len(cls.LEGACY_CURSOR_PREFIX):])
+                return {"$or": [{"seq": None, "_id": {"$gt": after}}, {"seq": {"$ne": None}}]}
+            return {"seq": {"$gt": parse_int_cursor(cursor)}}
+        except (InvalidCursorError, InvalidId):
+            raise InvalidCursorError(f"Got malformed cursor: {cursor!r}")
+
+    @timed("custom_memory", "get_messages")
+    def get_messages(self, conversation_id: str, cursor: Optional[str] = None,
+                     limit: int = 50) -> Tuple[List[dict], Optional[str]]:
+        """One page of turns after `cursor` in seq order, with the cursor of the next page"""
+        query = {"SessionId": self.session_id, "ConversationId": conversation_id}
+        if cursor is not None:
+            query.update(self._after_cursor(cursor))
+        documents = list(
+            self.collection.find(query, {"seq": 1, "Turn": 1, "History": 1, "CreatedAt": 1})
+            .sort(self.OLDEST_FIRST).limit(limit + 1)
+        )
+        next_cursor = self._cursor(documents[limit - 1]) if len(documents) > limit else None
+        return [self._message(document) for document in documents[:limit]], next_cursor
+
+    def iter_messages(self, conversation_id: str, batch_size: int = 500) -> Iterator[dict]:
+        """Every turn of a conversation from a server-side cursor, `batch_size` documents in memory at a time"""
+        cursor = self.collection.find(
+            {"SessionId": self.session_id, "ConversationId": conversation_id},
+            {"_id": 0, "seq": 1, "Turn": 1, "History": 1, "CreatedAt": 1}
+        ).sort(self.OLDEST_FIRST).batch_size(batch_size)
+        try:
+            for document in cursor:
+                yield self._message(document)
+        finally:
+            cursor.close()
+
+    def migrate_json_history(self, batch_size: int = 1000) -> int:
+        """
+        One-off migration of rows storing the turn as a JSON string into native subdocuments.
+        Legacy rows are numbered in insertion order ahead of any row already written with a sequence number.
+        Returns the number of migrated rows.
+        """
+        legacy = {}
+        cursor = self.collection.find(
+            {"Turn": {"$exists": False}},
+            {"_id": 1, "SessionId": 1, "ConversationId": 1}
+        ).sort("_id", ASCENDING)
+        for document in cursor:
+            legacy.setdefault((document["SessionId"], document["ConversationId"]), []).append(document["_id"])
+
+        migrated = 0
+        for (session_id, conversation_id), ids in legacy.items():
+            query = {"SessionId": session_id, "ConversationId": conversation_id}
+            first = self.collection.find_one(
+                {**query, "seq": {"$exists": True}}, {"_id": 0, "seq": 1}, sort=[("seq", ASCENDING)]
+            )
+            start = (first["seq"] if first else len(ids) + 1) - len(ids)
+            for offset in range(0, len(ids), batch_size):
+                batch = ids[offset:offset + batch_size]
+                documents = self.collection.find({"_id": {"$in": batch}}, {"_id": 1, "History": 1})
+                turns = {document["_id"]: json.loads(document["History"]) for document in documents}
+                self.collection.bulk_write([
+                    UpdateOne(
+                        {"_id": _id},
+                        {"$set": {"seq": start + offset + i, "Turn": turns[_id]}, "$unset": {"History": ""}}
+                    )
+                    for i, _id in enumerate(batch)
+                ], ordered=False)
+                migrated += len(batch)
+            # Keep new turns numbered after the migrated ones
+            self.counters.update_one(query, {"$max": {"seq": start + len(ids) - 1}}, upsert=True)
+            self.logger.info(f"Migrated {len(ids)} turns of conversation <{conversation_id}> at session <{session_id}>")
+        return migrated
+
 
 class CustomMongoChatbotMemory(BaseObject):
     def __init__(self, config: Config = None, **kwargs):
         super(CustomMongoChatbotMemory, self).__init__()
+        self.config = config
+        # Similar turns of the whole session, from an in-process index (None unless semantic_recall is set)
+        self.recall = get_recall_index(config)
         self.memory = BaseCustomMongoChatbotMemory(
             connection_string=config.memory_connection_string,
             session_id=config.session_id,
@@ -91,9 +275,44 @@ class CustomMongoChatbotMemory(BaseObject):
 
     def clear(self, conversation_id: str = None):
         self.memory.clear_history(conversation_id=conversation_id)
+        if self.recall is not None:
+            self.recall.remove(conversation_id)
+
+    def load_history(self, conversation_id: str, input: str = None):
+        history = self.memory.load_history(conversation_id)
+        if self.recall is not None:
+            history = self.recall.with_recall(history, input, top_k=self.config.recall_top_k)
+        return history
 
-    def load_history(self, conversation_id: str):
-        return self.memory.load_history(conversation_id)
+    def load_histories(self, conversation_ids: List[str], inputs: List[str] = None) -> List[str]:
+        histories = self.memory.load_histories(conversation_ids)
+        histories = [histories[conversation_id] for conversation_id in conversation_ids]
+        if self.recall is not None and inputs is not None:
+            histories = self.recall.with_recall_many(histories, inputs, top_k=self.config.recall_top_k)
+        return histories
+
+    def get_messages(self, conversation_id: str, cursor: str = None, limit: int = 50):
+        return self.memory.get_messages(conversation_id, cursor=cursor, limit=limit)
+
+    def iter_messages(self, conversation_id: str, batch_size: int = 500):
+        return self.memory.iter_messages(conversation_id, batch_size=batch_size)
 
     def add_message(self, message_turn: MessageTurn):
         self.memory.add_message(message_turn)
+        if self.recall is not None:
+            self.recall.add_turns([message_turn])
+
+    def add_messages(self, message_turns: List[MessageTurn]):
+        self.memory.add_messages(message_turns)
+        if self.recall is not None:
+            self.recall.add_turns(message_turns)
+
+    def insert_messages(self, message_turns: List[MessageTurn]) -> int:
+        saved = self.memory.insert_messages(message_turns)
+        if self.recall is not None:
+            try:
+                self.recall.add_turns(message_turns)
+            except Exception as e:
+                # The turns are stored, raising would store them again
+                self.logger.error(f"Could not index {len(message_turns)} message turns for recall: {e}")
+        return saved
@@ -0,0 +1,138 @@
+"""
+Sentence embedding backends for similarity search: PyTorch SentenceTransformer or the same model exported
+to ONNX (optionally int8 quantized) and run with ONNX Runtime, without importing torch.
+
+The ONNX path reproduces the SentenceTransformer pipeline of all-MiniLM-L6-v2, mean pooling over the
+attention mask then L2 normalization, so its vectors can be searched against the ones already stored.
+Export the model once from the backend directory:
+    python -m memory.embeddings --output models/all-MiniLM-L6-v2-onnx --quantize
+"""
+import argparse
+import os
+import threading
+from enum import Enum
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+
+from common.config import BaseObject, Config
+from common.metrics import timed
+
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_QUANTIZED_MODEL_FILE = "model_quantized.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+
+
+class EmbeddingBackends(str, Enum):
+    """Enumerator with the runtimes sentence embeddings are computed with."""
+    SENTENCE_TRANSFORMERS = "sentence-transformers"
+    ONNX = "onnx"
+    ONNX_INT8 = "onnx-int8"
+
+
+class OnnxEmbedder(BaseObject):
+    """ONNX Runtime embedder with the `encode` interface of SentenceTransformer"""
+
+    def __init__(
+            self,
+            model_dir: str,
+            quantized: bool = False,
+            max_length: int = 256,
+            batch_size: int = 32,
+            num_threads: int = None,
+    ):
+        super(OnnxEmbedder, self).__init__()
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        model_file = os.path.join(model_dir, ONNX_QUANTIZED_MODEL_FILE if quantized else ONNX_MODEL_FILE)
+        if not os.path.exists(model_file):
+            raise FileNotFoundError(f"{model_file} not found, export it with `python -m memory.embeddings`")
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(model_file, options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+        self.batch_size = batch_size
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array([encoding.type_ids for encoding in encodings], dtype=np.int64)
+        token_embeddings = self.session.run(None, feeds)[0]
+        # Mean pooling over real tokens, then unit length, as the SentenceTransformer modules do
+        mask = attention_mask[..., None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    @timed("embedder", "encode")
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = None, **kwargs) -> np.ndarray:
+        texts = [sentences] if isinstance(sentences, str) else list(sentences)
+        batch_size = batch_size or self.batch_size
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        vectors = np.concatenate([
+            self._encode_batch(texts[start:start + batch_size]) for start in range(0, len(texts), batch_size)
+        ]).astype(np.float32)
+        return vectors[0] if isinstance(sentences, str) else vectors
+
+
+def load_embedder(backend: str = EmbeddingBackends.SENTENCE_TRANSFORMERS, model_dir: str = None,
+                  num_threads: int = None):
+    if backend == EmbeddingBackends.SENTENCE_TRANSFORMERS:
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(EMBEDDING_MODEL_NAME)
+    if backend in (EmbeddingBackends.ONNX, EmbeddingBackends.ONNX_INT8):
+        return OnnxEmbedder(model_dir, quantized=backend == EmbeddingBackends.ONNX_INT8, num_threads=num_threads)
+    raise ValueError(f"Got unknown embedding backend: {backend}. "
+                     f"Valid types are: {[b.value for b in EmbeddingBackends]}.")
+
+
+_embedders: Dict[Tuple[str, str], object] = {}
+_embedders_lock = threading.Lock()
+
+
+def get_embedder(config: Config = None):
+    """Load the configured embedding model once per process"""
+    config = config if config is not None else Config()
+    key = (config.embedding_backend, config.embedding_model_dir)
+    with _embedders_lock:
+        embedder = _embedders.get(key)
+        if embedder is None:
+            embedder = _embedders[key] = load_embedder(
+                config.embedding_backend, config.embedding_model_dir, config.embedding_threads
+            )
+    return embedder
+
+
+def export_onnx(output_dir: str, quantize: bool = False) -> List[str]:
+    """Export the embedding model with its tokenizer to ONNX, and an int8 dynamically quantized copy"""
+    from optimum.exporters.onnx import main_export
+
+    main_export(f"sentence-transformers/{EMBEDDING_MODEL_NAME}", output=output_dir, task="feature-extraction")
+    files = [os.path.join(output_dir, ONNX_MODEL_FILE)]
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(files[0], os.path.join(output_dir, ONNX_QUANTIZED_MODEL_FILE), weight_type=QuantType.QInt8)
+        files.append(os.path.join(output_dir, ONNX_QUANTIZED_MODEL_FILE))
+    return files
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description=f"Export {EMBEDDING_MODEL_NAME} to ONNX for the onnx backends")
+    parser.add_argument("--output", default=Config().embedding_model_dir)
+    parser.add_argument("--quantize", action="store_true", help="Also write an int8 quantized model")
+    args = parser.parse_args(argv)
+    for path in export_onnx(args.output, quantize=args.quantize):
+        print(f"Wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Process-wide SQLAlchemy engines keyed by URL, with configurable pools that report checkout waits and saturation."""
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+from common.config import Config
+from common.metrics import REGISTRY, count, observe
+
+POOL_IN_USE = REGISTRY.gauge(
+    "chatbot_sql_pool_in_use", "Connections checked out of a SQL engine pool", ("pool",)
+)
+POOL_SATURATION = REGISTRY.gauge(
+    "chatbot_sql_pool_saturation", "Checked out connections over pool_size + max_overflow", ("pool",)
+)
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool timing how long each checkout waited for a free connection"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            count("sql_pool", "checkout_timeout")
+            raise
+        finally:
+            observe("sql_pool", "checkout_wait", time.perf_counter() - start)
+
+
+def pool_name(url: str) -> str:
+    """Label of an engine in metrics, without credentials"""
+    url = make_url(url)
+    return f"{url.get_backend_name()}://{url.host or ''}/{url.database or ''}"
+
+
+def _track_saturation(engine: Engine, name: str, capacity: int):
+    def update(*args):
+        in_use = engine.pool.checkedout()
+        POOL_IN_USE.set(name, value=in_use)
+        POOL_SATURATION.set(name, value=in_use / capacity)
+
+    event.listen(engine, "checkout", update)
+    event.listen(engine, "checkin", update)
+
+
+def build_engine(url: str, config: Config = None) -> Engine:
+    config = config if config is not None else Config()
+    if make_url(url).get_backend_name() == "sqlite":
+        # SQLite is file local, pooling options of a server connection do not apply
+        return create_engine(url, echo=False, future=True)
+    engine = create_engine(
+        url,
+        echo=False,
+        future=True,
+        poolclass=InstrumentedQueuePool,
+        pool_size=config.sql_pool_size,
+        max_overflow=config.sql_max_overflow,
+        pool_timeout=config.sql_pool_timeout,
+        pool_recycle=config.sql_pool_recycle,
+        pool_pre_ping=config.sql_pool_pre_ping,
+    )
+    _track_saturation(engine, pool_name(url), config.sql_pool_size + max(config.sql_max_overflow, 0))
+    return engine
+
+
+_engines: Dict[str, Engine] = {}
+_engines_lock = threading.Lock()
+_engines_pid = os.getpid()
+
+
+def get_engine(url: str, config: Config = None) -> Engine:
+    """Engine of a database URL shared by every memory and store of the process, built on first use"""
+    global _engines_pid
+    engine = _engines.get(url)
+    if engine is not None and _engines_pid == os.getpid():
+        return engine
+    with _engines_lock:
+        if _engines_pid != os.getpid():
+            # Connections of the parent process are left to it, a forked worker opens its own
+            for inherited in _engines.values():
+                inherited.dispose(close=False)
+            _engines_pid = os.getpid()
+        engine = _engines.get(url)
+        if engine is None:
+            engine = _engines[url] = build_engine(url, config)
+    return engine
+
+
+def dispose_engines(url: Optional[str] = None):
+    """Close the pooled connections of one engine, or of all, e.g. when the application stops"""
+    with _engines_lock:
+        if url is None:
+            engines = list(_engines.values())
+            _engines.clear()
+        else:
+            engines = [_engines.pop(url)] if url in _engines else []
+    for engine in engines:
+        engine.dispose()
@@ -1,5 +1,6 @@
 from enum import Enum
-from memory import MongoChatbotMemory, BaseChatbotMemory, CustomMongoChatbotMemory, CustomSQLChatbotMemory, CustomRedisChatbotMemory,CustomPostgresChatbotMemory
+from memory import MongoChatbotMemory, BaseChatbotMemory, CustomMongoChatbotMemory, CustomSQLChatbotMemory, CustomRedisChatbotMemory,CustomPostgresChatbotMemory, \
+    CustomSQLiteChatbotMemory, CustomTieredChatbotMemory
 
 class MemoryTypes(str, Enum):
     """Enumerator with the Memory types."""
@@ -9,6 +10,8 @@ class MemoryTypes(str, Enum):
     SQL_MEMORY = "sql-memory"
     REDIS_MEMORY = "redis-memory"
     POSTGRES_MEMORY = 'postgres-memory'
+    SQLITE_MEMORY = "sqlite-memory"
+    TIERED_MEMORY = "tiered-memory"
 
 
 MEM_TO_CLASS = {
@@ -18,4 +21,6 @@ MEM_TO_CLASS = {
     "sql-memory": CustomSQLChatbotMemory,
     "redis-memory": CustomRedisChatbotMemory,
     "postgres-memory": CustomPostgresChatbotMemory,
+    "sqlite-memory": CustomSQLiteChatbotMemory,
+    "tiered-memory": CustomTieredChatbotMemory,
 }
@@ -0,0 +1,52 @@
+"""Process-wide MongoClients keyed by URI, so every memory, store and conversation shares one connection pool."""
+import threading
+from typing import Dict, Optional
+
+from pymongo import MongoClient
+
+from common.config import Config
+
+
+def build_mongo_client(uri: str, config: Config = None) -> MongoClient:
+    config = config if config is not None else Config()
+    options = dict(
+        maxPoolSize=config.mongo_max_pool_size,
+        minPoolSize=config.mongo_min_pool_size,
+        maxIdleTimeMS=config.mongo_max_idle_time_ms,
+        connectTimeoutMS=config.mongo_connect_timeout_ms,
+        serverSelectionTimeoutMS=config.mongo_server_selection_timeout_ms,
+        waitQueueTimeoutMS=config.mongo_wait_queue_timeout_ms,
+    )
+    if config.mongo_compressors:
+        # Compressors the server does not support are skipped by the handshake
+        options["compressors"] = config.mongo_compressors
+    return MongoClient(uri, **options)
+
+
+_clients: Dict[str, MongoClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_mongo_client(uri: str, config: Config = None) -> MongoClient:
+    """Client of a URI shared by the whole process, built on first use with the pool options of `config`"""
+    client = _clients.get(uri)
+    if client is not None:
+        return client
+    # MongoClient resets its own pools in a forked child since pymongo 4.3, it is safe to keep across a fork
+    with _clients_lock:
+        client = _clients.get(uri)
+        if client is None:
+            client = _clients[uri] = build_mongo_client(uri, config)
+    return client
+
+
+def close_mongo_clients(uri: Optional[str] = None):
+    """Close one shared client, or all, e.g. when the application stops"""
+    with _clients_lock:
+        if uri is None:
+            clients = list(_clients.values())
+            _clients.clear()
+        else:
+            clients = [_clients.pop(uri)] if uri in _clients else []
+    for client in clients:
+        client.close()
@@ -1,22 +1,56 @@
 import logging
+import threading
 from langchain.memory import MongoDBChatMessageHistory
 
 from common.config import Config
 from memory.base_memory import BaseChatbotMemory
+from memory.mongo_clients import get_mongo_client
 
 logger = logging.getLogger(__name__)
 
+_indexed = set()
+_indexed_lock = threading.Lock()
+
+
+class SharedMongoDBChatMessageHistory(MongoDBChatMessageHistory):
+    """
+    MongoDBChatMessageHistory on the process-wide client of its connection string. The parent class opens a
+    new MongoClient, and creates the SessionId index, for every conversation.
+    """
+
+    def __init__(self, connection_string: str, session_id: str, database_name: str, collection_name: str,
+                 config: Config = None, session_id_key: str = "SessionId", history_key: str = "History",
+                 history_size: int = None, **kwargs):
+        self.connection_string = connection_string
+        self.session_id = session_id
+        self.database_name = database_name
+        self.collection_name = collection_name
+        # Defaults of the parent class, read by its messages, add_message and clear in newer releases
+        self.session_id_key = session_id_key
+        self.history_key = history_key
+        self.history_size = history_size
+        self.client = get_mongo_client(connection_string, config)
+        self.db = self.client[database_name]
+        self.collection = self.db[collection_name]
+        key = (connection_string, database_name, collection_name, session_id_key)
+        if key not in _indexed:
+            with _indexed_lock:
+                if key not in _indexed:
+                    self.collection.create_index(session_id_key)
+                    _indexed.add(key)
+
 
 class MongoChatbotMemory(BaseChatbotMemory):
     def __init__(self, config: Config = None, **kwargs):
         config = config if config is not None else Config()
         super(MongoChatbotMemory, self).__init__(
             config=config,
-            chat_history_class=MongoDBChatMessageHistory,
+            chat_history_class=kwargs.pop("chat_history_class", SharedMongoDBChatMessageHistory),
             chat_history_kwargs={
                 "connection_string": config.memory_connection_string,
                 "session_id": config.session_id,
                 "database_name": config.memory_database_name,
-                "collection_name": config.memory_collection_name
+                "collection_name": config.memory_collection_name,
+                "config": config
             }
         )
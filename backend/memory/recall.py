@@ -0,0 +1,381 @@
+"""In-process semantic recall: top-k cosine search over the turns of a session with one NumPy matmul."""
+import fcntl
+import glob
+import json
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from common.config import BaseObject, Config
+from common.metrics import count, timed
+from common.objects import MessageTurn, messages_from_dict
+from memory.embeddings import get_embedder
+
+EMBEDDING_DIMENSION = 384
+
+
+class SemanticRecallIndex(BaseObject):
+    """
+    Normalized embeddings of a session's turns kept in one contiguous float32 matrix, so a lookup is a single
+    matrix-vector product. Turns are appended in place, growing the matrix by doubling; removed conversations
+    are masked and physically dropped by `compact` once they are `compact_ratio` of the rows.
+
+    With `directory`, the matrix is a memory-mapped .npy file and the turn texts an append-only JSONL log, so
+    the index survives restarts. Each process writes its own `<session>@<pid>` files, like the outbox, so
+    pre-forked workers never write to one another's files: a worker sees the turns written before it forked
+    and the ones it adds itself. Files left behind by processes that are gone are merged when an index opens.
+    The first record of a log names the matrix file its rows live in, a matrix is never rewritten in place,
+    and the log is replaced atomically, so a crash leaves either the old or the new pair of files.
+    """
+
+    def __init__(
+            self,
+            session_id: str,
+            config: Config = None,
+            embedder=None,
+            dimension: int = EMBEDDING_DIMENSION,
+            directory: str = None,
+            initial_capacity: int = 1024,
+            compact_ratio: float = 0.25,
+    ):
+        super(SemanticRecallIndex, self).__init__()
+        self.session_id = session_id
+        self.config = config if config is not None else Config()
+        self._embedder = embedder
+        self.dimension = dimension
+        self.directory = directory
+        self.compact_ratio = compact_ratio
+        self._lock = threading.Lock()
+        self._size = 0
+        self._conversation_ids: List[str] = []
+        self._texts: List[str] = []
+        self._deleted = np.zeros(initial_capacity, dtype=bool)
+        self._deleted_count = 0
+        self._log = None
+        self._closed = False
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._name = re.sub(r"[^A-Za-z0-9_.-]", "_", session_id)
+            self._matrix = np.zeros((0, dimension), dtype=np.float32)
+            self._open(initial_capacity)
+            if hasattr(os, "register_at_fork"):
+                os.register_at_fork(after_in_child=self._after_fork)
+        else:
+            self._matrix = np.zeros((initial_capacity, dimension), dtype=np.float32)
+
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            self._embedder = get_embedder(self.config)
+        return self._embedder
+
+    def __len__(self):
+        return self._size - self._deleted_count
+
+    # ----------------------------------------
+    # Storage
+    # ----------------------------------------
+    def _matrix_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"{self._name}@{self._pid}.{generation}.npy")
+
+    def _open(self, capacity: int):
+        """Start this process's files with the rows it already has plus those of the files of dead processes"""
+        self._pid = os.getpid()
+        self._generation = 0
+        self._log_path = os.path.join(self.directory, f"{self._name}@{self._pid}.jsonl")
+        keep = np.flatnonzero(~self._deleted[:self._size])
+        conversation_ids = [self._conversation_ids[i] for i in keep]
+        texts = [self._texts[i] for i in keep]
+        vectors = [np.array(self._matrix[keep])]
+        orphans = []
+        for path in sorted(glob.glob(os.path.join(glob.escape(self.directory), f"{glob.escape(self._name)}@*.jsonl"))):
+            if not re.fullmatch(rf"{re.escape(self._name)}@\d+\.jsonl", os.path.basename(path)):
+                continue
+            try:
+                orphan = open(path, "rb")
+            except FileNotFoundError:
+                # Merged by another process meanwhile
+                continue
+            try:
+                fcntl.flock(orphan.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # Its process is still alive
+                orphan.close()
+                continue
+            orphans.append(orphan)
+            rows = self._read(path)
+            conversation_ids.extend(rows[0])
+            texts.extend(rows[1])
+            vectors.append(rows[2])
+        self._rewrite(conversation_ids, texts, np.concatenate(vectors), capacity)
+        for orphan in orphans:
+            # A dead process may have had our pid, its log is the one just replaced but not its matrices
+            self._remove_files(orphan.name, keep=self._matrix_path(self._generation))
+            orphan.close()
+        if orphans:
+            count("semantic_recall", "merged", amount=len(orphans))
+
+    def _after_fork(self):
+        """A forked worker writes its own files, starting from the rows of the parent"""
+        if self._closed:
+            return
+        self._lock = threading.Lock()
+        # Closing the inherited descriptor leaves the parent's lock in place
+        self._log.close()
+        self._open(len(self._matrix))
+
+    def _read(self, log_path: str) -> Tuple[List[str], List[str], np.ndarray]:
+        """Live rows of a log and its matrix, rows of the matrix past the log are ignored"""
+        matrix_name = None
+        conversation_ids, texts = [], []
+        with open(log_path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A line torn by a crash, its append never returned
+                    break
+                if "matrix" in record:
+                    matrix_name = record["matrix"]
+                elif "remove" in record:
+                    conversation_ids = [cid if cid != record["remove"] else None for cid in conversation_ids]
+                else:
+                    conversation_ids.append(record["conversation_id"])
+                    texts.append(record["text"])
+        matrix_path = os.path.join(self.directory, matrix_name) if matrix_name is not None else None
+        if matrix_path is None or not conversation_ids or not os.path.exists(matrix_path):
+            return [], [], np.zeros((0, self.dimension), dtype=np.float32)
+        matrix = np.load(matrix_path, mmap_mode="r")
+        size = min(len(conversation_ids), len(matrix))
+        keep = [i for i in range(size) if conversation_ids[i] is not None]
+        return [conversation_ids[i] for i in keep], [texts[i] for i in keep], np.array(matrix[keep])
+
+    def _remove_files(self, log_path: str, keep: str = None):
+        if log_path != self._log_path:
+            os.remove(log_path)
+        for path in glob.glob(glob.escape(log_path[:-len(".jsonl")]) + ".*.npy"):
+            if path != keep:
+                os.remove(path)
+
+    def _new_matrix(self, capacity: int) -> np.ndarray:
+        self._generation += 1
+        return np.lib.format.open_memmap(self._matrix_path(self._generation), mode="w+", dtype=np.float32,
+                                         shape=(capacity, self.dimension))
+
+    def _rewrite(self, conversation_ids: List[str], texts: List[str], vectors: np.ndarray, capacity: int):
+        """Write the rows to a new matrix file, then atomically replace the log with one naming it"""
+        capacity = max(capacity, 1)
+        while capacity < len(vectors):
+            capacity *= 2
+        previous = self._generation
+        matrix = self._new_matrix(capacity)
+        matrix[:len(vectors)] = vectors
+        matrix.flush()
+        log = open(self._log_path + ".tmp", "w", encoding="utf-8")
+        # Held while the process lives, other processes only merge files they can lock
+        fcntl.flock(log.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        log.write(json.dumps({"matrix": os.path.basename(self._matrix_path(self._generation))}) + "\n")
+        for conversation_id, text in zip(conversation_ids, texts):
+            log.write(json.dumps({"conversation_id": conversation_id, "text": text}, ensure_ascii=False) + "\n")
+        log.flush()
+        os.fsync(log.fileno())
+        # The commit point, a crash before it leaves the previous log naming the previous, untouched matrix
+        os.replace(log.name, self._log_path)
+        if self._log is not None and not self._log.closed:
+            self._log.close()
+        self._log = log
+        if previous and os.path.exists(self._matrix_path(previous)):
+            os.remove(self._matrix_path(previous))
+        self._matrix = matrix
+        self._conversation_ids, self._texts = list(conversation_ids), list(texts)
+        self._size = len(vectors)
+        self._deleted = np.zeros(capacity, dtype=bool)
+        self._deleted_count = 0
+
+    def _write_log(self, records: List[dict]):
+        if self._log is None:
+            return
+        self._log.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+        self._log.flush()
+
+    def _grow(self, needed: int):
+        capacity = len(self._matrix)
+        while capacity < needed:
+            capacity *= 2
+        if capacity == len(self._matrix):
+            return
+        if self.directory is None:
+            matrix = np.zeros((capacity, self.dimension), dtype=np.float32)
+            matrix[:self._size] = self._matrix[:self._size]
+        else:
+            # Rows logged from here on live in the new file, the old one is only dropped once the log says so
+            previous = self._matrix_path(self._generation)
+            matrix = self._new_matrix(capacity)
+            matrix[:self._size] = self._matrix[:self._size]
+            matrix.flush()
+            self._write_log([{"matrix": os.path.basename(self._matrix_path(self._generation))}])
+            os.fsync(self._log.fileno())
+            os.remove(previous)
+        deleted = np.zeros(capacity, dtype=bool)
+        deleted[:self._size] = self._deleted[:self._size]
+        self._matrix, self._deleted = matrix, deleted
+
+    # ----------------------------------------
+    # Writes
+    # ----------------------------------------
+    def _normalize(self, vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimension)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    @timed("semantic_recall", "add")
+    def add_turns(self, message_turns: Sequence[MessageTurn]):
+        """Embed the turns with one batched encode and append them"""
+        if not message_turns:
+            return
+        texts = [messages_from_dict(turn.model_dump()) for turn in message_turns]
+        self.add([turn.conversation_id for turn in message_turns], texts, self.embedder.encode(texts))
+
+    def add(self, conversation_ids: Sequence[str], texts: Sequence[str], vectors):
+        vectors = self._normalize(vectors)
+        with self._lock:
+            start = self._size
+            self._grow(start + len(vectors))
+            self._matrix[start:start + len(vectors)] = vectors
+            self._write_log([
+                {"conversation_id": conversation_id, "text": text}
+                for conversation_id, text in zip(conversation_ids, texts)
+            ])
+            self._conversation_ids.extend(conversation_ids)
+            self._texts.extend(texts)
+            self._size += len(vectors)
+
+    def remove(self, conversation_id: str = None):
+        """Mask the turns of a conversation, or drop every turn of the session"""
+        with self._lock:
+            if conversation_id is None:
+                if self.directory is not None:
+                    self._rewrite([], [], self._matrix[:0], len(self._matrix))
+                    return
+                self._size = 0
+                self._conversation_ids, self._texts = [], []
+                self._deleted[:] = False
+                self._deleted_count = 0
+                return
+            mask = np.fromiter((cid == conversation_id for cid in self._conversation_ids), dtype=bool,
+                               count=self._size)
+            newly_deleted = mask & ~self._deleted[:self._size]
+            if not newly_deleted.any():
+                return
+            self._deleted[:self._size] |= mask
+            self._deleted_count += int(newly_deleted.sum())
+            self._write_log([{"remove": conversation_id}])
+            should_compact = self._deleted_count > self.compact_ratio * self._size
+        if should_compact:
+            self.compact()
+
+    def compact(self):
+        """Drop the removed turns, on disk by writing the live rows to a new matrix and log"""
+        with self._lock:
+            keep = np.flatnonzero(~self._deleted[:self._size])
+            conversation_ids = [self._conversation_ids[i] for i in keep]
+            texts = [self._texts[i] for i in keep]
+            if self.directory is not None:
+                self._rewrite(conversation_ids, texts, self._matrix[keep], len(self._matrix))
+            else:
+                self._matrix[:len(keep)] = self._matrix[keep]
+                self._conversation_ids, self._texts = conversation_ids, texts
+                self._size = len(keep)
+                self._deleted[:] = False
+                self._deleted_count = 0
+        count("semantic_recall", "compaction")
+
+    # ----------------------------------------
+    # Reads
+    # ----------------------------------------
+    def search_vector(self, vector, top_k: int = 3) -> List[Tuple[float, str, str]]:
+        """(score, conversation_id, text) of the `top_k` most similar live turns, best first"""
+        vector = self._normalize(vector)[0]
+        with self._lock:
+            size = self._size
+            live = size - self._deleted_count
+            if live <= 0 or top_k <= 0:
+                return []
+            scores = self._matrix[:size] @ vector
+            if live < size:
+                scores[self._deleted[:size]] = -np.inf
+            conversation_ids, texts = self._conversation_ids, self._texts
+        k = min(top_k, live)
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [(float(scores[i]), conversation_ids[i], texts[i]) for i in best]
+
+    @timed("semantic_recall", "search")
+    def search(self, query: str, top_k: int = 3) -> List[Tuple[float, str, str]]:
+        if not query or len(self) == 0:
+            return []
+        return self.search_vector(self.embedder.encode(query), top_k=top_k)
+
+    def recall(self, query: str, top_k: int = 3) -> str:
+        """Similar turns formatted like history, one per line"""
+        return "\n".join(text for _, _, text in self.search(query, top_k=top_k))
+
+    @staticmethod
+    def _prefix(recalled: str, history: str) -> str:
+        if not recalled:
+            return history
+        return f"{recalled}\n{history}" if history else recalled
+
+    def with_recall(self, history: str, query: str, top_k: int = 3) -> str:
+        """Prefix the recent history with the turns most similar to the query"""
+        return self._prefix(self.recall(query, top_k=top_k), history)
+
+    def with_recall_many(self, histories: Sequence[str], queries: Sequence[str], top_k: int = 3) -> List[str]:
+        """`with_recall` for many histories, the queries embedded with one batched encode"""
+        positions = [i for i, query in enumerate(queries) if query]
+        if not positions or len(self) == 0:
+            return list(histories)
+        vectors = self.embedder.encode([queries[i] for i in positions])
+        recalled = [""] * len(histories)
+        for i, vector in zip(positions, vectors):
+            recalled[i] = "\n".join(text for _, _, text in self.search_vector(vector, top_k=top_k))
+        return [self._prefix(r, history) for r, history in zip(recalled, histories)]
+
+    def flush(self):
+        with self._lock:
+            if self.directory is not None:
+                self._matrix.flush()
+                self._log.flush()
+                os.fsync(self._log.fileno())
+
+    def close(self):
+        self.flush()
+        self._closed = True
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+
+_indexes: Dict[Tuple[str, Optional[str]], SemanticRecallIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_recall_index(config: Config, session_id: str = None, embedder=None) -> Optional[SemanticRecallIndex]:
+    """Process-wide index of a session shared by every memory using it, None when semantic recall is disabled"""
+    if not config.semantic_recall:
+        return None
+    session_id = session_id if session_id is not None else config.session_id
+    key = (session_id, config.recall_directory)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = SemanticRecallIndex(
+                session_id=session_id,
+                config=config,
+                embedder=embedder,
+                directory=config.recall_directory,
+            )
+    return index
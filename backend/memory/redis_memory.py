@@ -1,10 +1,20 @@
 import json
-from typing import List
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
 import redis
 from redis.exceptions import RedisError
 
 from common.config import Config, BaseObject
-from common.objects import MessageTurn, messages_from_dict, Message
+from common.metrics import timed
+from common.objects import MessageTurn, messages_from_dict, Message, parse_int_cursor
+from memory.recall import get_recall_index
+
+KEY_PREFIX = "chat"
+
+
+def escape_pattern(value: str) -> str:
+    """Escape glob characters so a value can be embedded in a SCAN MATCH pattern"""
+    return "".join(f"\\{char}" if char in "*?[]\\" else char for char in value)
+
 
 class BaseCustomRedisChatbotMemory(BaseObject):
     def __init__(
@@ -15,6 +25,8 @@ class BaseCustomRedisChatbotMemory(BaseObject):
         database_name: str = None,   # Redis DB index
         k: int = 5,
         expire_seconds: int = 3600,  # default 1 hour
+        client: redis.Redis = None,
+        batch_size: int = 500,
         **kwargs,
     ):
         super(BaseCustomRedisChatbotMemory, self).__init__()
@@ -22,10 +34,11 @@ class BaseCustomRedisChatbotMemory(BaseObject):
         self.session_id = session_id
         self.k = k
         self.expire_seconds = expire_seconds
+        self.batch_size = batch_size
 
         try:
             # Example connection_string: redis://localhost:6379/0
-            self.client = redis.from_url(
+            self.client = client if client is not None else redis.from_url(
                 connection_string or "redis://localhost:6379/0",
                 decode_responses=True,
             )
@@ -34,42 +47,139 @@ class BaseCustomRedisChatbotMemory(BaseObject):
             self.logger.error(f"❌ Redis connection failed: {e}")
             raise
 
+    def conversation_key(self, conversation_id: str) -> str:
+        return f"{KEY_PREFIX}:{self.session_id}:conv:{conversation_id}"
+
+    def index_key(self) -> str:
+        """Set of the conversation ids of this session"""
+        return f"{KEY_PREFIX}:{self.session_id}:conversations"
+
+    @timed("redis_memory", "add_message")
     def add_message(self, message_turn: MessageTurn):
         """Store one message turn (append to Redis list)"""
         try:
-            key = message_turn.conversation_id
+            key = self.conversation_key(message_turn.conversation_id)
             data = json.dumps(message_turn.model_dump(), ensure_ascii=False)
-            self.client.rpush(key, data)
-            
-            # ✅ Set expiry time (refresh on each insert)
-            self.client.expire(key, self.expire_seconds)
+            # One round trip, expiry is refreshed on each insert
+            pipe = self.client.pipeline(transaction=False)
+            pipe.rpush(key, data)
+            pipe.expire(key, self.expire_seconds)
+            pipe.sadd(self.index_key(), message_turn.conversation_id)
+            pipe.expire(self.index_key(), self.expire_seconds)
+            pipe.execute()
 
             self.logger.info(f"💾 Added message turn for conversation <{message_turn.conversation_id}>")
 
         except RedisError as e:
             self.logger.error(f"Redis insert error: {e}")
-    
+
+    def insert_messages(self, message_turns: Sequence[MessageTurn]) -> int:
+        """Store many message turns with one pipeline, in order, errors are raised to the caller"""
+        pipe = self.client.pipeline(transaction=False)
+        conversation_ids = []
+        for message_turn in message_turns:
+            pipe.rpush(self.conversation_key(message_turn.conversation_id),
+                       json.dumps(message_turn.model_dump(), ensure_ascii=False))
+            conversation_ids.append(message_turn.conversation_id)
+        if not conversation_ids:
+            return 0
+        for conversation_id in set(conversation_ids):
+            pipe.expire(self.conversation_key(conversation_id), self.expire_seconds)
+        pipe.sadd(self.index_key(), *conversation_ids)
+        pipe.expire(self.index_key(), self.expire_seconds)
+        pipe.execute()
+        return len(conversation_ids)
+
+    @timed("redis_memory", "add_messages")
+    def add_messages(self, message_turns: Sequence[MessageTurn]):
+        """Store many message turns with one pipeline, in order"""
+        try:
+            saved = self.insert_messages(message_turns)
+            if saved:
+                self.logger.info(f"💾 Added {saved} message turns")
+        except RedisError as e:
+            self.logger.error(f"Redis insert error: {e}")
+
+    def _unlink_batches(self, keys, batches_per_round_trip: int = 10) -> int:
+        """
+        UNLINK keys in batches of `batch_size`, queued on a pipeline sent once per `batches_per_round_trip`
+        batches. Memory is reclaimed in the background by Redis
+        """
+        unlinked = 0
+        pipe = self.client.pipeline(transaction=False)
+        batch = []
+        queued = 0
+        for key in keys:
+            batch.append(key)
+            if len(batch) >= self.batch_size:
+                pipe.unlink(*batch)
+                batch = []
+                queued += 1
+                if queued >= batches_per_round_trip:
+                    unlinked += sum(pipe.execute())
+                    queued = 0
+        if batch:
+            pipe.unlink(*batch)
+            queued += 1
+        if queued:
+            unlinked += sum(pipe.execute())
+        return unlinked
+
+    def clear_session(self, scan: bool = False) -> int:
+        """
+        Delete every conversation of this session using the index set.
+        With `scan`, keys are also found with an incremental SCAN, for keys written without the index.
+        """
+        conversation_ids = self.client.sscan_iter(self.index_key(), count=self.batch_size)
+        deleted = self._unlink_batches(self.conversation_key(cid) for cid in conversation_ids)
+        if scan:
+            pattern = f"{KEY_PREFIX}:{escape_pattern(self.session_id)}:conv:*"
+            deleted += self._unlink_batches(self.client.scan_iter(match=pattern, count=self.batch_size))
+        self.client.unlink(self.index_key())
+        return deleted
+
+    @timed("redis_memory", "clear_history")
     def clear_history(self, conversation_id: str = None):
         """Clear messages in one conversation or all of this session"""
         try:
             if conversation_id:
-                key = conversation_id
-                self.client.delete(key)
+                pipe = self.client.pipeline(transaction=False)
+                pipe.unlink(self.conversation_key(conversation_id))
+                pipe.srem(self.index_key(), conversation_id)
+                pipe.execute()
                 self.logger.info(f"🗑️ Deleted history for conversation <{conversation_id}>")
             else:
-                # Delete all keys for this session
-                pattern = f"chat:{self.session_id}:*"
-                keys = self.client.keys(pattern)
-                if keys:
-                    self.client.delete(*keys)
-                    self.logger.warning(f"⚠️ Deleted all history for session <{self.session_id}>")
+                deleted = self.clear_session()
+                self.logger.warning(f"⚠️ Deleted all history for session <{self.session_id}> ({deleted} conversations)")
         except RedisError as e:
             self.logger.error(f"Redis delete error: {e}")
 
+    @timed("redis_memory", "get_messages")
+    def get_messages(self, conversation_id: str, cursor: Optional[str] = None,
+                     limit: int = 50) -> Tuple[List[dict], Optional[str]]:
+        """One page of turns starting at list index `cursor`, with the cursor of the next page"""
+        start = parse_int_cursor(cursor) or 0
+        items = self.client.lrange(self.conversation_key(conversation_id), start, start + limit)
+        next_cursor = str(start + limit) if len(items) > limit else None
+        return [{"index": start + i, **json.loads(item)} for i, item in enumerate(items[:limit])], next_cursor
+
+    def iter_messages(self, conversation_id: str, batch_size: int = 500) -> Iterator[dict]:
+        """Every turn of a conversation read in LRANGE chunks of `batch_size`"""
+        key = self.conversation_key(conversation_id)
+        start = 0
+        while True:
+            items = self.client.lrange(key, start, start + batch_size - 1)
+            for i, item in enumerate(items):
+                yield {"index": start + i, **json.loads(item)}
+            if len(items) < batch_size:
+                return
+            start += batch_size
+
+    @timed("redis_memory", "load_history")
     def load_history(self, conversation_id: str) -> str:
         """Load the last k messages"""
         try:
-            key =  conversation_id
+            key = self.conversation_key(conversation_id)
             all_items = self.client.lrange(key, -self.k, -1)
             items = [json.loads(item) for item in all_items]
             messages: List[str] = [messages_from_dict(item) for item in items]
@@ -78,13 +188,34 @@ class BaseCustomRedisChatbotMemory(BaseObject):
             self.logger.error(f"Redis read error: {e}")
             return ""
 
+    @timed("redis_memory", "load_histories")
+    def load_histories(self, conversation_ids: Sequence[str]) -> Dict[str, str]:
+        """Load the last k messages of many conversations with one pipeline"""
+        unique_ids = list(dict.fromkeys(conversation_ids))
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for conversation_id in unique_ids:
+                pipe.lrange(self.conversation_key(conversation_id), -self.k, -1)
+            replies = pipe.execute()
+        except RedisError as e:
+            self.logger.error(f"Redis read error: {e}")
+            replies = [[] for _ in unique_ids]
+        return {
+            conversation_id: "\n".join(messages_from_dict(json.loads(item)) for item in items)
+            for conversation_id, items in zip(unique_ids, replies)
+        }
+
 
 class CustomRedisChatbotMemory(BaseObject):
     """User-facing wrapper that uses Config and hides Redis details"""
 
     def __init__(self, config: Config = None, **kwargs):
         super(CustomRedisChatbotMemory, self).__init__()
+        self.config = config
+        # Similar turns of the whole session, from an in-process index (None unless semantic_recall is set)
+        self.recall = get_recall_index(config)
         self.memory = BaseCustomRedisChatbotMemory(
+            config=config,
             connection_string=config.redis_connection_string,
             session_id=config.session_id,
             database_name=config.redis_database_name,
@@ -93,9 +224,44 @@ class CustomRedisChatbotMemory(BaseObject):
     
     def add_message(self, message_turn: MessageTurn):
         self.memory.add_message(message_turn)
+        if self.recall is not None:
+            self.recall.add_turns([message_turn])
+
+    def add_messages(self, message_turns: List[MessageTurn]):
+        self.memory.add_messages(message_turns)
+        if self.recall is not None:
+            self.recall.add_turns(message_turns)
+
+    def insert_messages(self, message_turns: List[MessageTurn]) -> int:
+        saved = self.memory.insert_messages(message_turns)
+        if self.recall is not None:
+            try:
+                self.recall.add_turns(message_turns)
+            except Exception as e:
+                # The turns are stored, raising would store them again
+                self.logger.error(f"Could not index {len(message_turns)} message turns for recall: {e}")
+        return saved
 
     def clear(self, conversation_id: str = None):
         self.memory.clear_history(conversation_id=conversation_id)
+        if self.recall is not None:
+            self.recall.remove(conversation_id)
+
+    def load_history(self, conversation_id: str, input: str = None):
+        history = self.memory.load_history(conversation_id)
+        if self.recall is not None:
+            history = self.recall.with_recall(history, input, top_k=self.config.recall_top_k)
+        return history
+
+    def load_histories(self, conversation_ids: List[str], inputs: List[str] = None) -> List[str]:
+        histories = self.memory.load_histories(conversation_ids)
+        histories = [histories[conversation_id] for conversation_id in conversation_ids]
+        if self.recall is not None and inputs is not None:
+            histories = self.recall.with_recall_many(histories, inputs, top_k=self.config.recall_top_k)
+        return histories
+
+    def get_messages(self, conversation_id: str, cursor: str = None, limit: int = 50):
+        return self.memory.get_messages(conversation_id, cursor=cursor, limit=limit)
 
-    def load_history(self, conversation_id: str):
-        return self.memory.load_history(conversation_id)
\ No newline at end of file
+    def iter_messages(self, conversation_id: str, batch_size: int = 500):
+        return self.memory.iter_messages(conversation_id, batch_size=batch_size)
\ No newline at end of file
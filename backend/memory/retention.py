@@ -0,0 +1,266 @@
+"""Retention of the SQL chat_memory table: chunked deletes, range partitions and a throttled purge worker."""
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, select, text
+from sqlalchemy.engine import Engine
+
+from common.config import BaseObject, Config
+from common.metrics import count, track
+from common.objects import ChatMemory
+
+chat_memory = ChatMemory.__table__
+_UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+
+def delete_in_batches(
+        engine: Engine,
+        *criteria,
+        batch_size: int = 1000,
+        pause_seconds: float = 0,
+        max_batches: int = None,
+) -> int:
+    """
+    Delete matching rows a batch at a time, each batch in its own short transaction,
+    so a large delete never holds row locks for long. Returns the number of deleted rows.
+    """
+    deleted = 0
+    batches = 0
+    while True:
+        with engine.begin() as conn:
+            ids = conn.execute(select(chat_memory.c.id).where(*criteria).limit(batch_size)).scalars().all()
+            if ids:
+                conn.execute(delete(chat_memory).where(chat_memory.c.id.in_(ids)))
+        deleted += len(ids)
+        batches += 1
+        if len(ids) < batch_size or (max_batches and batches >= max_batches):
+            break
+        if pause_seconds:
+            time.sleep(pause_seconds)
+    if deleted:
+        count("retention", "deleted_rows", amount=deleted)
+    return deleted
+
+
+# ----------------------------------------
+# Monthly range partitions (PostgreSQL)
+# ----------------------------------------
+def month_start(moment: datetime) -> datetime:
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(moment: datetime) -> datetime:
+    return (month_start(moment) + timedelta(days=32)).replace(day=1)
+
+
+def partition_name(start: datetime, table_name: str = chat_memory.name) -> str:
+    return f"{table_name}_p{start:%Y%m}"
+
+
+def is_partitioned(engine: Engine, table_name: str = chat_memory.name) -> bool:
+    if engine.dialect.name != "postgresql":
+        return False
+    with engine.connect() as conn:
+        return bool(conn.execute(text(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+            "WHERE c.relname = :table_name)"
+        ), {"table_name": table_name}).scalar())
+
+
+def ensure_partitions(engine: Engine, months_ahead: int = 2, table_name: str = chat_memory.name,
+                      now: datetime = None) -> List[str]:
+    """Create the partitions of the current month and the next `months_ahead` ones not covered yet"""
+    start = month_start(now or datetime.utcnow())
+    last = next_month(start)
+    for _ in range(months_ahead):
+        last = next_month(last)
+    # Months inside an existing partition, such as the one holding rows from before partitioning, are skipped
+    covered = max((upper for _, upper in list_partitions(engine, table_name) if upper is not None), default=None)
+    if covered is not None and covered > start:
+        start = covered
+    names = []
+    with engine.begin() as conn:
+        while start < last:
+            end = next_month(start)
+            name = partition_name(start, table_name)
+            conn.execute(text(
+                f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{table_name}" '
+                f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+            ))
+            names.append(name)
+            start = end
+    return names
+
+
+def list_partitions(engine: Engine, table_name: str = chat_memory.name) -> List[Tuple[str, Optional[datetime]]]:
+    """Partitions of the table with their exclusive upper bound, None for unbounded ones"""
+    with engine.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = :table_name"
+        ), {"table_name": table_name}).all()
+    partitions = []
+    for name, bound in rows:
+        match = _UPPER_BOUND.search(bound or "")
+        upper = datetime.fromisoformat(match.group(1)) if match else None
+        partitions.append((name, upper))
+    return partitions
+
+
+def drop_partitions_before(engine: Engine, cutoff: datetime, table_name: str = chat_memory.name) -> List[str]:
+    """Detach and drop every partition holding only rows older than `cutoff`, a metadata-only operation"""
+    dropped = []
+    for name, upper in list_partitions(engine, table_name):
+        if upper is None or upper > cutoff:
+            continue
+        with engine.begin() as conn:
+            conn.execute(text(f'ALTER TABLE "{table_name}" DETACH PARTITION "{name}"'))
+            conn.execute(text(f'DROP TABLE "{name}"'))
+        dropped.append(name)
+        count("retention", "dropped_partitions")
+    return dropped
+
+
+# ----------------------------------------
+# Background purge
+# ----------------------------------------
+class RetentionWorker(BaseObject):
+    """
+    Background thread enforcing age and turn-count retention on chat_memory.
+    Work is done in small batches separated by pauses so it never competes with requests for long.
+    """
+
+    def __init__(
+            self,
+            engine: Engine,
+            max_age_days: float = None,
+            max_turns: int = None,
+            batch_size: int = 1000,
+            pause_seconds: float = 0.05,
+            interval_seconds: float = 300,
+            max_batches_per_run: int = 100,
+            partition_months_ahead: int = 2,
+    ):
+        super(RetentionWorker, self).__init__()
+        self.engine = engine
+        self.max_age_days = max_age_days
+        self.max_turns = max_turns
+        self.batch_size = batch_size
+        self.pause_seconds = pause_seconds
+        self.interval_seconds = interval_seconds
+        self.max_batches_per_run = max_batches_per_run
+        self.partition_months_ahead = partition_months_ahead
+        self.partitioned = is_partitioned(engine)
+        # Only conversations written since the previous run can have grown past max_turns
+        self._last_run: Optional[datetime] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_config(cls, engine: Engine, config: Config) -> "RetentionWorker":
+        return cls(
+            engine=engine,
+            max_age_days=config.retention_max_age_days,
+            max_turns=config.retention_max_turns,
+            batch_size=config.retention_batch_size,
+            pause_seconds=config.retention_pause_seconds,
+            interval_seconds=config.retention_interval_seconds,
+        )
+
+    def purge_expired(self, now: datetime) -> int:
+        cutoff = now - timedelta(days=self.max_age_days)
+        if self.partitioned:
+            dropped = drop_partitions_before(self.engine, cutoff)
+            if dropped:
+                self.logger.info(f"Dropped expired partitions {dropped}")
+        # Rows of the partition the cutoff falls into, or of an unpartitioned table
+        return delete_in_batches(
+            self.engine, chat_memory.c.CreatedAt < cutoff,
+            batch_size=self.batch_size, pause_seconds=self.pause_seconds, max_batches=self.max_batches_per_run
+        )
+
+    def purge_excess_turns(self) -> int:
+        since = self._last_run
+        query = select(chat_memory.c.SessionId, chat_memory.c.ConversationId).distinct()
+        if since is not None:
+            query = query.where(chat_memory.c.CreatedAt >= since)
+        with self.engine.connect() as conn:
+            conversations = conn.execute(query).all()
+
+        deleted = 0
+        for session_id, conversation_id in conversations:
+            same_conversation = (chat_memory.c.SessionId == session_id, chat_memory.c.ConversationId == conversation_id)
+            with self.engine.connect() as conn:
+                # CreatedAt of the oldest turn to keep
+                boundary = conn.execute(
+                    select(chat_memory.c.CreatedAt).where(*same_conversation)
+                    .order_by(chat_memory.c.CreatedAt.desc()).offset(self.max_turns - 1).limit(1)
+                ).scalar()
+            if boundary is None:
+                continue
+            deleted += delete_in_batches(
+                self.engine, *same_conversation, chat_memory.c.CreatedAt < boundary,
+                batch_size=self.batch_size, pause_seconds=self.pause_seconds, max_batches=self.max_batches_per_run
+            )
+            if self.pause_seconds:
+                time.sleep(self.pause_seconds)
+        return deleted
+
+    def purge_once(self) -> Dict[str, int]:
+        now = datetime.utcnow()
+        result = {"expired": 0, "excess_turns": 0}
+        with track("retention", "purge"):
+            if self.partitioned:
+                ensure_partitions(self.engine, months_ahead=self.partition_months_ahead, now=now)
+            if self.max_age_days:
+                result["expired"] = self.purge_expired(now)
+            if self.max_turns:
+                result["excess_turns"] = self.purge_excess_turns()
+        self._last_run = now
+        if any(result.values()):
+            self.logger.info(f"Purged chat history: {result}")
+        return result
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                self.purge_once()
+            except Exception as e:
+                count("retention", "purge_error")
+                self.logger.error(f"Retention purge failed: {e}")
+            self._stop.wait(self.interval_seconds)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._work, name="retention", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval_seconds)
+
+
+_workers: Dict[str, RetentionWorker] = {}
+_workers_lock = threading.Lock()
+
+
+def start_retention_worker(engine: Engine, config: Config) -> Optional[RetentionWorker]:
+    """
+    One worker per database, shared by every memory using it. None when no retention is configured.
+    Forked serving workers inherit the registered worker without its thread, so the purge runs once, in the parent.
+    """
+    if not (config.retention_max_age_days or config.retention_max_turns):
+        return None
+    key = engine.url.render_as_string(hide_password=False)
+    with _workers_lock:
+        worker = _workers.get(key)
+        if worker is None:
+            worker = _workers[key] = RetentionWorker.from_config(engine, config).start()
+    return worker
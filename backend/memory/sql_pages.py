@@ -0,0 +1,84 @@
+"""Keyset pagination, streamed and bulk reads of the SQL chat_memory table, shared by the MySQL and Postgres memories."""
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Table, func, insert, select
+from sqlalchemy.engine import Engine
+
+from common.objects import ChatMemory, MessageTurn, parse_int_cursor
+
+chat_memory = ChatMemory.__table__
+_columns = (chat_memory.c.id, chat_memory.c.History, chat_memory.c.CreatedAt)
+
+
+def _message(row) -> dict:
+    return {"id": row.id, **row.History, "created_at": row.CreatedAt}
+
+
+def get_messages_page(engine: Engine, session_id: str, conversation_id: str, cursor: Optional[str] = None,
+                      limit: int = 50) -> Tuple[List[dict], Optional[str]]:
+    """One page of turns with an id after `cursor`, an index range scan however deep the page is"""
+    query = select(*_columns).where(
+        chat_memory.c.SessionId == session_id, chat_memory.c.ConversationId == conversation_id
+    )
+    after = parse_int_cursor(cursor)
+    if after is not None:
+        query = query.where(chat_memory.c.id > after)
+    with engine.connect() as conn:
+        rows = conn.execute(query.order_by(chat_memory.c.id).limit(limit + 1)).all()
+    next_cursor = str(rows[limit - 1].id) if len(rows) > limit else None
+    return [_message(row) for row in rows[:limit]], next_cursor
+
+
+def iter_messages(engine: Engine, session_id: str, conversation_id: str = None,
+                  batch_size: int = 500) -> Iterator[dict]:
+    """
+    Every turn of a conversation, or of the whole session, from a server-side cursor.
+    Only `batch_size` rows are buffered by the driver at a time.
+    """
+    query = select(*_columns).where(chat_memory.c.SessionId == session_id)
+    if conversation_id is not None:
+        query = query.where(chat_memory.c.ConversationId == conversation_id)
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(
+            query.order_by(chat_memory.c.id)
+        )
+        for row in result:
+            yield _message(row)
+
+
+def load_recent_turns(engine: Engine, session_id: str, conversation_ids: Sequence[str],
+                      k: int = 5) -> Dict[str, List[dict]]:
+    """Last `k` turns of each conversation, oldest first, read with one window-function query"""
+    rank = func.row_number().over(
+        partition_by=chat_memory.c.ConversationId,
+        order_by=(chat_memory.c.CreatedAt.desc(), chat_memory.c.id.desc())
+    ).label("rank")
+    recent = select(chat_memory.c.id, chat_memory.c.ConversationId, chat_memory.c.History, rank).where(
+        chat_memory.c.SessionId == session_id, chat_memory.c.ConversationId.in_(set(conversation_ids))
+    ).subquery()
+    query = select(recent.c.ConversationId, recent.c.History).where(recent.c.rank <= k) \
+        .order_by(recent.c.ConversationId, recent.c.rank.desc())
+    turns = {conversation_id: [] for conversation_id in conversation_ids}
+    with engine.connect() as conn:
+        for row in conn.execute(query):
+            turns[row.ConversationId].append(row.History)
+    return turns
+
+
+def insert_turns(engine: Engine, session_id: str, turns: Sequence[MessageTurn],
+                 extra_columns: Sequence[dict] = None, table: Table = chat_memory) -> int:
+    """
+    Insert many turns in one transaction with a single executemany, `extra_columns` holds per-row values
+    of columns `table` has beyond those of chat_memory
+    """
+    rows = [
+        {"ConversationId": turn.conversation_id, "SessionId": session_id, "History": turn.model_dump()}
+        for turn in turns
+    ]
+    if extra_columns is not None:
+        for row, columns in zip(rows, extra_columns):
+            row.update(columns)
+    if rows:
+        with engine.begin() as conn:
+            conn.execute(insert(table), rows)
+    return len(rows)
@@ -0,0 +1,270 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from common.config import Config, BaseObject
+from common.metrics import timed
+from common.objects import MessageTurn, messages_from_dict, parse_int_cursor
+from memory.recall import get_recall_index
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chat_memory (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    conversation_id TEXT NOT NULL,
+    history TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_chat_memory_conversation ON chat_memory (session_id, conversation_id, id);
+"""
+
+
+class BaseCustomSQLiteChatbotMemory(BaseObject):
+    """
+    Chat memory in a local SQLite file, for single-node deployments without a database server.
+
+    The database runs in WAL mode, so readers never wait on the writer, with `synchronous=NORMAL`,
+    which only syncs at checkpoints and keeps each commit to an append to the log. The last K turns of a
+    conversation are read with one range scan of the (session_id, conversation_id, id) index.
+    Each thread uses its own connection, writes are serialized in process by a lock.
+    """
+
+    def __init__(
+            self,
+            config: Config = None,
+            path: str = "chat_memory.db",
+            session_id: str = None,
+            k: int = 5,
+            busy_timeout: float = 5.0,
+            **kwargs,
+    ):
+        super(BaseCustomSQLiteChatbotMemory, self).__init__()
+        self.config = config if config is not None else Config()
+        self.path = path
+        self.session_id = session_id
+        self.k = k
+        self.busy_timeout = busy_timeout
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        try:
+            self.connection.executescript(SCHEMA)
+        except sqlite3.Error as e:
+            self.logger.error(f"Database initialization failed: {e}")
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None or getattr(self._local, "pid", None) != os.getpid():
+            # Connections must not cross a fork, a forked worker opens its own
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA temp_store=MEMORY")
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def _insert(self, message_turns: Sequence[MessageTurn]) -> int:
+        created_at = datetime.utcnow().isoformat()
+        rows = [
+            (self.session_id, turn.conversation_id, json.dumps(turn.model_dump(), ensure_ascii=False), created_at)
+            for turn in message_turns
+        ]
+        if not rows:
+            return 0
+        with self._write_lock:
+            connection = self.connection
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.executemany(
+                    "INSERT INTO chat_memory (session_id, conversation_id, history, created_at) VALUES (?, ?, ?, ?)",
+                    rows
+                )
+                connection.execute("COMMIT")
+            except sqlite3.Error:
+                connection.execute("ROLLBACK")
+                raise
+        return len(rows)
+
+    @timed("sqlite_memory", "add_message")
+    def add_message(self, message_turn: MessageTurn):
+        """Insert one message turn"""
+        try:
+            self._insert([message_turn])
+            self.logger.info(f"Saved 1 message turn for conversation <{message_turn.conversation_id}>")
+        except sqlite3.Error as e:
+            self.logger.error(f"SQLite insert error: {e}")
+
+    def insert_messages(self, message_turns: Sequence[MessageTurn]) -> int:
+        """Insert many message turns in one transaction, errors are raised to the caller"""
+        return self._insert(message_turns)
+
+    @timed("sqlite_memory", "add_messages")
+    def add_messages(self, message_turns: Sequence[MessageTurn]):
+        """Insert many message turns in one transaction"""
+        try:
+            saved = self.insert_messages(message_turns)
+            self.logger.info(f"Saved {saved} message turns")
+        except sqlite3.Error as e:
+            self.logger.error(f"SQLite insert error: {e}")
+
+    @timed("sqlite_memory", "clear_history")
+    def clear_history(self, conversation_id: str = None):
+        """Delete messages by conversation or all in session"""
+        try:
+            with self._write_lock:
+                if conversation_id:
+                    self.logger.info(
+                        f"Deleting history of conversation <{conversation_id}> in session <{self.session_id}>")
+                    self.connection.execute(
+                        "DELETE FROM chat_memory WHERE session_id = ? AND conversation_id = ?",
+                        (self.session_id, conversation_id)
+                    )
+                else:
+                    self.logger.warning(f"Deleting ALL history for session <{self.session_id}>")
+                    self.connection.execute("DELETE FROM chat_memory WHERE session_id = ?", (self.session_id,))
+        except sqlite3.Error as e:
+            self.logger.error(f"SQLite delete error: {e}")
+
+    def _recent(self, conversation_id: str) -> List[dict]:
+        rows = self.connection.execute(
+            "SELECT history FROM chat_memory WHERE session_id = ? AND conversation_id = ? ORDER BY id DESC LIMIT ?",
+            (self.session_id, conversation_id, self.k)
+        ).fetchall()
+        return [json.loads(history) for history, in reversed(rows)]
+
+    @timed("sqlite_memory", "load_history")
+    def load_history(self, conversation_id: str) -> str:
+        """Retrieve last K messages"""
+        try:
+            return "\n".join(messages_from_dict(item) for item in self._recent(conversation_id))
+        except sqlite3.Error as e:
+            self.logger.error(f"SQLite select error: {e}")
+            return ""
+
+    @timed("sqlite_memory", "load_histories")
+    def load_histories(self, conversation_ids: Sequence[str]) -> Dict[str, str]:
+        """Retrieve the last K messages of many conversations, one index range scan each in one read transaction"""
+        histories = {conversation_id: "" for conversation_id in conversation_ids}
+        connection = self.connection
+        try:
+            connection.execute("BEGIN")
+            try:
+                for conversation_id in histories:
+                    histories[conversation_id] = "\n".join(
+                        messages_from_dict(item) for item in self._recent(conversation_id)
+                    )
+            finally:
+                connection.execute("COMMIT")
+        except sqlite3.Error as e:
+            self.logger.error(f"SQLite select error: {e}")
+        return histories
+
+    @staticmethod
+    def _message(row: Tuple[int, str, str]) -> dict:
+        id, history, created_at = row
+        return {"id": id, **json.loads(history), "created_at": created_at}
+
+    @timed("sqlite_memory", "get_messages")
+    def get_messages(self, conversation_id: str, cursor: str = None,
+                     limit: int = 50) -> Tuple[List[dict], Optional[str]]:
+        """One page of turns after `cursor`, with the cursor of the next page"""
+        rows = self.connection.execute(
+            "SELECT id, history, created_at FROM chat_memory "
+            "WHERE session_id = ? AND conversation_id = ? AND id > ? ORDER BY id LIMIT ?",
+            (self.session_id, conversation_id, parse_int_cursor(cursor) or 0, limit + 1)
+        ).fetchall()
+        next_cursor = str(rows[limit - 1][0]) if len(rows) > limit else None
+        return [self._message(row) for row in rows[:limit]], next_cursor
+
+    def iter_messages(self, conversation_id: str = None, batch_size: int = 500) -> Iterator[dict]:
+        """Every turn of a conversation, or of the whole session, read `batch_size` rows at a time"""
+        query = "SELECT id, history, created_at FROM chat_memory WHERE session_id = ?"
+        parameters: tuple = (self.session_id,)
+        if conversation_id is not None:
+            query += " AND conversation_id = ?"
+            parameters += (conversation_id,)
+        cursor = self.connection.execute(query + " ORDER BY id", parameters)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            for row in rows:
+                yield self._message(row)
+
+
+class CustomSQLiteChatbotMemory(BaseObject):
+    """User-facing wrapper that uses Config and hides the internal Base class"""
+
+    def __init__(self, config: Config = None, **kwargs):
+        super(CustomSQLiteChatbotMemory, self).__init__()
+        self.config = config
+        self.memory = BaseCustomSQLiteChatbotMemory(
+            config=config,
+            path=kwargs.pop("path", config.sqlite_path),
+            session_id=config.session_id,
+            **kwargs,
+        )
+        # Similar turns of the whole session, from an in-process index (None unless semantic_recall is set)
+        self.recall = get_recall_index(config)
+        if self.recall is not None and len(self.recall) == 0:
+            self._rebuild_recall()
+
+    def _rebuild_recall(self, batch_size: int = 256):
+        """Index the turns already stored, e.g. when the index is not kept on disk under recall_directory"""
+        batch = []
+        for message in self.memory.iter_messages(batch_size=batch_size):
+            batch.append(MessageTurn(**message))
+            if len(batch) == batch_size:
+                self.recall.add_turns(batch)
+                batch = []
+        self.recall.add_turns(batch)
+
+    def clear(self, conversation_id: str = None):
+        self.memory.clear_history(conversation_id=conversation_id)
+        if self.recall is not None:
+            self.recall.remove(conversation_id)
+
+    def load_history(self, conversation_id: str, input: str = None):
+        history = self.memory.load_history(conversation_id)
+        if self.recall is not None:
+            history = self.recall.with_recall(history, input, top_k=self.config.recall_top_k)
+        return history
+
+    def load_histories(self, conversation_ids: List[str], inputs: List[str] = None) -> List[str]:
+        histories = self.memory.load_histories(conversation_ids)
+        histories = [histories[conversation_id] for conversation_id in conversation_ids]
+        if self.recall is not None and inputs is not None:
+            histories = self.recall.with_recall_many(histories, inputs, top_k=self.config.recall_top_k)
+        return histories
+
+    def get_messages(self, conversation_id: str, cursor: str = None, limit: int = 50):
+        return self.memory.get_messages(conversation_id, cursor=cursor, limit=limit)
+
+    def iter_messages(self, conversation_id: str, batch_size: int = 500):
+        return self.memory.iter_messages(conversation_id, batch_size=batch_size)
+
+    def add_message(self, message_turn: MessageTurn):
+        self.memory.add_message(message_turn)
+        if self.recall is not None:
+            self.recall.add_turns([message_turn])
+
+    def add_messages(self, message_turns: List[MessageTurn]):
+        self.memory.add_messages(message_turns)
+        if self.recall is not None:
+            self.recall.add_turns(message_turns)
+
+    def insert_messages(self, message_turns: List[MessageTurn]) -> int:
+        saved = self.memory.insert_messages(message_turns)
+        if self.recall is not None:
+            try:
+                self.recall.add_turns(message_turns)
+            except Exception as e:
+                # The turns are stored, raising would store them again
+                self.logger.error(f"Could not index {len(message_turns)} message turns for recall: {e}")
+        return saved
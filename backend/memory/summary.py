@@ -0,0 +1,322 @@
+import threading
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from enum import Enum
+from typing import Callable, Dict, List, Optional, Set
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import PromptTemplate
+from pydantic import BaseModel, Field
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
+
+from common.config import BaseObject, Config
+from common.metrics import MetricsCallbackHandler, count, track
+from common.objects import ConversationSummary
+from memory.engines import get_engine
+from prompts import SUMMARY_PROMPT
+
+SUMMARY_HEADER = "Summary of the earlier conversation:"
+
+
+class SummaryState(BaseModel):
+    conversation_id: str = Field(description="Id of the summarized conversation")
+    summary: str = Field(default="", description="Running summary of the folded turns")
+    turns: List[str] = Field(default_factory=list, description="Formatted turns not folded into the summary yet")
+    folded_turns: int = Field(default=0, description="Number of turns folded into the summary so far")
+
+
+class InMemorySummaryStore(BaseObject):
+    """Summaries of this process only, use a shared store when running several workers"""
+
+    def __init__(self, config: Config = None, session_id: str = None, **kwargs):
+        super(InMemorySummaryStore, self).__init__()
+        self._states: Dict[str, str] = {}
+
+    def get(self, conversation_id: str) -> Optional[SummaryState]:
+        state = self._states.get(conversation_id)
+        return SummaryState.model_validate_json(state) if state is not None else None
+
+    def save(self, state: SummaryState):
+        self._states[state.conversation_id] = state.model_dump_json()
+
+    def delete(self, conversation_id: str = None):
+        if conversation_id is None:
+            self._states.clear()
+        else:
+            self._states.pop(conversation_id, None)
+
+
+class MongoSummaryStore(BaseObject):
+    def __init__(self, config: Config = None, session_id: str = None, collection=None, client=None, **kwargs):
+        super(MongoSummaryStore, self).__init__()
+        self.config = config if config is not None else Config()
+        self.session_id = session_id if session_id is not None else self.config.session_id
+        if collection is None:
+            from memory.mongo_clients import get_mongo_client
+            client = client if client is not None \
+                else get_mongo_client(self.config.memory_connection_string, self.config)
+            collection = client[self.config.memory_database_name]["conversation_summaries"]
+        self.collection = collection
+        self.collection.create_index([("SessionId", 1), ("ConversationId", 1)], unique=True)
+
+    def get(self, conversation_id: str) -> Optional[SummaryState]:
+        document = self.collection.find_one(
+            {"SessionId": self.session_id, "ConversationId": conversation_id},
+            {"_id": 0, "State": 1}
+        )
+        return SummaryState(**document["State"]) if document else None
+
+    def save(self, state: SummaryState):
+        self.collection.update_one(
+            {"SessionId": self.session_id, "ConversationId": state.conversation_id},
+            {"$set": {"State": state.model_dump()}},
+            upsert=True
+        )
+
+    def delete(self, conversation_id: str = None):
+        query = {"SessionId": self.session_id}
+        if conversation_id is not None:
+            query["ConversationId"] = conversation_id
+        self.collection.delete_many(query)
+
+
+class RedisSummaryStore(BaseObject):
+    def __init__(self, config: Config = None, session_id: str = None, client=None, expire_seconds: int = None,
+                 **kwargs):
+        super(RedisSummaryStore, self).__init__()
+        self.config = config if config is not None else Config()
+        self.session_id = session_id if session_id is not None else self.config.session_id
+        self.expire_seconds = expire_seconds
+        if client is None:
+            import redis
+            client = redis.from_url(self.config.redis_connection_string, decode_responses=True)
+        self.client = client
+
+    def key(self, conversation_id: str) -> str:
+        return f"summary:{self.session_id}:{conversation_id}"
+
+    def get(self, conversation_id: str) -> Optional[SummaryState]:
+        state = self.client.get(self.key(conversation_id))
+        return SummaryState.model_validate_json(state) if state else None
+
+    def save(self, state: SummaryState):
+        self.client.set(self.key(state.conversation_id), state.model_dump_json(), ex=self.expire_seconds)
+
+    def delete(self, conversation_id: str = None):
+        if conversation_id is not None:
+            self.client.delete(self.key(conversation_id))
+            return
+        keys = list(self.client.scan_iter(match=self.key("*"), count=500))
+        if keys:
+            self.client.delete(*keys)
+
+
+class SQLSummaryStore(BaseObject):
+    def __init__(self, config: Config = None, session_id: str = None, engine: Engine = None,
+                 connection_string: str = None, **kwargs):
+        super(SQLSummaryStore, self).__init__()
+        self.config = config if config is not None else Config()
+        self.session_id = session_id if session_id is not None else self.config.session_id
+        self.engine = engine if engine is not None else get_engine(
+            connection_string or self.config.postgres_connection_string, self.config
+        )
+        # Also created by `python -m migrations.sql_schema`, checked here so the store works without it
+        ConversationSummary.__table__.create(self.engine, checkfirst=True)
+        self.SessionLocal = sessionmaker(bind=self.engine, expire_on_commit=False)
+
+    def get(self, conversation_id: str) -> Optional[SummaryState]:
+        with self.SessionLocal() as session:
+            record = session.get(ConversationSummary, (self.session_id, conversation_id))
+            if record is None:
+                return None
+            return SummaryState(
+                conversation_id=conversation_id,
+                summary=record.Summary,
+                turns=record.Turns,
+                folded_turns=record.FoldedTurns,
+            )
+
+    def save(self, state: SummaryState):
+        with self.SessionLocal() as session:
+            session.merge(ConversationSummary(
+                SessionId=self.session_id,
+                ConversationId=state.conversation_id,
+                Summary=state.summary,
+                Turns=state.turns,
+                FoldedTurns=state.folded_turns,
+            ))
+            session.commit()
+
+    def delete(self, conversation_id: str = None):
+        with self.SessionLocal() as session:
+            query = session.query(ConversationSummary).filter_by(SessionId=self.session_id)
+            if conversation_id is not None:
+                query = query.filter_by(ConversationId=conversation_id)
+            query.delete()
+            session.commit()
+
+
+class SummaryStoreTypes(str, Enum):
+    """Enumerator with the places running summaries are stored."""
+    IN_MEMORY = "in-memory"
+    MONGO = "mongodb"
+    REDIS = "redis"
+    SQL = "sql"
+
+
+SUMMARY_STORE_TO_CLASS = {
+    "in-memory": InMemorySummaryStore,
+    "mongodb": MongoSummaryStore,
+    "redis": RedisSummaryStore,
+    "sql": SQLSummaryStore,
+}
+
+
+class ConversationSummarizer(BaseObject):
+    """
+    Keeps the history of long conversations at a roughly constant size.
+    Recent turns are kept verbatim, once more than `threshold` of them pile up the older ones are
+    folded into a running summary by a background task, off the request path.
+    """
+
+    def __init__(
+            self,
+            model: BaseChatModel,
+            store=None,
+            threshold: int = 12,
+            keep_turns: int = 4,
+            prompt: str = SUMMARY_PROMPT,
+            max_workers: int = 2,
+    ):
+        super(ConversationSummarizer, self).__init__()
+        if keep_turns >= threshold:
+            raise ValueError(f"keep_turns ({keep_turns}) must be smaller than threshold ({threshold})")
+        self.store = store if store is not None else InMemorySummaryStore()
+        self.threshold = threshold
+        self.keep_turns = keep_turns
+        self.chain = (PromptTemplate.from_template(prompt) | model | StrOutputParser()).with_config(
+            callbacks=[MetricsCallbackHandler("summarizer")]
+        )
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="summarizer")
+        self._in_flight: Set[str] = set()
+        self._futures: Set[Future] = set()
+        # conversation_id -> [lock, users], the store is read and written under the lock of its conversation
+        self._conversation_locks: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: Config, model: BaseChatModel, **store_kwargs) -> "ConversationSummarizer":
+        store_type = config.summary_store
+        if store_type not in SUMMARY_STORE_TO_CLASS:
+            raise ValueError(f"Got unknown summary store type: {store_type}. "
+                             f"Valid types are: {SUMMARY_STORE_TO_CLASS.keys()}.")
+        store = SUMMARY_STORE_TO_CLASS[store_type](config=config, session_id=config.session_id, **store_kwargs)
+        return cls(model=model, store=store, threshold=config.summary_threshold,
+                   keep_turns=config.summary_keep_turns)
+
+    @staticmethod
+    def format_summary(summary: str) -> str:
+        return f"{SUMMARY_HEADER}\n{summary}" if summary else ""
+
+    @classmethod
+    def format_history(cls, state: SummaryState) -> str:
+        history = "\n".join(state.turns)
+        if state.summary:
+            history = f"{cls.format_summary(state.summary)}\n\n{history}"
+        return history
+
+    def load_state(self, conversation_id: str) -> Optional[SummaryState]:
+        """Summary and recent turns, None when this conversation is not tracked yet"""
+        with track("summarizer", "load_history"):
+            return self.store.get(conversation_id)
+
+    def load_history(self, conversation_id: str) -> Optional[str]:
+        """Summary plus recent turns, None when this conversation is not tracked yet"""
+        state = self.load_state(conversation_id)
+        return self.format_history(state) if state is not None else None
+
+    @contextmanager
+    def _locked(self, conversation_id: str):
+        """Serialize updates of one conversation, the others go on in parallel"""
+        with self._lock:
+            entry = self._conversation_locks.setdefault(conversation_id, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._conversation_locks[conversation_id]
+
+    def add_turn(self, conversation_id: str, turn: str, history: Callable[[], str] = None):
+        """
+        Record a finished turn and schedule a fold when the conversation passed the threshold.
+        `history` returns the history stored before this turn, it seeds conversations started before
+        summarization was enabled so their earlier context is folded in as well.
+        """
+        with self._locked(conversation_id):
+            state = self.store.get(conversation_id)
+            if state is None:
+                state = SummaryState(conversation_id=conversation_id)
+                earlier = history() if history is not None else ""
+                if earlier:
+                    state.turns.append(earlier)
+            state.turns.append(turn)
+            self.store.save(state)
+        with self._lock:
+            if len(state.turns) > self.threshold and conversation_id not in self._in_flight:
+                self._in_flight.add(conversation_id)
+                count("summarizer", "fold_scheduled")
+                future = self._executor.submit(self._fold, conversation_id)
+                self._futures.add(future)
+                future.add_done_callback(self._futures.discard)
+
+    def summarize(self, summary: str, turns: List[str]) -> str:
+        return self.chain.invoke({"summary": summary or "(empty)", "new_lines": "\n".join(turns)}).strip()
+
+    def _fold(self, conversation_id: str):
+        try:
+            with self._locked(conversation_id):
+                state = self.store.get(conversation_id)
+            if state is None or len(state.turns) <= self.keep_turns:
+                return
+            folded = state.turns[:-self.keep_turns]
+            with track("summarizer", "fold"):
+                summary = self.summarize(state.summary, folded)
+            with self._locked(conversation_id):
+                current = self.store.get(conversation_id)
+                # The conversation was cleared or folded elsewhere while the summary was generated
+                if current is None or current.folded_turns != state.folded_turns \
+                        or current.turns[:len(folded)] != folded:
+                    count("summarizer", "fold_conflict")
+                    return
+                current.summary = summary
+                current.turns = current.turns[len(folded):]
+                current.folded_turns += len(folded)
+                self.store.save(current)
+            self.logger.info(f"Folded {len(folded)} turns of conversation <{conversation_id}> into its summary")
+        except Exception as e:
+            count("summarizer", "fold_error")
+            self.logger.error(f"Failed to summarize conversation <{conversation_id}>: {e}")
+        finally:
+            with self._lock:
+                self._in_flight.discard(conversation_id)
+
+    def clear(self, conversation_id: str = None):
+        if conversation_id is None:
+            self.store.delete()
+            return
+        with self._locked(conversation_id):
+            self.store.delete(conversation_id)
+
+    def flush(self):
+        """Wait for the scheduled folds"""
+        for future in list(self._futures):
+            future.result()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,332 @@
+import json
+import os
+import threading
+from contextlib import ExitStack, contextmanager
+from typing import Dict, List, Sequence
+
+from redis.exceptions import RedisError
+from sqlalchemy.exc import SQLAlchemyError
+
+from common.config import Config, BaseObject
+from common.metrics import count, timed
+from common.objects import MessageTurn, messages_from_dict
+from common.outbox import DurableOutbox
+from memory import sql_pages
+from memory.postgres_memory import BaseCustomPostgresChatbotMemory
+from memory.recall import get_recall_index
+from memory.redis_memory import BaseCustomRedisChatbotMemory
+
+# Conversations share these many locks, a fill only waits on the writes of conversations hashing alike
+FILL_LOCK_STRIPES = 64
+
+
+class BaseTieredChatbotMemory(BaseObject):
+    """
+    Redis in front of Postgres. The last `hot_turns` turns of an active conversation are read from a Redis
+    list, every turn is written to Postgres by a background thread through a local outbox, so it survives
+    restarts and Postgres being briefly down without making the caller wait.
+
+    A conversation missing from Redis is filled from Postgres, plus the turns still in the outbox, on its
+    first read. Conversations idle for `idle_seconds` expire from Redis and are only kept in Postgres.
+    """
+
+    def __init__(
+            self,
+            config: Config,
+            hot: BaseCustomRedisChatbotMemory,
+            cold: BaseCustomPostgresChatbotMemory,
+            k: int = 5,
+            hot_turns: int = 50,
+            idle_seconds: int = 3600,
+            outbox_directory: str = None,
+            **kwargs,
+    ):
+        super(BaseTieredChatbotMemory, self).__init__()
+        self.config = config
+        self.hot = hot
+        self.cold = cold
+        self.session_id = cold.session_id
+        self.k = k
+        self.hot_turns = max(hot_turns, k)
+        self.idle_seconds = idle_seconds
+        self.outbox = DurableOutbox(
+            directory=outbox_directory or os.path.join("data", "outbox"),
+            name=f"tiered-{self.session_id}",
+            handler=self._write_cold,
+            batch_size=config.outbox_batch_size,
+            fsync_interval=config.outbox_fsync_interval,
+        )
+        self._init_locks()
+        if hasattr(os, "register_at_fork"):
+            # A lock held by another thread at the fork would never be released in the child
+            os.register_at_fork(after_in_child=self._init_locks)
+
+    def _init_locks(self):
+        self._fill_locks = [threading.Lock() for _ in range(FILL_LOCK_STRIPES)]
+
+    @contextmanager
+    def _serialized(self, conversation_ids: Sequence[str]):
+        """
+        Held by a fill and by the writes of the conversations it fills. A turn appended while a fill is between
+        its outbox read and its Redis write would be missed by both: the fill reads neither the outbox nor
+        Postgres after it, and rpushx does nothing on a list the fill has not written yet.
+        """
+        # Always taken in the same order, so two holders of several stripes cannot deadlock
+        stripes = sorted({hash(conversation_id) % FILL_LOCK_STRIPES for conversation_id in conversation_ids})
+        with ExitStack() as stack:
+            for stripe in stripes:
+                stack.enter_context(self._fill_locks[stripe])
+            yield
+
+    def _filled_key(self, conversation_id: str) -> str:
+        """Set once a conversation is in Redis, so a conversation without any turn is not filled on every read"""
+        return f"{self.hot.conversation_key(conversation_id)}:filled"
+
+    def _write_cold(self, records: List[dict]):
+        """Outbox handler, raising keeps the records for a retry"""
+        self.cold.insert_messages([MessageTurn(**record) for record in records])
+
+    # ----------------------------------------
+    # Writes
+    # ----------------------------------------
+    def insert_messages(self, message_turns: Sequence[MessageTurn]) -> int:
+        """Add the turns, raising only when they could not be appended to the outbox"""
+        self.add_messages(message_turns)
+        return len(message_turns)
+
+    @timed("tiered_memory", "add_messages")
+    def add_messages(self, message_turns: Sequence[MessageTurn]):
+        with self._serialized([message_turn.conversation_id for message_turn in message_turns]):
+            for message_turn in message_turns:
+                self.outbox.append(message_turn.model_dump())
+            try:
+                pipe = self.hot.client.pipeline(transaction=False)
+                for message_turn in message_turns:
+                    key = self.hot.conversation_key(message_turn.conversation_id)
+                    # Only extend lists already filled, a conversation that is not is filled on its next read
+                    pipe.rpushx(key, json.dumps(message_turn.model_dump(), ensure_ascii=False))
+                    pipe.ltrim(key, -self.hot_turns, -1)
+                    pipe.expire(key, self.idle_seconds)
+                    pipe.delete(self._filled_key(message_turn.conversation_id))
+                pipe.execute()
+            except RedisError as e:
+                # The turns are in the outbox, Redis is filled again on the next read
+                self.logger.error(f"Redis insert error: {e}")
+
+    def add_message(self, message_turn: MessageTurn):
+        self.add_messages([message_turn])
+
+    # ----------------------------------------
+    # Reads
+    # ----------------------------------------
+    def _read_hot(self, conversation_ids: Sequence[str]) -> Dict[str, List[dict]]:
+        """Recent turns of the conversations found in Redis, refreshing their expiry"""
+        pipe = self.hot.client.pipeline(transaction=False)
+        for conversation_id in conversation_ids:
+            key = self.hot.conversation_key(conversation_id)
+            pipe.lrange(key, -self.k, -1)
+            pipe.exists(self._filled_key(conversation_id))
+            pipe.expire(key, self.idle_seconds)
+            pipe.expire(self._filled_key(conversation_id), self.idle_seconds)
+        replies = pipe.execute()
+        found = {}
+        for i, conversation_id in enumerate(conversation_ids):
+            items, filled = replies[4 * i], replies[4 * i + 1]
+            if items or filled:
+                found[conversation_id] = [json.loads(item) for item in items]
+        return found
+
+    def _fill(self, conversation_ids: Sequence[str]) -> Dict[str, List[dict]]:
+        """Copy the recent turns of conversations from Postgres and the outbox to Redis"""
+        with self._serialized(conversation_ids):
+            # No turn is appended until the fill is in Redis. The outbox is read before Postgres, so a turn
+            # drained in between is found twice, and kept once, rather than not at all
+            pending = {conversation_id: self.outbox.pending(conversation_id) for conversation_id in conversation_ids}
+            stored = sql_pages.load_recent_turns(self.cold.engine, self.session_id, conversation_ids,
+                                                 k=self.hot_turns)
+            filled = {}
+            pipe = self.hot.client.pipeline(transaction=True)
+            for conversation_id in conversation_ids:
+                items = stored.get(conversation_id, [])
+                items = (items + [record for record in pending[conversation_id] if record not in items])
+                items = items[-self.hot_turns:]
+                filled[conversation_id] = items[-self.k:] if self.k else []
+                key = self.hot.conversation_key(conversation_id)
+                pipe.delete(key)
+                if items:
+                    pipe.rpush(key, *[json.dumps(item, ensure_ascii=False) for item in items])
+                    pipe.expire(key, self.idle_seconds)
+                pipe.set(self._filled_key(conversation_id), 1, ex=self.idle_seconds)
+                pipe.sadd(self.hot.index_key(), conversation_id)
+            pipe.expire(self.hot.index_key(), self.idle_seconds)
+            pipe.execute()
+        count("tiered_memory", "fill", amount=len(conversation_ids))
+        return filled
+
+    def _recent(self, conversation_ids: Sequence[str]) -> Dict[str, List[dict]]:
+        unique_ids = list(dict.fromkeys(conversation_ids))
+        try:
+            turns = self._read_hot(unique_ids)
+            count("tiered_memory", "hot_hit", amount=len(turns))
+            missing = [conversation_id for conversation_id in unique_ids if conversation_id not in turns]
+            if missing:
+                turns.update(self._fill(missing))
+            return turns
+        except RedisError as e:
+            self.logger.error(f"Redis read error, reading from Postgres: {e}")
+        turns = sql_pages.load_recent_turns(self.cold.engine, self.session_id, unique_ids, k=self.k)
+        for conversation_id in unique_ids:
+            pending = [record for record in self.outbox.pending(conversation_id)
+                       if record not in turns[conversation_id]]
+            turns[conversation_id] = (turns[conversation_id] + pending)[-self.k:]
+        return turns
+
+    @timed("tiered_memory", "load_history")
+    def load_history(self, conversation_id: str) -> str:
+        """Retrieve last K messages"""
+        return self.load_histories([conversation_id])[conversation_id]
+
+    @timed("tiered_memory", "load_histories")
+    def load_histories(self, conversation_ids: Sequence[str]) -> Dict[str, str]:
+        """Retrieve the last K messages of many conversations, misses are filled with one Postgres query"""
+        try:
+            turns = self._recent(conversation_ids)
+        except SQLAlchemyError as e:
+            self.logger.error(f"SQLAlchemy select error: {e}")
+            return {conversation_id: "" for conversation_id in conversation_ids}
+        return {
+            conversation_id: "\n".join(messages_from_dict(item) for item in turns.get(conversation_id, []))
+            for conversation_id in conversation_ids
+        }
+
+    def get_messages(self, conversation_id: str, cursor: str = None, limit: int = 50):
+        """Pages are read from Postgres, which holds every turn once the outbox is drained"""
+        return self.cold.get_messages(conversation_id, cursor=cursor, limit=limit)
+
+    def iter_messages(self, conversation_id: str, batch_size: int = 500):
+        return self.cold.iter_messages(conversation_id, batch_size=batch_size)
+
+    # ----------------------------------------
+    # Tiering
+    # ----------------------------------------
+    def _flush_outbox(self, action: str) -> bool:
+        """Wait up to outbox_flush_timeout for the turns in the outbox to reach Postgres"""
+        if self.outbox.flush(timeout=self.config.outbox_flush_timeout):
+            return True
+        count("tiered_memory", "flush_timeout")
+        self.logger.warning(f"Outbox {self.outbox.path} did not drain in {self.config.outbox_flush_timeout}s "
+                            f"before {action}, {self.outbox.backlog} bytes are still pending")
+        return False
+
+    def demote(self, conversation_id: str) -> bool:
+        """Drop a conversation from Redis once its turns are in Postgres, returning whether it was dropped"""
+        if not self._flush_outbox(f"demoting conversation <{conversation_id}>"):
+            # Redis may hold the only readable copy of turns Postgres does not have yet
+            return False
+        self.hot.clear_history(conversation_id=conversation_id)
+        self.hot.client.unlink(self._filled_key(conversation_id))
+        count("tiered_memory", "demote")
+        return True
+
+    @timed("tiered_memory", "clear_history")
+    def clear_history(self, conversation_id: str = None):
+        # Turns still in the outbox would be written after the delete
+        if not self._flush_outbox("clearing history"):
+            raise TimeoutError(f"Outbox {self.outbox.path} did not drain, history of session "
+                               f"<{self.session_id}> was not cleared")
+        self.cold.clear_history(conversation_id=conversation_id)
+        try:
+            if conversation_id:
+                self.hot.client.unlink(self._filled_key(conversation_id))
+                self.hot.clear_history(conversation_id=conversation_id)
+            else:
+                # The scan also finds the markers of conversations filled without turns
+                self.hot.clear_session(scan=True)
+        except RedisError as e:
+            self.logger.error(f"Redis delete error: {e}")
+
+    def close(self):
+        self.outbox.close()
+
+
+class CustomTieredChatbotMemory(BaseObject):
+    """User-facing wrapper that uses Config and hides the Redis and Postgres details"""
+
+    def __init__(self, config: Config = None, client=None, engine=None, embedder=None, **kwargs):
+        super(CustomTieredChatbotMemory, self).__init__()
+        self.config = config
+        # Similar turns of the whole session, from an in-process index (None unless semantic_recall is set)
+        self.recall = get_recall_index(config)
+        self.memory = BaseTieredChatbotMemory(
+            config=config,
+            hot=BaseCustomRedisChatbotMemory(
+                config=config,
+                connection_string=config.redis_connection_string,
+                session_id=config.session_id,
+                database_name=config.redis_database_name,
+                expire_seconds=config.tiered_idle_seconds,
+                client=client,
+            ),
+            cold=BaseCustomPostgresChatbotMemory(
+                config=config,
+                connection_string=config.postgres_connection_string,
+                session_id=config.session_id,
+                database_name=config.postgres_database_name,
+                engine=engine,
+                embedder=embedder,
+            ),
+            hot_turns=config.tiered_hot_turns,
+            idle_seconds=config.tiered_idle_seconds,
+            outbox_directory=config.outbox_directory,
+            **kwargs,
+        )
+
+    def add_message(self, message_turn: MessageTurn):
+        self.memory.add_message(message_turn)
+        if self.recall is not None:
+            self.recall.add_turns([message_turn])
+
+    def add_messages(self, message_turns: List[MessageTurn]):
+        self.memory.add_messages(message_turns)
+        if self.recall is not None:
+            self.recall.add_turns(message_turns)
+
+    def insert_messages(self, message_turns: List[MessageTurn]) -> int:
+        saved = self.memory.insert_messages(message_turns)
+        if self.recall is not None:
+            try:
+                self.recall.add_turns(message_turns)
+            except Exception as e:
+                # The turns are stored, raising would store them again
+                self.logger.error(f"Could not index {len(message_turns)} message turns for recall: {e}")
+        return saved
+
+    def clear(self, conversation_id: str = None):
+        self.memory.clear_history(conversation_id=conversation_id)
+        if self.recall is not None:
+            self.recall.remove(conversation_id)
+
+    def load_history(self, conversation_id: str, input: str = None):
+        history = self.memory.load_history(conversation_id)
+        if self.recall is not None:
+            history = self.recall.with_recall(history, input, top_k=self.config.recall_top_k)
+        return history
+
+    def load_histories(self, conversation_ids: List[str], inputs: List[str] = None) -> List[str]:
+        histories = self.memory.load_histories(conversation_ids)
+        histories = [histories[conversation_id] for conversation_id in conversation_ids]
+        if self.recall is not None and inputs is not None:
+            histories = self.recall.with_recall_many(histories, inputs, top_k=self.config.recall_top_k)
+        return histories
+
+    def get_messages(self, conversation_id: str, cursor: str = None, limit: int = 50):
+        return self.memory.get_messages(conversation_id, cursor=cursor, limit=limit)
+
+    def iter_messages(self, conversation_id: str, batch_size: int = 500):
+        return self.memory.iter_messages(conversation_id, batch_size=batch_size)
+
+    def demote(self, conversation_id: str) -> bool:
+        return self.memory.demote(conversation_id)
+
+    def close(self):
+        self.memory.close()
@@ -0,0 +1,113 @@
+"""Storage layouts of the chat_memory embeddings: full precision, half precision or binary quantized."""
+from enum import Enum
+from typing import Dict, List, Sequence
+
+from pgvector.sqlalchemy import BIT, HALFVEC, Vector
+from sqlalchemy import Column, MetaData, Table, text
+from sqlalchemy.sql.elements import TextClause
+
+from common.objects import ChatMemory
+
+EMBEDDING_DIMENSION = 384
+
+
+class EmbeddingStorage(str, Enum):
+    """Enumerator with the ways turn embeddings are stored and searched."""
+    VECTOR = "vector"
+    HALFVEC = "halfvec"
+    BINARY = "binary"
+
+
+# Column searched by each layout and the expression the query embedding is compared with
+STORAGE_TO_SEARCH = {
+    "vector": ('"Embedding"', "<=>", f"(:embedding)::vector({EMBEDDING_DIMENSION})"),
+    "halfvec": ('"EmbeddingHalf"', "<=>", f"(:embedding)::halfvec({EMBEDDING_DIMENSION})"),
+    "binary": ('"EmbeddingBits"', "<~>", f"binary_quantize((:embedding)::vector({EMBEDDING_DIMENSION}))"),
+}
+
+
+# Column of each layout, the compact ones need pgvector 0.7+ and are added by migrations.embedding_storage
+EMBEDDING_COLUMNS = {
+    "vector": ("Embedding", Vector(EMBEDDING_DIMENSION)),
+    "halfvec": ("EmbeddingHalf", HALFVEC(EMBEDDING_DIMENSION)),
+    "binary": ("EmbeddingBits", BIT(EMBEDDING_DIMENSION)),
+}
+
+
+def postgres_chat_memory(metadata: MetaData, storages: Sequence[str] = tuple(EMBEDDING_COLUMNS)) -> Table:
+    """
+    chat_memory of Postgres: the columns of the ChatMemory model, which every SQL backend has, plus the
+    embedding columns of `storages`. Inserts name their columns, so only those of the configured layout are
+    written and the others need not exist.
+    """
+    table = ChatMemory.__table__.to_metadata(metadata)
+    for storage in storages:
+        name, column_type = EMBEDDING_COLUMNS[storage]
+        table.append_column(Column(name, column_type, quote=True))
+    return table
+
+
+postgres_chat_memory_table = postgres_chat_memory(MetaData())
+
+
+def quantize_binary(embedding: Sequence[float]) -> str:
+    """Sign bits of an embedding as a bit string, the same as pgvector's binary_quantize"""
+    return "".join("1" if value > 0 else "0" for value in embedding)
+
+
+def keeps_full_precision(storage: str, rerank: bool) -> bool:
+    return storage == EmbeddingStorage.VECTOR or rerank
+
+
+def embedding_columns(embedding: List[float], storage: str = EmbeddingStorage.VECTOR,
+                      rerank: bool = False) -> Dict[str, object]:
+    """Column values of one turn's embedding for the configured layout"""
+    columns = {}
+    if keeps_full_precision(storage, rerank):
+        columns["Embedding"] = embedding
+    if storage == EmbeddingStorage.HALFVEC:
+        columns["EmbeddingHalf"] = embedding
+    elif storage == EmbeddingStorage.BINARY:
+        columns["EmbeddingBits"] = quantize_binary(embedding)
+    return columns
+
+
+def similarity_query(storage: str = EmbeddingStorage.VECTOR, rerank: bool = False,
+                     table_name: str = "chat_memory") -> TextClause:
+    """
+    Nearest turns of a session. With `rerank`, the compact index returns `:candidates` rows that are
+    reordered by their full-precision distance before keeping `:top_k`.
+    Parameters: session_id, embedding, top_k and, when reranking, candidates.
+    """
+    if storage not in STORAGE_TO_SEARCH:
+        raise ValueError(f"Got unknown embedding storage: {storage}. Valid types are: {STORAGE_TO_SEARCH.keys()}.")
+    column, operator, query_vector = STORAGE_TO_SEARCH[storage]
+    if not rerank or storage == EmbeddingStorage.VECTOR:
+        return text(f"""
+            SELECT "History"
+            FROM "{table_name}"
+            WHERE "SessionId" = :session_id AND {column} IS NOT NULL
+            ORDER BY {column} {operator} {query_vector}
+            LIMIT :top_k
+        """)
+    return text(f"""
+        SELECT candidates."History"
+        FROM (
+            SELECT "History", "Embedding"
+            FROM "{table_name}"
+            WHERE "SessionId" = :session_id AND {column} IS NOT NULL
+            ORDER BY {column} {operator} {query_vector}
+            LIMIT :candidates
+        ) AS candidates
+        ORDER BY candidates."Embedding" <=> (:embedding)::vector({EMBEDDING_DIMENSION})
+        LIMIT :top_k
+    """)
+
+
+def search_params(session_id: str, embedding: List[float], top_k: int, rerank_factor: int = 4) -> dict:
+    return {
+        "session_id": session_id,
+        "embedding": embedding,
+        "top_k": top_k,
+        "candidates": top_k * rerank_factor,
+    }
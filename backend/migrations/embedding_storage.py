@@ -0,0 +1,126 @@
+"""
+Move the chat_memory embeddings to a compact layout: half precision (`halfvec`, 2 bytes per dimension)
+or binary quantized (`bit`, 1 bit per dimension), searched through an HNSW index. Needs pgvector 0.7+.
+
+Existing rows are backfilled from the full-precision column in small batches, so it can run against a live table.
+Full-precision vectors are only worth keeping when `EMBEDDING_RERANK` is enabled, `--drop-full` clears them.
+Run from the backend directory, then set EMBEDDING_STORAGE to the same layout:
+    python -m migrations.embedding_storage --storage binary
+"""
+import argparse
+import logging
+import time
+from typing import List
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+
+from common.config import Config
+from memory.retention import chat_memory, is_partitioned
+from memory.vector_storage import EMBEDDING_DIMENSION, EmbeddingStorage
+
+logger = logging.getLogger(__name__)
+
+# Column, its type, the expression computing it from the full-precision vector and its HNSW operator class
+STORAGE_TO_COLUMN = {
+    "halfvec": ("EmbeddingHalf", f"halfvec({EMBEDDING_DIMENSION})",
+                f'"Embedding"::halfvec({EMBEDDING_DIMENSION})', "halfvec_cosine_ops"),
+    "binary": ("EmbeddingBits", f"bit({EMBEDDING_DIMENSION})",
+               f'binary_quantize("Embedding")::bit({EMBEDDING_DIMENSION})', "bit_hamming_ops"),
+}
+
+
+def add_column(engine: Engine, storage: str, table: str = chat_memory.name):
+    column, column_type, _, _ = STORAGE_TO_COLUMN[storage]
+    with engine.begin() as conn:
+        conn.execute(text(f'ALTER TABLE "{table}" ADD COLUMN IF NOT EXISTS "{column}" {column_type}'))
+
+
+def _update_in_batches(engine: Engine, assignment: str, criteria: str, table: str, batch_size: int,
+                       pause_seconds: float) -> int:
+    """Run `UPDATE ... SET assignment` on rows matching `criteria`, a short transaction per batch"""
+    updated = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(text(
+                f'UPDATE "{table}" SET {assignment} WHERE id IN '
+                f'(SELECT id FROM "{table}" WHERE {criteria} LIMIT :batch_size)'
+            ), {"batch_size": batch_size}).rowcount
+        updated += rows
+        if rows < batch_size:
+            return updated
+        if pause_seconds:
+            time.sleep(pause_seconds)
+
+
+def backfill(engine: Engine, storage: str, table: str = chat_memory.name, batch_size: int = 1000,
+             pause_seconds: float = 0.05) -> int:
+    """Fill the compact column of rows written before it existed, returning the number of rows"""
+    column, _, expression, _ = STORAGE_TO_COLUMN[storage]
+    return _update_in_batches(
+        engine, f'"{column}" = {expression}', f'"{column}" IS NULL AND "Embedding" IS NOT NULL',
+        table, batch_size, pause_seconds
+    )
+
+
+def create_index(engine: Engine, storage: str, table: str = chat_memory.name) -> float:
+    """Build the HNSW index of the compact column, returning the build time in seconds"""
+    column, _, _, operator_class = STORAGE_TO_COLUMN[storage]
+    # Partitioned tables can not be indexed concurrently, each partition gets its own index either way
+    concurrently = "" if is_partitioned(engine, table) else "CONCURRENTLY"
+    start = time.perf_counter()
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(
+            f'CREATE INDEX {concurrently} IF NOT EXISTS idx_{column.lower()} '
+            f'ON "{table}" USING hnsw ("{column}" {operator_class})'
+        ))
+    return time.perf_counter() - start
+
+
+def drop_full_precision(engine: Engine, storage: str, table: str = chat_memory.name, batch_size: int = 1000,
+                        pause_seconds: float = 0.05) -> int:
+    """Clear the full-precision vectors already copied to the compact column, space is reclaimed by VACUUM"""
+    column, _, _, _ = STORAGE_TO_COLUMN[storage]
+    return _update_in_batches(
+        engine, '"Embedding" = NULL', f'"Embedding" IS NOT NULL AND "{column}" IS NOT NULL',
+        table, batch_size, pause_seconds
+    )
+
+
+def migrate(engine: Engine, storage: str, batch_size: int = 1000, pause_seconds: float = 0.05,
+            drop_full: bool = False) -> dict:
+    if storage not in STORAGE_TO_COLUMN:
+        raise ValueError(f"Got unknown compact storage: {storage}. Valid types are: {STORAGE_TO_COLUMN.keys()}.")
+    add_column(engine, storage)
+    stats = {"backfilled": backfill(engine, storage, batch_size=batch_size, pause_seconds=pause_seconds)}
+    stats["index_seconds"] = create_index(engine, storage)
+    if drop_full:
+        stats["dropped_full"] = drop_full_precision(engine, storage, batch_size=batch_size,
+                                                    pause_seconds=pause_seconds)
+    return stats
+
+
+def main(argv: List[str] = None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Backfill and index compact chat_memory embeddings")
+    parser.add_argument("--connection-string", default=None, help="Defaults to POSTGRES_CONNECTION_STRING")
+    parser.add_argument("--storage", choices=[EmbeddingStorage.HALFVEC.value, EmbeddingStorage.BINARY.value],
+                        required=True)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--pause-seconds", type=float, default=0.05, help="Pause between backfill batches")
+    parser.add_argument("--drop-full", action="store_true",
+                        help="Clear full-precision vectors afterwards, only without EMBEDDING_RERANK")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    config = Config(postgres_connection_string=args.connection_string)
+    engine = create_engine(config.postgres_connection_string, future=True)
+    stats = migrate(engine, args.storage, batch_size=args.batch_size, pause_seconds=args.pause_seconds,
+                    drop_full=args.drop_full)
+    print(f"Backfilled {stats['backfilled']} rows, index built in {stats['index_seconds']:.1f}s"
+          + (f", cleared {stats['dropped_full']} full-precision vectors" if args.drop_full else ""))
+
+
+if __name__ == "__main__":
+    main()
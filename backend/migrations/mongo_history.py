@@ -0,0 +1,45 @@
+"""
+One-off migration of the custom MongoDB memory from JSON-string `History` rows to native `Turn` subdocuments
+numbered by `seq`.
+
+Run from the backend directory:
+    python -m migrations.mongo_history --batch-size 1000
+"""
+import argparse
+import logging
+from typing import List
+
+from dotenv import load_dotenv
+
+from common.config import Config
+from memory.custom_memory import BaseCustomMongoChatbotMemory
+
+
+def main(argv: List[str] = None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Convert JSON-string chat history rows to native subdocuments")
+    parser.add_argument("--connection-string", default=None, help="Defaults to MONGO_CONNECTION_STRING")
+    parser.add_argument("--database", default=None, help="Defaults to MONGO_DATABASE")
+    parser.add_argument("--collection", default=None, help="Defaults to MONGO_COLLECTION")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    config = Config(
+        memory_connection_string=args.connection_string,
+        memory_database_name=args.database,
+        memory_collection_name=args.collection,
+    )
+    memory = BaseCustomMongoChatbotMemory(
+        config=config,
+        connection_string=config.memory_connection_string,
+        session_id=config.session_id,
+        database_name=config.memory_database_name,
+        collection_name=config.memory_collection_name,
+    )
+    migrated = memory.migrate_json_history(batch_size=args.batch_size)
+    print(f"Migrated {migrated} rows of {config.memory_database_name}.{config.memory_collection_name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+One-off migration of the Redis memory from bare `{conversation_id}` keys to the namespaced
+`chat:{session_id}:conv:{conversation_id}` keys, registering each conversation in the session index set.
+
+Keys are found with an incremental SCAN, so the migration can run against a live server.
+Run from the backend directory:
+    python -m migrations.redis_keys --dry-run
+"""
+import argparse
+import json
+import logging
+from typing import Dict, List
+
+import redis
+from dotenv import load_dotenv
+
+from common.config import Config
+from memory.redis_memory import KEY_PREFIX, BaseCustomRedisChatbotMemory
+
+logger = logging.getLogger(__name__)
+
+
+def _is_legacy_history(key: str, first_item) -> bool:
+    """A legacy key is a list of message turns of the conversation the key is named after"""
+    if key.startswith(f"{KEY_PREFIX}:") or first_item is None:
+        return False
+    try:
+        turn = json.loads(first_item)
+    except (TypeError, ValueError):
+        return False
+    return isinstance(turn, dict) and "human_message" in turn and turn.get("conversation_id") == key
+
+
+def migrate_keys(memory: BaseCustomRedisChatbotMemory, batch_size: int = 500, dry_run: bool = False) -> Dict[str, int]:
+    client = memory.client
+    stats = {"scanned": 0, "migrated": 0, "conflicts": 0}
+    batch: List[str] = []
+
+    def flush():
+        pipe = client.pipeline(transaction=False)
+        for key in batch:
+            pipe.type(key)
+            pipe.lindex(key, 0)
+        replies = pipe.execute()
+        legacy = [
+            key for key, key_type, first in zip(batch, replies[0::2], replies[1::2])
+            if key_type == "list" and _is_legacy_history(key, first)
+        ]
+        if not legacy or dry_run:
+            stats["migrated"] += len(legacy)
+            return
+        pipe = client.pipeline(transaction=False)
+        for key in legacy:
+            # RENAMENX keeps the TTL and never overwrites history already written under the new key
+            pipe.renamenx(key, memory.conversation_key(key))
+        renamed = pipe.execute()
+        moved = [key for key, ok in zip(legacy, renamed) if ok]
+        for key, ok in zip(legacy, renamed):
+            if not ok:
+                logger.warning(f"Skipped <{key}>, <{memory.conversation_key(key)}> already exists")
+        stats["conflicts"] += len(legacy) - len(moved)
+        stats["migrated"] += len(moved)
+        if moved:
+            client.sadd(memory.index_key(), *moved)
+            client.expire(memory.index_key(), memory.expire_seconds)
+
+    for key in client.scan_iter(count=batch_size):
+        stats["scanned"] += 1
+        batch.append(key)
+        if len(batch) >= batch_size:
+            flush()
+            batch = []
+    if batch:
+        flush()
+    return stats
+
+
+def main(argv: List[str] = None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Rename bare conversation keys to namespaced Redis keys")
+    parser.add_argument("--connection-string", default=None, help="Defaults to the configured Redis connection")
+    parser.add_argument("--session-id", default=None, help="Session the legacy conversations belong to")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true", help="Only count the keys that would be renamed")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    config = Config(redis_connection_string=args.connection_string, session_id=args.session_id)
+    memory = BaseCustomRedisChatbotMemory(
+        config=config,
+        session_id=config.session_id,
+        client=redis.from_url(config.redis_connection_string, decode_responses=True),
+        batch_size=args.batch_size,
+    )
+    stats = migrate_keys(memory, batch_size=args.batch_size, dry_run=args.dry_run)
+    print(f"{'Would migrate' if args.dry_run else 'Migrated'} {stats['migrated']} of {stats['scanned']} keys, "
+          f"{stats['conflicts']} conflicts")
+
+
+if __name__ == "__main__":
+    main()
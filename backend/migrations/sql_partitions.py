@@ -0,0 +1,98 @@
+"""
+Turn the PostgreSQL chat_memory table into a table range-partitioned by month on CreatedAt, so expired history
+is removed by dropping whole partitions instead of deleting rows.
+
+An existing table is kept as one partition holding everything up to the end of the current month,
+new months get their own partitions. Run once from the backend directory, e.g. before a deploy:
+    python -m migrations.sql_partitions --months-ahead 2
+"""
+import argparse
+import logging
+from datetime import datetime
+from typing import List
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.engine import Engine
+
+from common.config import Config
+from memory.retention import next_month, chat_memory, ensure_partitions, is_partitioned
+
+logger = logging.getLogger(__name__)
+
+CREATE_PARTITIONED_TABLE = """
+CREATE TABLE "{table}" (
+    id SERIAL NOT NULL,
+    "ConversationId" VARCHAR(255) NOT NULL,
+    "SessionId" VARCHAR(255) NOT NULL,
+    "History" JSON NOT NULL,
+    "Embedding" vector(384),
+    "CreatedAt" TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    PRIMARY KEY (id, "CreatedAt")
+) PARTITION BY RANGE ("CreatedAt")
+"""
+
+INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_sessionid ON "{table}" ("SessionId")',
+    'CREATE INDEX IF NOT EXISTS idx_conversation_created ON "{table}" ("SessionId", "ConversationId", "CreatedAt")',
+    'CREATE INDEX IF NOT EXISTS idx_created ON "{table}" ("CreatedAt")',
+]
+
+
+def partition_table(engine: Engine, months_ahead: int = 2, table: str = chat_memory.name) -> List[str]:
+    """Create or convert the partitioned table, returning the partitions created for upcoming months"""
+    if engine.dialect.name != "postgresql":
+        raise ValueError(f"Partitioning is only supported on PostgreSQL, got {engine.dialect.name}")
+    if is_partitioned(engine, table):
+        logger.info(f"<{table}> is already partitioned")
+        return ensure_partitions(engine, months_ahead=months_ahead, table_name=table)
+
+    # Everything written so far fits in one partition ending with the current month
+    boundary = next_month(datetime.utcnow())
+    legacy = f"{table}_legacy"
+    exists = inspect(engine).has_table(table)
+    with engine.begin() as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+        if exists:
+            conn.execute(text(f'ALTER TABLE "{table}" RENAME TO "{legacy}"'))
+            for index in ("idx_sessionid", "idx_conversation_created", "idx_created"):
+                conn.execute(text(f'ALTER INDEX IF EXISTS {index} RENAME TO {index}_legacy'))
+        conn.execute(text(CREATE_PARTITIONED_TABLE.format(table=table)))
+        for statement in INDEXES:
+            conn.execute(text(statement.format(table=table)))
+        if exists:
+            conn.execute(text(f'UPDATE "{legacy}" SET "CreatedAt" = now() AT TIME ZONE \'utc\' WHERE "CreatedAt" IS NULL'))
+            conn.execute(text(f'ALTER TABLE "{legacy}" ALTER COLUMN "CreatedAt" SET NOT NULL'))
+            # Lets ATTACH skip scanning the whole table to validate the bound
+            conn.execute(text(
+                f'ALTER TABLE "{legacy}" ADD CONSTRAINT {legacy}_bound CHECK ("CreatedAt" < \'{boundary:%Y-%m-%d}\')'
+            ))
+            conn.execute(text(
+                f'ALTER TABLE "{table}" ATTACH PARTITION "{legacy}" '
+                f"FOR VALUES FROM (MINVALUE) TO ('{boundary:%Y-%m-%d}')"
+            ))
+            conn.execute(text(f'ALTER TABLE "{legacy}" DROP CONSTRAINT {legacy}_bound'))
+            conn.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f'COALESCE((SELECT max(id) FROM "{legacy}"), 0) + 1, false)'
+            ))
+            logger.info(f"Attached the existing rows of <{table}> as partition <{legacy}>")
+    return ensure_partitions(engine, months_ahead=months_ahead, table_name=table)
+
+
+def main(argv: List[str] = None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Partition the PostgreSQL chat_memory table by month")
+    parser.add_argument("--connection-string", default=None, help="Defaults to POSTGRES_CONNECTION_STRING")
+    parser.add_argument("--months-ahead", type=int, default=2, help="Future monthly partitions to create")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    config = Config(postgres_connection_string=args.connection_string)
+    engine = create_engine(config.postgres_connection_string, future=True)
+    partitions = partition_table(engine, months_ahead=args.months_ahead)
+    print(f"Partitions ready: {', '.join(partitions)}")
+
+
+if __name__ == "__main__":
+    main()
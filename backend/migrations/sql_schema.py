@@ -0,0 +1,74 @@
+"""
+Create the tables of the SQL memories and the summary store, plus the pgvector extension on PostgreSQL.
+
+Memories no longer create their schema when they are built, run this once from the backend directory
+before the first deploy and after adding a SQL backend, e.g.:
+    python -m migrations.sql_schema --backend postgres
+
+Tables are built from the ORM models, so they match what the memories read and write. On PostgreSQL,
+chat_memory also gets the full-precision embedding, which any pgvector release supports. The compact
+halfvec and bit columns need pgvector 0.7+ and are added by migrations.embedding_storage.
+"""
+import argparse
+import logging
+from typing import List
+
+from dotenv import load_dotenv
+from sqlalchemy import MetaData, Table, create_engine, inspect, text
+from sqlalchemy.engine import Engine
+
+from common.config import Config
+from common.objects import ChatMemory, ConversationSummary
+from memory import vector_storage
+from memory.vector_storage import EmbeddingStorage
+
+logger = logging.getLogger(__name__)
+
+
+def mysql_chat_memory(metadata: MetaData) -> Table:
+    """chat_memory as mapped by the ChatMemory model, MySQL has no vector type"""
+    return ChatMemory.__table__.to_metadata(metadata)
+
+
+def postgres_chat_memory(metadata: MetaData) -> Table:
+    """chat_memory with the full-precision embedding, the compact columns need pgvector 0.7+"""
+    return vector_storage.postgres_chat_memory(metadata, storages=[EmbeddingStorage.VECTOR])
+
+
+def bootstrap(engine: Engine) -> List[str]:
+    """Create what is missing, returning the tables created"""
+    existing = set(inspect(engine).get_table_names())
+    metadata = MetaData()
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+        postgres_chat_memory(metadata)
+    elif engine.dialect.name == "mysql":
+        mysql_chat_memory(metadata)
+    else:
+        raise ValueError(f"Got unsupported dialect: {engine.dialect.name}. Valid dialects are: postgresql, mysql.")
+    ConversationSummary.__table__.to_metadata(metadata)
+    metadata.create_all(engine, checkfirst=True)
+    return sorted(set(inspect(engine).get_table_names()) - existing)
+
+
+def main(argv: List[str] = None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Create the tables of the SQL memories")
+    parser.add_argument("--backend", choices=("postgres", "mysql"), default="postgres")
+    parser.add_argument("--connection-string", default=None,
+                        help="Defaults to POSTGRES_CONNECTION_STRING or SQL_CONNECTION_STRING")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    config = Config()
+    connection_string = args.connection_string or (
+        config.postgres_connection_string if args.backend == "postgres" else config.sql_connection_string
+    )
+    engine = create_engine(connection_string, future=True)
+    created = bootstrap(engine)
+    print(f"Tables created: {', '.join(created) or 'none, the schema is up to date'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -18,4 +18,37 @@ Current conversation:
 {history}
 Human: {input}
 AI: [/INST]
-"""
\ No newline at end of file
+"""
+
+DIRECT_CHAT_PROMPT = """You are a helpful assistant with given personalities.
+Below are descriptions of your personality traits, talk to users according to those traits:
+{bot_personality}
+{user_personality}
+
+Current conversation:
+{history}
+Human: {input}
+AI:"""
+
+
+TOOL_CALLING_SYSTEM_PROMPT = """You are a helpful assistant with given personalities.
+Below are descriptions of your personality traits, talk to users according to those traits:
+{bot_personality}
+{user_personality}
+
+When a question needs several independent lookups, request all of them at once.
+
+Current conversation:
+{history}"""
+
+
+SUMMARY_PROMPT = """Progressively summarize the lines of conversation provided, adding onto the previous summary and returning a new summary.
+Keep names, facts, preferences and open questions the AI may need later in the conversation.
+
+Current summary:
+{summary}
+
+New lines of conversation:
+{new_lines}
+
+New summary:"""
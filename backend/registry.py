@@ -0,0 +1,219 @@
+"""Registry hosting many bot configurations in one process, sharing heavy resources between them."""
+import json
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+from bot import Bot, BotModes, DEFAULT_MODEL_KWARGS
+from chain import ChainManager
+from common.config import BaseObject, Config
+from memory import MemoryTypes
+from models import ModelTypes
+from prompts import BOT_PERSONALITY
+from tools import CustomSearchTool
+
+DEFAULT_BOT_ID = "default"
+
+
+class BotSpec(BaseModel):
+    """Declarative configuration of one hosted bot"""
+    bot_id: str = Field(description="Id requests are routed by, usually the tenant id")
+    model: Optional[ModelTypes] = Field(default=None, description="Model type")
+    model_kwargs: Dict[str, Any] = Field(default_factory=dict, description="Model constructor arguments")
+    prompt_template: Optional[str] = Field(default=None, description="Hub prompt name or inline template")
+    memory: Optional[MemoryTypes] = Field(default=None, description="Memory backend")
+    memory_kwargs: Dict[str, Any] = Field(default_factory=dict, description="Memory constructor arguments")
+    tools: Optional[List[str]] = Field(default=None, description="Tool names, None for the default tools")
+    mode: Optional[BotModes] = Field(default=None, description="How the bot answers")
+    bot_personality: str = Field(default=BOT_PERSONALITY, description="Personality of the bot")
+    config: Dict[str, Any] = Field(default_factory=dict, description="Config constructor arguments")
+
+
+class SharedResources(BaseObject):
+    """
+    Heavy resources shared by reference between bots: database clients keyed by connection string,
+    chat models keyed by their configuration and tool instances keyed by name.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._resources: Dict[tuple, Any] = {}
+        self._lock = threading.Lock()
+        self.tool_factories: Dict[str, Callable[[], Any]] = {
+            CustomSearchTool.name: CustomSearchTool,
+        }
+
+    def get(self, key: tuple, factory: Callable[[], Any]):
+        resource = self._resources.get(key)
+        if resource is None:
+            with self._lock:
+                resource = self._resources.get(key)
+                if resource is None:
+                    resource = self._resources[key] = factory()
+        return resource
+
+    def sql_engine(self, connection_string: str, config: Config = None):
+        from memory.engines import get_engine
+        return self.get(("sql_engine", connection_string), lambda: get_engine(connection_string, config))
+
+    def mongo_client(self, connection_string: str, config: Config = None):
+        from memory.mongo_clients import get_mongo_client
+        return self.get(("mongo_client", connection_string), lambda: get_mongo_client(connection_string, config))
+
+    def redis_client(self, connection_string: str):
+        import redis
+        return self.get(("redis_client", connection_string),
+                        lambda: redis.from_url(connection_string, decode_responses=True))
+
+    def chat_model(self, config: Config, model: Optional[ModelTypes], model_kwargs: Dict[str, Any]):
+        key = ("chat_model", model, config.base_model_name, json.dumps(model_kwargs, sort_keys=True, default=str))
+        return self.get(key, lambda: ChainManager.build_model(config=config, model_type=model, parameters=model_kwargs))
+
+    def tool(self, name: str):
+        if name not in self.tool_factories:
+            raise ValueError(f"Got unknown tool: {name}. Valid tools are: {self.tool_factories.keys()}.")
+        return self.get(("tool", name), self.tool_factories[name])
+
+    def memory_kwargs(self, config: Config, memory: Optional[MemoryTypes]) -> Dict[str, Any]:
+        """Injects the shared client of the memory backend"""
+        if memory == MemoryTypes.SQL_MEMORY:
+            return {"engine": self.sql_engine(config.sql_connection_string, config)}
+        if memory == MemoryTypes.POSTGRES_MEMORY:
+            return {"engine": self.sql_engine(config.postgres_connection_string, config)}
+        if memory == MemoryTypes.CUSTOM_MEMORY:
+            return {"client": self.mongo_client(config.memory_connection_string, config)}
+        if memory == MemoryTypes.REDIS_MEMORY:
+            return {"client": self.redis_client(config.redis_connection_string)}
+        if memory == MemoryTypes.TIERED_MEMORY:
+            return {
+                "client": self.redis_client(config.redis_connection_string),
+                "engine": self.sql_engine(config.postgres_connection_string, config),
+            }
+        return {}
+
+    def after_fork(self):
+        """
+        Drop connections inherited from the parent process so each worker opens its own.
+        Chat models are kept as is, the parent never sends requests so their HTTP pools are still empty.
+        """
+        self._lock = threading.Lock()
+        for (kind, *_), resource in list(self._resources.items()):
+            if kind == "sql_engine":
+                # Leave the parent's connections open, they belong to the parent
+                resource.dispose(close=False)
+            elif kind == "redis_client":
+                resource.connection_pool.reset()
+            # MongoClient resets its own pools in the child since pymongo 4.3
+
+    def close(self):
+        with self._lock:
+            resources = list(self._resources.items())
+            self._resources.clear()
+        for (kind, *_), resource in resources:
+            try:
+                if kind == "sql_engine":
+                    resource.dispose()
+                elif kind in ("mongo_client", "redis_client"):
+                    resource.close()
+            except Exception as e:
+                self.logger.warning(f"Failed to close {kind}: {e}")
+
+
+class BotRegistry(BaseObject):
+    """Builds bots from their specs on first use and routes requests to them by bot id"""
+
+    def __init__(self, resources: SharedResources = None, default_bot_id: str = DEFAULT_BOT_ID):
+        super().__init__()
+        self.resources = resources if resources is not None else SharedResources()
+        self.default_bot_id = default_bot_id
+        self._specs: Dict[str, BotSpec] = {}
+        self._bots: Dict[str, Bot] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> "BotRegistry":
+        """Load bot specs from a JSON file holding a list of BotSpec objects"""
+        registry = cls(**kwargs)
+        with open(path, "r") as f:
+            for item in json.load(f):
+                registry.register(BotSpec(**item))
+        return registry
+
+    @property
+    def bot_ids(self) -> List[str]:
+        return list(self._specs)
+
+    def register(self, spec: BotSpec):
+        with self._lock:
+            self._specs[spec.bot_id] = spec
+            # A changed spec takes effect on the next request
+            bot = self._bots.pop(spec.bot_id, None)
+        if bot is not None:
+            bot.close()
+
+    def unregister(self, bot_id: str):
+        with self._lock:
+            self._specs.pop(bot_id, None)
+            bot = self._bots.pop(bot_id, None)
+        if bot is not None:
+            bot.close()
+
+    def host(self, bot_id: str, bot: Bot):
+        """Route `bot_id` to a bot built elsewhere, e.g. on a fake model, it is closed with the registry"""
+        with self._lock:
+            previous = self._bots.get(bot_id)
+            self._bots[bot_id] = bot
+        if previous is not None and previous is not bot:
+            previous.close()
+
+    def build(self, spec: BotSpec) -> Bot:
+        config = Config(**spec.config)
+        tool_names = spec.tools if spec.tools is not None else [CustomSearchTool.name]
+        tools = [self.resources.tool(name) for name in tool_names]
+        model_kwargs = spec.model_kwargs or dict(DEFAULT_MODEL_KWARGS)
+        return Bot(
+            config=config,
+            prompt_template=spec.prompt_template,
+            memory=spec.memory,
+            model=spec.model,
+            memory_kwargs={**self.resources.memory_kwargs(config, spec.memory), **spec.memory_kwargs},
+            model_kwargs=model_kwargs,
+            bot_personality=spec.bot_personality,
+            tools=tools,
+            mode=spec.mode,
+            base_model=self.resources.chat_model(config, spec.model, model_kwargs),
+            outbox_name=spec.bot_id,
+        )
+
+    def get(self, bot_id: Optional[str] = None) -> Bot:
+        bot_id = bot_id or self.default_bot_id
+        bot = self._bots.get(bot_id)
+        if bot is not None:
+            return bot
+        with self._lock:
+            bot = self._bots.get(bot_id)
+            if bot is None:
+                spec = self._specs.get(bot_id)
+                if spec is None:
+                    raise KeyError(f"Got unknown bot id: {bot_id}. Valid ids are: {list(self._specs)}.")
+                bot = self._bots[bot_id] = self.build(spec)
+                self.logger.info(f"Built bot <{bot_id}>")
+            return bot
+
+    def preload(self):
+        """Build every registered bot and load its read-only models, e.g. before forking workers"""
+        for bot_id in self.bot_ids:
+            self.get(bot_id).preload()
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+        self.resources.after_fork()
+
+    def close(self):
+        with self._lock:
+            bots = list(self._bots.values())
+            self._bots.clear()
+        for bot in bots:
+            bot.close()
+        self.resources.close()
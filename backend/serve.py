@@ -0,0 +1,290 @@
+"""
+Pre-fork production server.
+
+The master imports the application, loads the read-only models (embedder, spaCy pipelines, prompts) once,
+then forks the workers so they share those pages copy-on-write. Each worker reopens its own database
+connections and serves the listening socket of the master with uvicorn.
+
+    python serve.py app:app --workers 4
+
+Signals to the master:
+    SIGHUP           rolling restart, workers are replaced one at a time
+    SIGUSR1          log the memory usage of every worker
+    SIGTERM, SIGINT  graceful shutdown
+"""
+import argparse
+import gc
+import importlib
+import logging
+import os
+import select
+import signal
+import socket
+import threading
+import time
+from typing import Dict, Optional
+
+import uvicorn
+from dotenv import load_dotenv
+
+from common.config import BaseObject
+from utils.process import memory_usage
+
+MiB = 1024 * 1024
+
+
+def load_target(target: str):
+    """Import `module:attribute`, returning the module and the ASGI app"""
+    module_name, _, attribute = target.partition(":")
+    module = importlib.import_module(module_name)
+    return module, getattr(module, attribute or "app")
+
+
+class Worker:
+    def __init__(self, pid: int, index: int, started_at: float):
+        self.pid = pid
+        self.index = index
+        self.started_at = started_at
+
+
+class PreforkServer(BaseObject):
+    """Master process forking and supervising uvicorn workers"""
+
+    def __init__(
+            self,
+            target: str,
+            host: str = "0.0.0.0",
+            port: int = 8081,
+            workers: int = 2,
+            ready_timeout: float = 60,
+            graceful_timeout: float = 30,
+            rss_interval: float = 60,
+            log_level: str = "info",
+    ):
+        super().__init__()
+        self.target = target
+        self.host = host
+        self.port = port
+        self.num_workers = workers
+        self.ready_timeout = ready_timeout
+        self.graceful_timeout = graceful_timeout
+        self.rss_interval = rss_interval
+        self.log_level = log_level
+        self.module = None
+        self.app = None
+        self.socket: Optional[socket.socket] = None
+        self.workers: Dict[int, Worker] = {}
+        self._stopping = False
+        self._restart_requested = False
+        self._report_requested = False
+
+    def preload(self):
+        """Import the application and load its heavy read-only state in the master"""
+        start = time.perf_counter()
+        self.module, self.app = load_target(self.target)
+        registry = getattr(self.module, "registry", None)
+        if registry is not None:
+            registry.preload()
+        # Objects alive now are never collected, so the collector does not write to their shared pages
+        gc.collect()
+        gc.freeze()
+        usage = memory_usage()
+        self.logger.info(
+            f"Preloaded <{self.target}> in {time.perf_counter() - start:.1f}s, master RSS {usage['rss'] / MiB:.1f} MiB"
+        )
+
+    def bind(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.host, self.port))
+        self.socket.listen(2048)
+        self.socket.set_inheritable(True)
+        self.logger.info(f"Listening on {self.host}:{self.port}")
+
+    def after_fork(self):
+        """Give the worker its own connections and signal handling"""
+        for signum in (signal.SIGHUP, signal.SIGUSR1, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+            signal.signal(signum, signal.SIG_DFL)
+        registry = getattr(self.module, "registry", None)
+        if registry is not None:
+            registry.after_fork()
+
+    def _run_worker(self, ready_fd: int):
+        self.after_fork()
+        config = uvicorn.Config(
+            self.app,
+            log_level=self.log_level,
+            timeout_graceful_shutdown=self.graceful_timeout,
+        )
+        server = uvicorn.Server(config)
+
+        def notify_ready():
+            while not server.started and not server.should_exit:
+                time.sleep(0.05)
+            os.write(ready_fd, b"1")
+            os.close(ready_fd)
+
+        threading.Thread(target=notify_ready, daemon=True).start()
+        server.run(sockets=[self.socket])
+
+    def spawn(self, index: int) -> Optional[Worker]:
+        """Fork a worker and wait until it accepts connections"""
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            code = 0
+            try:
+                self._run_worker(write_fd)
+            except BaseException:
+                logging.getLogger(self.class_name()).exception("Worker crashed")
+                code = 1
+            finally:
+                os._exit(code)
+
+        os.close(write_fd)
+        worker = self.workers[pid] = Worker(pid=pid, index=index, started_at=time.time())
+        ready, _, _ = select.select([read_fd], [], [], self.ready_timeout)
+        is_ready = bool(ready) and os.read(read_fd, 1) == b"1"
+        os.close(read_fd)
+        if not is_ready:
+            self.logger.error(f"Worker {index} <{pid}> did not become ready in {self.ready_timeout}s")
+            self.stop_worker(worker)
+            return None
+        self.logger.info(f"Worker {index} <{pid}> ready, RSS {memory_usage(pid)['rss'] / MiB:.1f} MiB")
+        return worker
+
+    def stop_worker(self, worker: Worker):
+        """Ask a worker to finish its in-flight requests and exit, kill it after the graceful timeout"""
+        try:
+            os.kill(worker.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        deadline = time.monotonic() + self.graceful_timeout
+        while time.monotonic() < deadline:
+            try:
+                pid, _ = os.waitpid(worker.pid, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid:
+                break
+            time.sleep(0.1)
+        else:
+            self.logger.warning(f"Worker {worker.index} <{worker.pid}> did not exit in time, killing it")
+            try:
+                os.kill(worker.pid, signal.SIGKILL)
+                os.waitpid(worker.pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        self.workers.pop(worker.pid, None)
+
+    def rolling_restart(self):
+        """Replace workers one at a time, starting each replacement before stopping the worker it replaces"""
+        self.logger.info("Rolling restart")
+        for worker in sorted(self.workers.values(), key=lambda w: w.index):
+            if self._stopping:
+                return
+            replacement = self.spawn(worker.index)
+            if replacement is None:
+                self.logger.error(f"Keeping worker {worker.index} <{worker.pid}>, its replacement failed to start")
+                continue
+            self.stop_worker(worker)
+        self.report_memory()
+
+    def reap(self):
+        """Respawn workers that exited on their own"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            worker = self.workers.pop(pid, None)
+            if worker is not None and not self._stopping:
+                self.logger.warning(f"Worker {worker.index} <{pid}> exited with status {status}, respawning")
+                self.spawn(worker.index)
+
+    def report_memory(self):
+        total_pss = 0
+        for worker in sorted(self.workers.values(), key=lambda w: w.index):
+            usage = memory_usage(worker.pid)
+            total_pss += usage.get("pss", usage["rss"])
+            self.logger.info(
+                f"Worker {worker.index} <{worker.pid}>: RSS {usage['rss'] / MiB:.1f} MiB, "
+                f"shared {usage.get('shared', 0) / MiB:.1f} MiB, private {usage.get('private', 0) / MiB:.1f} MiB, "
+                f"PSS {usage.get('pss', 0) / MiB:.1f} MiB"
+            )
+        master = memory_usage()
+        total_pss += master.get("pss", master["rss"])
+        self.logger.info(f"Master RSS {master['rss'] / MiB:.1f} MiB, total PSS {total_pss / MiB:.1f} MiB")
+
+    def _on_signal(self, signum, frame):
+        if signum == signal.SIGHUP:
+            self._restart_requested = True
+        elif signum == signal.SIGUSR1:
+            self._report_requested = True
+        else:
+            self._stopping = True
+
+    def run(self):
+        self.preload()
+        self.bind()
+        for signum in (signal.SIGHUP, signal.SIGUSR1, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self._on_signal)
+
+        for index in range(self.num_workers):
+            self.spawn(index)
+        self.report_memory()
+
+        last_report = time.monotonic()
+        while not self._stopping:
+            self.reap()
+            if self._restart_requested:
+                self._restart_requested = False
+                self.rolling_restart()
+            if self._report_requested or (self.rss_interval and time.monotonic() - last_report > self.rss_interval):
+                self._report_requested = False
+                last_report = time.monotonic()
+                self.report_memory()
+            time.sleep(0.5)
+
+        self.logger.info("Shutting down workers")
+        for worker in list(self.workers.values()):
+            try:
+                os.kill(worker.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for worker in list(self.workers.values()):
+            self.stop_worker(worker)
+        self.socket.close()
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Serve the chatbot with pre-forked workers sharing preloaded models")
+    parser.add_argument("target", nargs="?", default="app:app", help="ASGI app as module:attribute")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8081")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1))))
+    parser.add_argument("--ready-timeout", type=float, default=60, help="Seconds a new worker has to start")
+    parser.add_argument("--graceful-timeout", type=float, default=30, help="Seconds a worker has to finish requests")
+    parser.add_argument("--rss-interval", type=float, default=60, help="Seconds between memory reports, 0 to disable")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(process)d %(name)s %(levelname)s %(message)s")
+    PreforkServer(
+        target=args.target,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        ready_timeout=args.ready_timeout,
+        graceful_timeout=args.graceful_timeout,
+        rss_interval=args.rss_interval,
+        log_level=args.log_level,
+    ).run()
+
+
+if __name__ == "__main__":
+    main()
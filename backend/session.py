@@ -0,0 +1,145 @@
+import asyncio
+import re
+from collections import OrderedDict, deque
+from typing import AsyncIterator, List, Optional, Tuple
+
+from bot import Bot
+from common.metrics import count, timed
+from common.objects import Message, MessageTurn, messages_from_dict
+
+
+class ChatSession:
+    """
+    State of one conversation held by a long-lived connection, e.g. a WebSocket.
+
+    History is read from the backend once when the session opens, then kept up to date in memory with the
+    turns of the connection, so a message does not wait on a history read. Query embeddings of the
+    similarity search are cached, and turns are written to memory by a background task in the order they
+    were answered, so a message does not wait on the database either.
+    The anonymizer mapping lives on the bot and stays loaded while the bot is hosted.
+    """
+
+    def __init__(self, bot: Bot, conversation_id: str, embedding_cache_size: int = 256):
+        self.bot = bot
+        self.conversation_id = conversation_id
+        self.config = bot.config
+        self.logger = bot.logger
+        self.embedding_cache_size = embedding_cache_size
+        # The summary stays in every prompt, the seed turns make room for the turns of the connection
+        self._summary = ""
+        self._seed_turns: List[str] = []
+        self._turns = deque(maxlen=self.config.memory_window_size)
+        self._embeddings: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._pending: "asyncio.Queue[Optional[MessageTurn]]" = asyncio.Queue()
+        self._writer: Optional[asyncio.Task] = None
+
+    async def open(self) -> "ChatSession":
+        self._summary, self._seed_turns = await asyncio.to_thread(self._load_seed)
+        self._writer = asyncio.create_task(self._write_turns())
+        return self
+
+    async def close(self):
+        """Wait for the turns still queued to be written"""
+        if self._writer is None:
+            return
+        await self._pending.put(None)
+        await self._writer
+        self._writer = None
+
+    async def __aenter__(self) -> "ChatSession":
+        return await self.open()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    # ----------------------------------------
+    # History
+    # ----------------------------------------
+    @timed("session", "history_seed")
+    def _load_seed(self) -> Tuple[str, List[str]]:
+        """Summary and recent turns stored before the session opened, plus those still in the outbox"""
+        pending = self.bot._pending_history(self.conversation_id)
+        summarizer = self.bot.summarizer
+        if summarizer is not None:
+            state = summarizer.load_state(self.conversation_id)
+            if state is not None:
+                turns = [turn for entry in state.turns for turn in self._split_turns(entry)]
+                return summarizer.format_summary(state.summary), turns + pending
+        # Without a query memories return the recent turns only, similar turns are searched per message
+        return "", self._split_turns(self.bot.memory.load_history(self.conversation_id)) + pending
+
+    def _split_turns(self, history: str) -> List[str]:
+        """Turns of a history, each starting on a line of the human prefix"""
+        if not history:
+            return []
+        starts = re.split(rf"\n(?={re.escape(self.config.human_prefix)}: )", history)
+        return [turn for turn in starts if turn]
+
+    def _embed(self, query: str) -> List[float]:
+        embedding = self._embeddings.get(query)
+        if embedding is not None:
+            self._embeddings.move_to_end(query)
+            count("session", "embedding_cache_hit")
+            return embedding
+        memory = self.bot.memory
+        recall = getattr(memory, "recall", None)
+        embedding = recall.embedder.encode(query) if recall is not None else memory.embed(query)
+        self._embeddings[query] = embedding
+        if len(self._embeddings) > self.embedding_cache_size:
+            self._embeddings.popitem(last=False)
+        return embedding
+
+    def _similar(self, query: str) -> str:
+        memory = self.bot.memory
+        recall = getattr(memory, "recall", None)
+        if recall is not None:
+            if len(recall) == 0:
+                return ""
+            results = recall.search_vector(self._embed(query), top_k=self.config.recall_top_k)
+            return "\n".join(text for _, _, text in results)
+        if getattr(memory, "search_similar_by_embedding", None) is not None:
+            return memory.search_similar_by_embedding(self._embed(query), top_k=3)
+        return ""
+
+    def history(self, query: str = None) -> str:
+        """History given to the bot: the summary, then the last window of turns, seed turns first"""
+        room = self._turns.maxlen - len(self._turns)
+        turns = (self._seed_turns[-room:] if room > 0 else []) + list(self._turns)
+        history = "\n\n".join(part for part in (self._summary, "\n".join(turns)) if part)
+        similar = self._similar(query) if query else ""
+        return f"{similar}\n{history}" if similar and history else similar or history
+
+    # ----------------------------------------
+    # Messages
+    # ----------------------------------------
+    async def stream(self, sentence: str) -> AsyncIterator[str]:
+        """Answer chunks of a message, the turn is queued for writing once the answer is complete"""
+        message = Message(message=sentence, role=self.config.human_prefix)
+        history = await asyncio.to_thread(self.history, sentence)
+        chunks = []
+        async for chunk in self.bot.astream(message, conversation_id=self.conversation_id, history=history):
+            chunks.append(chunk)
+            yield chunk
+        turn = MessageTurn(
+            human_message=message,
+            ai_message=Message(message="".join(chunks), role=self.config.ai_prefix),
+            conversation_id=self.conversation_id
+        )
+        self._turns.append(messages_from_dict(turn.model_dump()))
+        self._pending.put_nowait(turn)
+
+    async def _write_turns(self):
+        while True:
+            turn = await self._pending.get()
+            if turn is None:
+                return
+            try:
+                await asyncio.to_thread(
+                    self.bot.persist,
+                    human_message=turn.human_message,
+                    ai_message=turn.ai_message,
+                    conversation_id=self.conversation_id
+                )
+            except Exception as e:
+                count("session", "persist_error")
+                self.logger.error(f"Could not persist a turn of conversation <{self.conversation_id}>: {e}")
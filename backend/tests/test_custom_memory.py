@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+from benchmarks.fakes import InMemoryMongoClient
+from common.config import Config
+from common.objects import Message, MessageTurn
+from memory.custom_memory import BaseCustomMongoChatbotMemory
+
+
+def make_turn(text, conversation_id="a"):
+    return MessageTurn(
+        human_message=Message(message=text, role="human"),
+        ai_message=Message(message=f"re: {text}", role="ai"),
+        conversation_id=conversation_id,
+    )
+
+
+@pytest.fixture
+def memory():
+    return BaseCustomMongoChatbotMemory(
+        config=Config(), client=InMemoryMongoClient(), session_id="s", database_name="chat",
+        collection_name="history", k=10,
+    )
+
+
+def insert_legacy(memory, text, conversation_id="a"):
+    """A row written before the migration, the turn stored as a JSON string without a sequence number"""
+    memory.collection.insert_one({
+        "SessionId": memory.session_id,
+        "ConversationId": conversation_id,
+        "History": json.dumps(make_turn(text, conversation_id).model_dump()),
+    })
+
+
+def human_messages(memory, conversation_id="a"):
+    messages, _ = memory.get_messages(conversation_id)
+    return [message["human_message"]["message"] for message in messages]
+
+
+def test_legacy_turns_are_ordered_before_new_ones(memory):
+    for text in ("old 1", "old 2", "old 3"):
+        insert_legacy(memory, text)
+    memory.add_messages([make_turn("new 1"), make_turn("new 2")])
+
+    assert memory.migrate_json_history(batch_size=2) == 3
+    assert memory.collection.count_documents({"Turn": {"$exists": False}}) == 0
+    assert memory.collection.count_documents({"History": {"$exists": True}}) == 0
+
+    memory.add_message(make_turn("new 3"))
+    assert human_messages(memory) == ["old 1", "old 2", "old 3", "new 1", "new 2", "new 3"]
+    assert [line for line in memory.load_history("a").splitlines() if line.startswith("human")] == [
+        "human: old 1", "human: old 2", "human: old 3", "human: new 1", "human: new 2", "human: new 3"
+    ]
+
+
+def test_new_turns_follow_a_conversation_with_only_legacy_turns(memory):
+    insert_legacy(memory, "old 1", conversation_id="b")
+    insert_legacy(memory, "old 2", conversation_id="b")
+
+    assert memory.migrate_json_history() == 2
+    memory.add_message(make_turn("new 1", conversation_id="b"))
+    assert human_messages(memory, "b") == ["old 1", "old 2", "new 1"]
+    # Nothing left to migrate
+    assert memory.migrate_json_history() == 0
@@ -0,0 +1,123 @@
+import asyncio
+import os
+import threading
+
+import pytest
+
+from common.outbox import DurableOutbox
+
+
+class FlakyBackend:
+    """Handler failing while `down` is set, recording the records of the writes that went through"""
+
+    def __init__(self, down: bool = True):
+        self.down = down
+        self.written = []
+        self.attempts = 0
+        self.attempted = threading.Event()
+
+    def __call__(self, records):
+        self.attempts += 1
+        self.attempted.set()
+        if self.down:
+            raise ConnectionError("backend is down")
+        self.written.extend(records)
+
+
+@pytest.fixture
+def backend():
+    return FlakyBackend()
+
+
+def make_outbox(directory, handler, name="turns"):
+    return DurableOutbox(
+        directory=str(directory), name=name, handler=handler, fsync_interval=0.01, retry_seconds=0.01,
+        max_retry_seconds=0.05,
+    )
+
+
+def test_failing_backend_leaves_records_pending(tmp_path, backend):
+    outbox = make_outbox(tmp_path, backend)
+    try:
+        outbox.append({"conversation_id": "a", "text": "first"})
+        outbox.append({"conversation_id": "a", "text": "second"})
+        assert backend.attempted.wait(timeout=5)
+        assert not outbox.flush(timeout=0.2)
+        assert [record["text"] for record in outbox.pending("a")] == ["first", "second"]
+        assert outbox.backlog > 0
+        assert backend.written == []
+    finally:
+        outbox.close(timeout=0.2)
+    # Nothing was drained, the file is kept for the next process
+    assert os.path.exists(outbox.path)
+
+
+def test_records_are_written_once_the_backend_recovers(tmp_path, backend):
+    outbox = make_outbox(tmp_path, backend)
+    try:
+        outbox.append({"conversation_id": "a", "text": "first"})
+        assert backend.attempted.wait(timeout=5)
+        backend.down = False
+        assert outbox.flush(timeout=5)
+        assert [record["text"] for record in backend.written] == ["first"]
+        assert outbox.pending("a") == []
+    finally:
+        outbox.close()
+
+
+def test_orphans_of_other_outboxes_are_not_replayed(tmp_path):
+    # Left by a dead process of an outbox named "turns-archive", not of "turns"
+    other = tmp_path / "turns-archive-123.jsonl"
+    other.write_text('{"conversation_id": "a", "text": "archived"}\n')
+    orphan = tmp_path / "turns-123.jsonl"
+    orphan.write_text('{"conversation_id": "a", "text": "orphaned"}\n')
+    backend = FlakyBackend(down=False)
+    outbox = make_outbox(tmp_path, backend)
+    try:
+        for _ in range(500):
+            if not orphan.exists():
+                break
+            threading.Event().wait(0.01)
+        assert [record["text"] for record in backend.written] == ["orphaned"]
+        assert other.exists()
+    finally:
+        outbox.close()
+
+
+@pytest.fixture
+def chat_manager(tmp_path, monkeypatch):
+    from benchmarks.fakes import FakeChatModel, InMemoryMongoClient
+    from chat import manager
+    from database.mongodb import MongodbClient
+    monkeypatch.setattr(manager.settings, "outbox_directory", str(tmp_path))
+    monkeypatch.setattr(manager.settings, "outbox_flush_timeout", 0.2)
+    monkeypatch.setattr(manager.settings, "summary_threshold", 0)
+    chat_manager = manager.ChatManager(
+        db=MongodbClient(client=InMemoryMongoClient()), model=FakeChatModel(latency=0, tokens_per_second=1e6),
+    )
+    chat_manager.outbox.retry_seconds = chat_manager.outbox.max_retry_seconds = 0.01
+    yield chat_manager
+    chat_manager.close()
+
+
+def test_clear_keeps_history_while_the_outbox_cannot_drain(chat_manager, monkeypatch):
+    backend = FlakyBackend()
+    monkeypatch.setattr(chat_manager.db, "add_conversation_messages", backend)
+    asyncio.run(chat_manager.process_message("hello", "a"))
+    assert backend.attempted.wait(timeout=5)
+    with pytest.raises(TimeoutError):
+        chat_manager.clear_history("a")
+    assert "hello" in chat_manager._pending_history("a")
+
+
+def test_cleared_history_is_not_written_back_by_the_outbox(chat_manager, monkeypatch):
+    write = chat_manager.db.add_conversation_messages
+    backend = FlakyBackend()
+    monkeypatch.setattr(chat_manager.db, "add_conversation_messages", lambda turns: (backend(turns), write(turns)))
+    asyncio.run(chat_manager.process_message("hello", "a"))
+    assert backend.attempted.wait(timeout=5)
+    backend.down = False
+    chat_manager.clear_history("a")
+    assert chat_manager.outbox.flush(timeout=5)
+    assert chat_manager._pending_history("a") == ""
+    assert chat_manager.db.get_conversation_history("a") == []
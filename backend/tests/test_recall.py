@@ -0,0 +1,112 @@
+import os
+
+import numpy as np
+import pytest
+
+from memory.recall import SemanticRecallIndex
+
+DIMENSION = 4
+
+
+def unit(i):
+    vector = np.zeros(DIMENSION, dtype=np.float32)
+    vector[i] = 1
+    return vector
+
+
+def make_index(directory=None, **kwargs):
+    return SemanticRecallIndex(session_id="s", embedder=object(), dimension=DIMENSION,
+                               directory=None if directory is None else str(directory), **kwargs)
+
+
+def texts(index, i, top_k=3):
+    return [text for _, _, text in index.search_vector(unit(i), top_k=top_k)]
+
+
+@pytest.fixture(params=["memory", "disk"])
+def index(request, tmp_path):
+    index = make_index(tmp_path if request.param == "disk" else None, initial_capacity=2)
+    yield index
+    index.close()
+
+
+def test_add_grows_past_the_initial_capacity(index):
+    index.add(["a", "a", "b", "b", "c"], ["a0", "a1", "b2", "b3", "c0"], [unit(0), unit(1), unit(2), unit(3), unit(0)])
+    assert len(index) == 5
+    assert texts(index, 2, top_k=1) == ["b2"]
+    assert sorted(texts(index, 0, top_k=2)) == ["a0", "c0"]
+
+
+def test_remove_masks_a_conversation(index):
+    index.add(["a", "b", "c", "d"], ["a0", "b0", "c0", "d0"], [unit(0), unit(1), unit(2), unit(3)])
+    index.remove("a")
+    assert len(index) == 3
+    assert "a0" not in texts(index, 0, top_k=4)
+    index.remove()
+    assert len(index) == 0
+    assert texts(index, 1) == []
+
+
+def test_compact_drops_removed_rows(index):
+    index.add(["a", "a", "b", "c"], ["a0", "a1", "b0", "c0"], [unit(0), unit(1), unit(2), unit(3)])
+    # Half the rows are removed, past compact_ratio, so the remove compacts
+    index.remove("a")
+    assert index._size == 2
+    assert index._deleted_count == 0
+    assert texts(index, 2, top_k=1) == ["b0"]
+    assert texts(index, 3, top_k=1) == ["c0"]
+
+
+def test_reopen_keeps_turns_and_removals(tmp_path):
+    index = make_index(tmp_path, compact_ratio=1)
+    index.add(["a", "b", "c"], ["a0", "b0", "c0"], [unit(0), unit(1), unit(2)])
+    index.remove("b")
+    index.add(["d"], ["d0"], [unit(3)])
+    index.close()
+
+    reopened = make_index(tmp_path)
+    try:
+        assert len(reopened) == 3
+        assert texts(reopened, 3, top_k=1) == ["d0"]
+        assert "b0" not in texts(reopened, 1, top_k=4)
+    finally:
+        reopened.close()
+
+
+def test_torn_last_line_is_ignored_on_reopen(tmp_path):
+    index = make_index(tmp_path)
+    index.add(["a"], ["a0"], [unit(0)])
+    log_path = index._log_path
+    index.close()
+    with open(log_path, "a") as f:
+        f.write('{"conversation_id": "b", "te')
+
+    reopened = make_index(tmp_path)
+    try:
+        assert len(reopened) == 1
+        assert texts(reopened, 0) == ["a0"]
+    finally:
+        reopened.close()
+
+
+def test_files_of_a_dead_process_are_merged(tmp_path):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            child = make_index(tmp_path)
+            child.add(["a", "b"], ["child a", "child b"], [unit(0), unit(1)])
+            child.close()
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+    assert os.path.exists(tmp_path / f"s@{pid}.jsonl")
+
+    index = make_index(tmp_path)
+    try:
+        index.add(["c"], ["parent c"], [unit(2)])
+        assert len(index) == 3
+        assert texts(index, 1, top_k=1) == ["child b"]
+        assert not os.path.exists(tmp_path / f"s@{pid}.jsonl")
+        assert [name for name in os.listdir(tmp_path) if name.startswith(f"s@{pid}.")] == []
+    finally:
+        index.close()
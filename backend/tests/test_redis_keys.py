@@ -0,0 +1,63 @@
+import json
+
+from benchmarks.fakes import InMemoryRedis
+from common.config import Config
+from common.objects import Message, MessageTurn
+from memory.redis_memory import BaseCustomRedisChatbotMemory
+from migrations.redis_keys import migrate_keys
+
+
+def turn_json(text, conversation_id):
+    return json.dumps(MessageTurn(
+        human_message=Message(message=text, role="human"),
+        ai_message=Message(message=f"re: {text}", role="ai"),
+        conversation_id=conversation_id,
+    ).model_dump())
+
+
+def make_memory():
+    return BaseCustomRedisChatbotMemory(config=Config(), session_id="s", client=InMemoryRedis())
+
+
+def test_legacy_keys_are_renamed_and_indexed():
+    memory = make_memory()
+    client = memory.client
+    client.rpush("a", turn_json("old a", "a"))
+    client.expire("a", 60)
+    client.rpush("b", turn_json("old b", "b"))
+    # Neither is the history of the conversation it is named after
+    client.rpush("queue", "job")
+    client.set("c", turn_json("old c", "c"))
+
+    stats = migrate_keys(memory, batch_size=2)
+
+    assert stats == {"scanned": 4, "migrated": 2, "conflicts": 0}
+    assert client.lrange(memory.conversation_key("a"), 0, -1) == [turn_json("old a", "a")]
+    assert client.ttl(memory.conversation_key("a")) > 0
+    assert not client.exists("a", "b")
+    assert client.exists("queue", "c") == 2
+    assert client.smembers(memory.index_key()) == {"a", "b"}
+
+
+def test_renamenx_conflicts_keep_the_namespaced_history():
+    memory = make_memory()
+    client = memory.client
+    client.rpush("a", turn_json("old a", "a"))
+    client.rpush(memory.conversation_key("a"), turn_json("new a", "a"))
+
+    stats = migrate_keys(memory)
+
+    assert stats["conflicts"] == 1
+    assert stats["migrated"] == 0
+    assert client.lrange(memory.conversation_key("a"), 0, -1) == [turn_json("new a", "a")]
+    # The legacy key is left in place for an operator to merge by hand
+    assert client.lrange("a", 0, -1) == [turn_json("old a", "a")]
+
+
+def test_dry_run_renames_nothing():
+    memory = make_memory()
+    memory.client.rpush("a", turn_json("old a", "a"))
+
+    assert migrate_keys(memory, dry_run=True)["migrated"] == 1
+    assert memory.client.exists("a") == 1
+    assert memory.client.exists(memory.conversation_key("a")) == 0
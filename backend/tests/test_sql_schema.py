@@ -0,0 +1,60 @@
+from sqlalchemy import MetaData, create_engine, inspect
+
+from benchmarks.fakes import FakeEmbedder
+from common.config import Config
+from common.objects import ChatMemory, Message, MessageTurn
+from memory.mysql_memory import BaseCustomSQLChatbotMemory
+from memory.postgres_memory import BaseCustomPostgresChatbotMemory
+from migrations import sql_schema
+
+
+def make_turn(text, conversation_id="a"):
+    return MessageTurn(
+        human_message=Message(message=text, role="human"),
+        ai_message=Message(message=f"re: {text}", role="ai"),
+        conversation_id=conversation_id,
+    )
+
+
+def migrated_engine(tmp_path, build_table):
+    """SQLite engine with the chat_memory table a migration builder creates"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'chat.db'}")
+    metadata = MetaData()
+    build_table(metadata)
+    metadata.create_all(engine)
+    return engine
+
+
+def test_model_columns_exist_in_every_migration(tmp_path):
+    mapped = set(ChatMemory.__table__.columns.keys())
+    for build_table in (sql_schema.mysql_chat_memory, sql_schema.postgres_chat_memory):
+        assert mapped <= set(build_table(MetaData()).columns.keys())
+
+
+def test_sql_memory_reads_and_writes_a_migrated_table(tmp_path):
+    engine = migrated_engine(tmp_path, sql_schema.mysql_chat_memory)
+    memory = BaseCustomSQLChatbotMemory(config=Config(), engine=engine, session_id="s")
+    memory.add_message(make_turn("first"))
+    memory.add_messages([make_turn("second"), make_turn("third")])
+
+    history = memory.load_history("a")
+    assert [line for line in history.splitlines() if line.startswith("human")] == [
+        "human: first", "human: second", "human: third"
+    ]
+    assert len(memory.load_histories(["a"])["a"].splitlines()) == 6
+    messages, _ = memory.get_messages("a")
+    assert len(messages) == 3
+
+
+def test_postgres_memory_writes_a_migrated_table(tmp_path):
+    engine = migrated_engine(tmp_path, sql_schema.postgres_chat_memory)
+    assert "EmbeddingHalf" not in {column["name"] for column in inspect(engine).get_columns("chat_memory")}
+    memory = BaseCustomPostgresChatbotMemory(
+        config=Config(embedding_storage="vector"), engine=engine, session_id="s",
+        embedder=FakeEmbedder(latency=0),
+    )
+    memory.add_message(make_turn("first"))
+    memory.add_messages([make_turn("second")])
+
+    messages, _ = memory.get_messages("a")
+    assert len(messages) == 2
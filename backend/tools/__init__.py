@@ -1 +1,3 @@
-from .serp import CustomSearchTool
+from .executor import SharedExecutor, shutdown_tool_executors
+from .serp import CustomSearchTool, DuckDuckGoTransport, SearchCache, SearchTransport
+from .timeout import TimeoutTool
@@ -0,0 +1,47 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+
+class SharedExecutor:
+    """
+    Thread pool shared by every instance of a tool, built on first use. A forked worker gets its own, the
+    threads of the parent's do not exist in the child.
+    """
+
+    def __init__(self, max_workers: int, thread_name_prefix: str):
+        self.max_workers = max_workers
+        self.thread_name_prefix = thread_name_prefix
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        _executors.append(self)
+
+    def get(self) -> ThreadPoolExecutor:
+        executor = self._executor
+        if executor is not None and self._pid == os.getpid():
+            return executor
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix=self.thread_name_prefix
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def shutdown(self, wait: bool = False):
+        """Cancel the queued calls and stop the threads once the running ones finish, the next call builds a new pool"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None and self._pid == os.getpid():
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+
+_executors: List[SharedExecutor] = []
+
+
+def shutdown_tool_executors(wait: bool = False):
+    """Stop the thread pools of every tool, e.g. when the application stops. A call past its deadline is not waited for"""
+    for executor in _executors:
+        executor.shutdown(wait=wait)
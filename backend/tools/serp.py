@@ -1,27 +1,168 @@
-from typing import Optional, ClassVar
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Optional, ClassVar, List, Dict, Any, Protocol
+from pydantic import Field, PrivateAttr
 from langchain.tools import BaseTool
-from langchain.callbacks.manager import CallbackManagerForToolRun
+from langchain.callbacks.manager import CallbackManagerForToolRun, AsyncCallbackManagerForToolRun
 from duckduckgo_search import DDGS
 
+from common.metrics import count, track
+from tools.executor import SharedExecutor
+
+# Searches of every search tool, a search past its deadline keeps its thread until the transport gives up
+_search_executor = SharedExecutor(max_workers=8, thread_name_prefix="search")
+
+
+class SearchTransport(Protocol):
+    """Backend that performs the actual web search"""
+
+    def search(self, query: str, max_results: int) -> List[Dict[str, Any]]:
+        ...
+
+
+class DuckDuckGoTransport:
+    """DuckDuckGo transport reusing one DDGS session per worker thread"""
+
+    def __init__(self, timeout: float = 10):
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def search(self, query: str, max_results: int) -> List[Dict[str, Any]]:
+        ddgs = getattr(self._local, "ddgs", None)
+        if ddgs is None:
+            ddgs = self._local.ddgs = DDGS(timeout=self.timeout)
+        return ddgs.text(query, max_results=max_results) or []
+
+
+class SearchCache:
+    """Thread-safe TTL + LRU cache of formatted search results"""
+
+    def __init__(self, max_size: int = 256, ttl_seconds: float = 600):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._items: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
 
 class CustomSearchTool(BaseTool):
     name: ClassVar[str] = "custom_search"
     description: ClassVar[str] = "Useful for answering questions about current events, news, facts, or general knowledge."
 
+    transport: Any = Field(default=None, description="Search transport, defaults to DuckDuckGo")
+    max_results: int = 5
+    timeout: float = Field(default=10, description="Hard deadline of one search in seconds")
+    cache_ttl: float = 600
+    cache_size: int = 256
+
+    _cache: SearchCache = PrivateAttr()
+    _in_flight: Dict[str, Future] = PrivateAttr(default_factory=dict)
+    _in_flight_lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if self.transport is None:
+            self.transport = DuckDuckGoTransport(timeout=self.timeout)
+        self._cache = SearchCache(max_size=self.cache_size, ttl_seconds=self.cache_ttl)
+
+    @staticmethod
+    def format_results(results: List[Dict[str, Any]]) -> str:
+        if not results:
+            return "No results found."
+        return "\n\n".join(
+            f"Title: {r['title']}\nSnippet: {r['body']}\nURL: {r['href']}"
+            for r in results
+        )
+
+    def _search(self, query: str, key: str) -> str:
+        with track("search_tool", "search"):
+            results = self.transport.search(query, self.max_results)
+        output = self.format_results(results)
+        self._cache.set(key, output)
+        return output
+
+    def _release(self, key: str, future: Future):
+        with self._in_flight_lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+    def _submit(self, query: str, key: str) -> Future:
+        """Start a search, or join the one already running for the same query"""
+        with self._in_flight_lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                count("search_tool", "in_flight_dedup")
+            else:
+                future = _search_executor.get().submit(self._search, query, key)
+                self._in_flight[key] = future
+                future.add_done_callback(lambda f: self._release(key, f))
+            return future
+
     def _run(
         self, query: str, run_manager: Optional[CallbackManagerForToolRun] = None
     ) -> str:
         """Use DuckDuckGo to search the web."""
+        key = normalize_query(query)
+        cached = self._cache.get(key)
+        if cached is not None:
+            count("search_tool", "cache_hit")
+            return cached
+        count("search_tool", "cache_miss")
+        try:
+            return self._submit(query, key).result(timeout=self.timeout)
+        except FutureTimeoutError:
+            count("search_tool", "timeout")
+            return f"Search failed: timed out after {self.timeout}s"
+        except Exception as e:
+            return f"Search failed: {str(e)}"
+
+    async def _arun(
+        self, query: str, run_manager: Optional[AsyncCallbackManagerForToolRun] = None
+    ) -> str:
+        """Use DuckDuckGo to search the web without blocking the event loop."""
+        key = normalize_query(query)
+        cached = self._cache.get(key)
+        if cached is not None:
+            count("search_tool", "cache_hit")
+            return cached
+        count("search_tool", "cache_miss")
         try:
-            with DDGS() as ddgs:
-                results = ddgs.text(query, max_results=5)
-                if not results:
-                    return "No results found."
-
-                formatted_results = "\n\n".join(
-                    f"Title: {r['title']}\nSnippet: {r['body']}\nURL: {r['href']}"
-                    for r in results
-                )
-                return formatted_results
+            # Shield so a timed out caller does not cancel the search shared with other callers
+            future = asyncio.wrap_future(self._submit(query, key))
+            return await asyncio.wait_for(asyncio.shield(future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            count("search_tool", "timeout")
+            return f"Search failed: timed out after {self.timeout}s"
         except Exception as e:
-            return f"Search failed: {str(e)}"
\ No newline at end of file
+            return f"Search failed: {str(e)}"
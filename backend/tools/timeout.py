@@ -0,0 +1,52 @@
+import asyncio
+import logging
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Optional
+from langchain.tools import BaseTool
+from langchain.callbacks.manager import CallbackManagerForToolRun, AsyncCallbackManagerForToolRun
+
+from tools.executor import SharedExecutor
+
+logger = logging.getLogger(__name__)
+
+# Sync calls of every wrapped tool run here so the caller can stop waiting, a call past its deadline finishes
+# in the background. Separate from the search pool, a wrapped search waits on it from one of these threads
+_tool_executor = SharedExecutor(max_workers=32, thread_name_prefix="tool")
+
+
+class TimeoutTool(BaseTool):
+    """Wraps a tool so that a single invocation can not run longer than `timeout` seconds"""
+    name: str
+    description: str
+    tool: BaseTool
+    timeout: float = 10
+
+    @classmethod
+    def wrap(cls, tool: BaseTool, timeout: float) -> "TimeoutTool":
+        return cls(
+            name=tool.name,
+            description=tool.description,
+            tool=tool,
+            timeout=timeout,
+            args_schema=tool.get_input_schema(),
+        )
+
+    def _timeout_message(self) -> str:
+        return f"Tool {self.name} failed: timed out after {self.timeout}s"
+
+    def _run(self, *args: Any, run_manager: Optional[CallbackManagerForToolRun] = None, **kwargs: Any) -> str:
+        future = _tool_executor.get().submit(self.tool.invoke, kwargs or args[0])
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            logger.warning(self._timeout_message())
+            return self._timeout_message()
+
+    async def _arun(
+        self, *args: Any, run_manager: Optional[AsyncCallbackManagerForToolRun] = None, **kwargs: Any
+    ) -> str:
+        try:
+            return await asyncio.wait_for(self.tool.ainvoke(kwargs or args[0]), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            logger.warning(self._timeout_message())
+            return self._timeout_message()
@@ -1,31 +1,166 @@
+import gc
+import threading
+import time
 import langdetect
 from typing import Dict, Any, Optional
 from langchain_experimental.data_anonymizer import PresidioReversibleAnonymizer
+from langchain_experimental.data_anonymizer.deanonymizer_matching_strategies import exact_matching_strategy
 from langchain_core.runnables import RunnableLambda
 
 from common.config import BaseObject, Config
-from common.constants import ANONYMIZED_FIELDS, NLP_CONFIG
+from common.constants import ANONYMIZED_FIELDS, NLP_MODELS
+from common.metrics import timed, observe
+from utils.process import rss_bytes
 
 
 class BotAnonymizer(BaseObject):
     """
     Anonymizer class to handle PII data in chat messages
-    Uses Presidio for anonymization and de-anonymization
+    Uses Presidio for anonymization and de-anonymization.
+    Each language pipeline is loaded on first use and can be unloaded when idle.
     """
     def __init__(self, config: Config = None):
         super(BotAnonymizer, self).__init__()
         self.config = config if config is not None else Config()
-        self._anonymizer = PresidioReversibleAnonymizer(languages_config=NLP_CONFIG)
-        # Custom entities to anonymize can be added here
-        self._anonymizer.add_recognizer_for_entities(ANONYMIZED_FIELDS)
+        self._anonymizers: Dict[str, PresidioReversibleAnonymizer] = {}
+        self._last_used: Dict[str, float] = {}
+        self._load_stats: Dict[str, Dict[str, Any]] = {}
+        # Mappings of unloaded pipelines are kept so earlier responses can still be de-anonymized
+        self._retained_mapping: Dict[str, Dict[str, str]] = {}
+        # Calls inside anonymize() per language, a pipeline in use is not unloaded
+        self._in_use: Dict[str, int] = {}
+        self._lock = threading.Lock()
 
     @property
-    def anonymizer(self):
-        return self._anonymizer
+    def supported_lang(self):
+        return list(NLP_MODELS.keys())
+
+    def model_name(self, language: str) -> str:
+        """Resolve the spaCy pipeline configured for a language"""
+        models = NLP_MODELS[language]
+        size = self.config.anonymizer_model_sizes.get(language)
+        if size in models:
+            return models[size]
+        # Sizes may also be given as a full pipeline name
+        if size:
+            return size
+        return next(iter(models.values()))
+
+    def get_language_anonymizer(self, language: str) -> PresidioReversibleAnonymizer:
+        """Return the anonymizer of a language, loading its pipeline on first use"""
+        self._last_used[language] = time.monotonic()
+        anonymizer = self._anonymizers.get(language)
+        if anonymizer is not None:
+            return anonymizer
+
+        with self._lock:
+            anonymizer = self._anonymizers.get(language)
+            if anonymizer is not None:
+                return anonymizer
+
+            model_name = self.model_name(language)
+            rss_before = rss_bytes()
+            start = time.perf_counter()
+            anonymizer = PresidioReversibleAnonymizer(languages_config={
+                "nlp_engine_name": "spacy",
+                "models": [{"lang_code": language, "model_name": model_name}],
+            })
+            # Custom entities to anonymize can be added here
+            anonymizer.add_recognizer_for_entities(ANONYMIZED_FIELDS)
+            load_seconds = time.perf_counter() - start
+            observe("anonymizer", f"load_pipeline_{language}", load_seconds)
+            rss_delta = rss_bytes() - rss_before
+
+            self._anonymizers[language] = anonymizer
+            self._load_stats[language] = {
+                "model_name": model_name,
+                "load_seconds": load_seconds,
+                "rss_delta_bytes": rss_delta,
+            }
+            self.logger.info(
+                f"Loaded NLP pipeline <{model_name}> for language '{language}' "
+                f"in {load_seconds:.2f}s, RSS +{rss_delta / (1024 * 1024):.1f} MiB"
+            )
+            return anonymizer
+
+    def preload(self):
+        """Load the pipelines of every supported language, e.g. before forking workers"""
+        for language in self.supported_lang:
+            self.get_language_anonymizer(language)
+
+    def _acquire(self, language: str) -> PresidioReversibleAnonymizer:
+        """The anonymizer of a language, marked in use until `_release`"""
+        while True:
+            anonymizer = self.get_language_anonymizer(language)
+            with self._lock:
+                # Unloaded between the lookup and here, load it again
+                if self._anonymizers.get(language) is anonymizer:
+                    self._in_use[language] = self._in_use.get(language, 0) + 1
+                    return anonymizer
+
+    def _release(self, language: str):
+        with self._lock:
+            self._in_use[language] -= 1
+
+    def unload(self, language: str):
+        """Drop the pipeline of a language, keeping its de-anonymizer mapping"""
+        with self._lock:
+            if self._in_use.get(language):
+                # Entities added by the running call would be missing from the copied mapping
+                return
+            anonymizer = self._anonymizers.pop(language, None)
+            if anonymizer is None:
+                return
+            for entity_type, mapping in anonymizer.deanonymizer_mapping.items():
+                self._retained_mapping.setdefault(entity_type, {}).update(mapping)
+            rss_before = rss_bytes()
+            del anonymizer
+            gc.collect()
+            freed = rss_before - rss_bytes()
+            self.logger.info(f"Unloaded NLP pipeline for language '{language}', RSS -{freed / (1024 * 1024):.1f} MiB")
+
+    def unload_idle(self):
+        """Unload every pipeline that has been idle longer than `anonymizer_idle_seconds`"""
+        idle_seconds = self.config.anonymizer_idle_seconds
+        if idle_seconds is None:
+            return
+        now = time.monotonic()
+        for language in list(self._anonymizers):
+            if now - self._last_used.get(language, now) > idle_seconds:
+                self.unload(language)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Memory footprint and first-use latency of each language pipeline"""
+        return {
+            language: {
+                "model_name": self.model_name(language),
+                "loaded": language in self._anonymizers,
+                **self._load_stats.get(language, {}),
+            }
+            for language in self.supported_lang
+        }
 
     @property
-    def supported_lang(self):
-        return ["vi", "en"]
+    def deanonymizer_mapping(self) -> Dict[str, Dict[str, str]]:
+        mapping = {entity_type: dict(values) for entity_type, values in self._retained_mapping.items()}
+        for anonymizer in list(self._anonymizers.values()):
+            for entity_type, values in anonymizer.deanonymizer_mapping.items():
+                mapping.setdefault(entity_type, {}).update(values)
+        return mapping
+
+    @timed("anonymizer", "anonymize")
+    def anonymize(self, text: str, language: Optional[str] = None) -> str:
+        self.unload_idle()
+        language = language or "en"
+        anonymizer = self._acquire(language)
+        try:
+            return anonymizer.anonymize(text, language)
+        finally:
+            self._release(language)
+
+    @timed("anonymizer", "deanonymize")
+    def deanonymize(self, text: str) -> str:
+        return exact_matching_strategy(text, self.deanonymizer_mapping)
 
     def _detect_lang(self, input_dict: Dict[str, Any]) -> Dict[str, Any]:
         """Detect the language of the input text"""
@@ -39,7 +174,7 @@ class BotAnonymizer(BaseObject):
         except Exception as e:
             self.logger.error(f"Error detecting language: {e}")
             language = "en"  # Default to English if detection fails
-            
+
         return {"language": language, **input_dict}
 
     def anonymize_func(self, input_dict: Dict[str, Any]) -> Dict[str, Any]:
@@ -51,22 +186,22 @@ class BotAnonymizer(BaseObject):
                 "history": input_dict.get("history", ""),
                 "agent_scratchpad": input_dict.get("agent_scratchpad", "")
             }
-            
+
         # Anonymize user input
-        anonymized_input = self.anonymizer.anonymize(input_dict["input"], language)
-        
+        anonymized_input = self.anonymize(input_dict["input"], language)
+
         # Anonymize conversation history if available
         history = input_dict.get("history", "")
         anonymized_history = ""
         if history:
-            anonymized_history = self.anonymizer.anonymize(history, language)
-            
+            anonymized_history = self.anonymize(history, language)
+
         # Anonymize agent scratchpad if available
         agent_scratchpad = input_dict.get("agent_scratchpad", "")
         anonymized_scratchpad = ""
         if agent_scratchpad:
-            anonymized_scratchpad = self.anonymizer.anonymize(agent_scratchpad, language)
-            
+            anonymized_scratchpad = self.anonymize(agent_scratchpad, language)
+
         return {
             "input": anonymized_input,
             "history": anonymized_history,
@@ -0,0 +1,34 @@
+import os
+import resource
+from typing import Dict, Union
+
+
+def rss_bytes(pid: Union[int, str] = "self") -> int:
+    """Resident set size of a process, falls back to peak RSS of this process where /proc is unavailable"""
+    try:
+        with open(f"/proc/{pid}/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        if pid != "self":
+            return 0
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def memory_usage(pid: Union[int, str] = "self") -> Dict[str, int]:
+    """
+    RSS of a process split into pages shared with other processes and private ones.
+    PSS charges each shared page proportionally, so the PSS of all workers adds up to their real footprint.
+    """
+    usage = {"rss": rss_bytes(pid)}
+    fields = {"Pss:": "pss", "Shared_Clean:": "shared", "Shared_Dirty:": "shared",
+              "Private_Clean:": "private", "Private_Dirty:": "private"}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0] in fields:
+                    key = fields[parts[0]]
+                    usage[key] = usage.get(key, 0) + int(parts[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return usage